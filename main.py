@@ -3,18 +3,18 @@ WhatsApp Bot per Centri Estetici - Entry Point
 Multi-tenant bot collegato a Supabase con Gemini AI
 """
 
+import asyncio
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 
-from dotenv import load_dotenv
 from fastapi import FastAPI
 
+from src.env import load_env_once
+
 # Load environment variables
-load_dotenv("config/.env")
-load_dotenv("config/.env.local")
-load_dotenv(".env")
-load_dotenv(".env.local")
+load_env_once()
 
 # Configure logging
 log_level = os.getenv("LOG_LEVEL", "INFO").upper()
@@ -50,11 +50,34 @@ else:
     logger.info("Sentry non configurato (SENTRY_DSN non impostato)")
 
 
+def _register_routes(app: FastAPI) -> None:
+    """Include the webhook router once, even if lifespan runs again."""
+    if getattr(app.state, "routes_registered", False):
+        return
+    from src.webhook_handler import router as webhook_router
+    app.include_router(webhook_router)
+    app.state.routes_registered = True
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Startup and shutdown events."""
     logger.info("Bot WhatsApp avviato")
 
+    # Sync supabase-py queries run via asyncio.to_thread: size the default
+    # executor to the sync connection pool instead of min(32, cpu + 4)
+    from src.supabase_client import SYNC_QUERY_WORKERS
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=SYNC_QUERY_WORKERS, thread_name_prefix="sb-query")
+    )
+
+    # Register webhook routes (deferred: pulls in Gemini/Supabase/WhatsApp clients)
+    _register_routes(app)
+
+    # Start batched message logging
+    from src import message_logger
+    message_logger.start()
+
     # Start scheduler
     from src.scheduler import start_scheduler, stop_scheduler
     start_scheduler()
@@ -63,6 +86,14 @@ async def lifespan(app: FastAPI):
     yield
 
     stop_scheduler()
+
+    from src.supabase_client import close_async_supabase
+    from src.utils import drain_background_tasks
+    from src.whatsapp_api import close_whatsapp_client
+    await message_logger.stop()
+    await drain_background_tasks()
+    await close_async_supabase()
+    await close_whatsapp_client()
     logger.info("Bot WhatsApp fermato")
 
 
@@ -72,10 +103,6 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
-# Register webhook routes
-from src.webhook_handler import router as webhook_router
-app.include_router(webhook_router)
-
 
 @app.get("/health")
 async def health_check():
@@ -0,0 +1,72 @@
+-- ================================================================
+-- Migration 004: Single round-trip client lookup/create
+--
+-- Changes:
+-- 1. Unique index on clients (tenant_id, whatsapp_phone) so the upsert
+--    can target it with ON CONFLICT
+-- 2. upsert_wa_client: finds the client by whatsapp_phone, then by phone
+--    (adopting it whatever its whatsapp_phone, like the Python lookup),
+--    otherwise creates it — lookup + create + touch in one call
+--
+-- HOW TO APPLY:
+-- 1. Open Supabase Dashboard > SQL Editor
+-- 2. Paste this entire file and run it
+--    (the index fails if duplicate (tenant_id, whatsapp_phone) rows exist:
+--     merge them first)
+-- 3. Verify in Database > Functions that upsert_wa_client exists
+-- ================================================================
+
+CREATE UNIQUE INDEX IF NOT EXISTS clients_tenant_whatsapp_phone_key
+    ON clients (tenant_id, whatsapp_phone);
+
+
+CREATE OR REPLACE FUNCTION upsert_wa_client(
+    p_tenant_id UUID,
+    p_phone TEXT,
+    p_name TEXT DEFAULT NULL
+)
+RETURNS SETOF clients
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    -- Known WhatsApp client: touch updated_at
+    RETURN QUERY
+    UPDATE clients
+    SET updated_at = NOW()
+    WHERE tenant_id = p_tenant_id
+      AND whatsapp_phone = p_phone
+    RETURNING *;
+    IF FOUND THEN
+        RETURN;
+    END IF;
+
+    -- Client known by phone (e.g. created from the dashboard): adopt it,
+    -- filling whatsapp_phone / whatsapp_name only when missing
+    RETURN QUERY
+    UPDATE clients
+    SET whatsapp_phone = COALESCE(NULLIF(whatsapp_phone, ''), p_phone),
+        whatsapp_name = COALESCE(NULLIF(whatsapp_name, ''), p_name),
+        ultima_interazione_wa = NOW()
+    WHERE id = (
+        SELECT id FROM clients
+        WHERE tenant_id = p_tenant_id
+          AND phone = p_phone
+        LIMIT 1
+    )
+    RETURNING *;
+    IF FOUND THEN
+        RETURN;
+    END IF;
+
+    -- New client: create it (ON CONFLICT covers a concurrent first message)
+    RETURN QUERY
+    INSERT INTO clients (
+        tenant_id, whatsapp_phone, phone, name, whatsapp_name, consent_wa
+    ) VALUES (
+        p_tenant_id, p_phone, p_phone, '', COALESCE(p_name, ''), TRUE
+    )
+    ON CONFLICT (tenant_id, whatsapp_phone) DO UPDATE
+    SET updated_at = NOW()
+    RETURNING *;
+END;
+$$;
@@ -0,0 +1,48 @@
+-- ================================================================
+-- Migration 005: Log a WhatsApp message in a single transaction
+--
+-- Changes:
+-- 1. log_wa_message: inserts into whatsapp_messages and bumps the
+--    conversation counters (last_message_at, message_count,
+--    bot_handled_count) server-side, in one round-trip
+--
+-- HOW TO APPLY:
+-- 1. Open Supabase Dashboard > SQL Editor
+-- 2. Paste this entire file and run it
+-- 3. Verify in Database > Functions that log_wa_message exists
+-- ================================================================
+
+CREATE OR REPLACE FUNCTION log_wa_message(
+    p_tenant_id UUID,
+    p_client_id UUID,
+    p_direction TEXT,
+    p_from_number TEXT,
+    p_to_number TEXT,
+    p_content TEXT,
+    p_wa_message_id TEXT DEFAULT NULL,
+    p_conversation_id UUID DEFAULT NULL,
+    p_handled_by TEXT DEFAULT 'bot'
+)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO whatsapp_messages (
+        tenant_id, client_id, direction, from_number, to_number,
+        message_type, content, wa_message_id, handled_by
+    ) VALUES (
+        p_tenant_id, p_client_id, p_direction, p_from_number, p_to_number,
+        'text', p_content, p_wa_message_id, p_handled_by
+    );
+
+    IF p_conversation_id IS NOT NULL THEN
+        UPDATE whatsapp_conversations
+        SET last_message_at = NOW(),
+            updated_at = NOW(),
+            message_count = COALESCE(message_count, 0) + 1,
+            bot_handled_count = COALESCE(bot_handled_count, 0)
+                + CASE WHEN p_direction = 'outbound' AND p_handled_by = 'bot' THEN 1 ELSE 0 END
+        WHERE id = p_conversation_id;
+    END IF;
+END;
+$$;
@@ -0,0 +1,53 @@
+-- ================================================================
+-- Migration 006: Batch message logging
+--
+-- Changes:
+-- 1. log_wa_messages: inserts a batch of messages (JSON array) and bumps
+--    the counters of every touched conversation with one grouped UPDATE.
+--    Used by src/message_logger.py, which flushes queued messages.
+--
+-- HOW TO APPLY:
+-- 1. Open Supabase Dashboard > SQL Editor
+-- 2. Paste this entire file and run it
+-- 3. Verify in Database > Functions that log_wa_messages exists
+-- ================================================================
+
+CREATE OR REPLACE FUNCTION log_wa_messages(p_messages JSONB)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO whatsapp_messages (
+        tenant_id, client_id, direction, from_number, to_number,
+        message_type, content, wa_message_id, handled_by, created_at
+    )
+    SELECT
+        m.tenant_id, m.client_id, m.direction, m.from_number, m.to_number,
+        'text', m.content, m.wa_message_id, m.handled_by,
+        COALESCE(m.created_at, NOW())
+    FROM jsonb_to_recordset(p_messages) AS m(
+        tenant_id UUID, client_id UUID, direction TEXT, from_number TEXT,
+        to_number TEXT, content TEXT, wa_message_id TEXT, handled_by TEXT,
+        created_at TIMESTAMPTZ
+    );
+
+    UPDATE whatsapp_conversations c
+    SET last_message_at = v.last_at,
+        updated_at = NOW(),
+        message_count = COALESCE(c.message_count, 0) + v.n,
+        bot_handled_count = COALESCE(c.bot_handled_count, 0) + v.bot_n
+    FROM (
+        SELECT
+            m.conversation_id,
+            MAX(COALESCE(m.created_at, NOW())) AS last_at,
+            COUNT(*) AS n,
+            COUNT(*) FILTER (WHERE m.direction = 'outbound' AND m.handled_by = 'bot') AS bot_n
+        FROM jsonb_to_recordset(p_messages) AS m(
+            conversation_id UUID, direction TEXT, handled_by TEXT, created_at TIMESTAMPTZ
+        )
+        WHERE m.conversation_id IS NOT NULL
+        GROUP BY m.conversation_id
+    ) v
+    WHERE c.id = v.conversation_id;
+END;
+$$;
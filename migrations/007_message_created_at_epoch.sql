@@ -0,0 +1,24 @@
+-- ================================================================
+-- Migration 007: created_at as epoch seconds on whatsapp_messages
+--
+-- Changes:
+-- 1. Computed column created_at_epoch (PostgREST exposes functions that
+--    take the row type as selectable columns). Lets the bot compare
+--    plain floats for session-gap detection instead of parsing ISO strings.
+--
+-- Superseded by migration 008 (get_session_history), which drops this
+-- function: don't apply it on new databases.
+--
+-- HOW TO APPLY:
+-- 1. Open Supabase Dashboard > SQL Editor
+-- 2. Paste this entire file and run it
+-- 3. Verify: GET /rest/v1/whatsapp_messages?select=created_at_epoch&limit=1
+-- ================================================================
+
+CREATE OR REPLACE FUNCTION created_at_epoch(whatsapp_messages)
+RETURNS DOUBLE PRECISION
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT EXTRACT(EPOCH FROM $1.created_at)::DOUBLE PRECISION;
+$$;
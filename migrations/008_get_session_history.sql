@@ -0,0 +1,65 @@
+-- ================================================================
+-- Migration 008: Session history computed server-side
+--
+-- Changes:
+-- 1. get_session_history: returns the last p_limit messages of a client,
+--    cut at the first gap > 2 hours (LAG over created_at), already in
+--    chronological order. Only current-session rows cross the wire.
+-- 2. Drops created_at_epoch (migration 007): the legacy history path
+--    measures the gap from created_at, nothing selects it anymore
+--
+-- HOW TO APPLY:
+-- 1. Open Supabase Dashboard > SQL Editor
+-- 2. Paste this entire file and run it
+-- 3. Verify in Database > Functions that get_session_history exists
+--    and created_at_epoch is gone
+-- ================================================================
+
+CREATE OR REPLACE FUNCTION get_session_history(
+    p_tenant_id UUID,
+    p_client_id UUID DEFAULT NULL,
+    p_client_phone TEXT DEFAULT NULL,
+    p_limit INTEGER DEFAULT 10
+)
+RETURNS TABLE(
+    direction TEXT,
+    content TEXT,
+    created_at TIMESTAMPTZ
+)
+LANGUAGE sql
+STABLE
+AS $$
+    WITH recent AS (
+        SELECT m.direction, m.content, m.created_at
+        FROM whatsapp_messages m
+        WHERE m.tenant_id = p_tenant_id
+          AND CASE
+                WHEN p_client_id IS NOT NULL THEN m.client_id = p_client_id
+                ELSE m.from_number = p_client_phone
+              END
+        ORDER BY m.created_at DESC
+        LIMIT p_limit
+    ),
+    gaps AS (
+        SELECT
+            r.direction,
+            r.content,
+            r.created_at,
+            ROW_NUMBER() OVER (ORDER BY r.created_at DESC) AS rn,
+            LAG(r.created_at) OVER (ORDER BY r.created_at DESC) - r.created_at AS gap
+        FROM recent r
+    ),
+    cut AS (
+        SELECT MIN(g.rn) AS first_gap_rn
+        FROM gaps g
+        WHERE g.gap > INTERVAL '2 hours'
+    )
+    SELECT g.direction, g.content, g.created_at
+    FROM gaps g, cut
+    WHERE cut.first_gap_rn IS NULL OR g.rn < cut.first_gap_rn
+    ORDER BY g.created_at ASC;
+$$;
+
+
+-- ── Superseded by get_session_history ──────────────────────
+DROP FUNCTION IF EXISTS created_at_epoch(whatsapp_messages);
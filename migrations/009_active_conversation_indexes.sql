@@ -0,0 +1,33 @@
+-- ================================================================
+-- Migration 009: Partial indexes for the active-conversation lookup
+--
+-- Changes:
+-- 1. whatsapp_conversations_active_client_idx: serves the
+--    get_or_create_conversation lookup by client_id
+--    (status IN ('active','waiting_human'), newest last_message_at first)
+-- 2. whatsapp_conversations_active_phone_idx: same lookup for
+--    conversations without a client_id, keyed by client_phone
+--
+-- Both indexes only contain open conversations, so they stay small
+-- while resolved conversations pile up.
+--
+-- HOW TO APPLY:
+-- 1. Open Supabase Dashboard > SQL Editor
+-- 2. Paste this entire file and run it
+-- 3. Verify the lookup uses the index, e.g.:
+--      EXPLAIN ANALYZE
+--      SELECT * FROM whatsapp_conversations
+--      WHERE tenant_id = '<tenant>' AND client_id = '<client>'
+--        AND status IN ('active', 'waiting_human')
+--        AND last_message_at >= NOW() - INTERVAL '24 hours'
+--      ORDER BY last_message_at DESC LIMIT 1;
+--    should show "Index Scan using whatsapp_conversations_active_client_idx"
+-- ================================================================
+
+CREATE INDEX IF NOT EXISTS whatsapp_conversations_active_client_idx
+    ON whatsapp_conversations (tenant_id, client_id, last_message_at DESC)
+    WHERE status IN ('active', 'waiting_human');
+
+CREATE INDEX IF NOT EXISTS whatsapp_conversations_active_phone_idx
+    ON whatsapp_conversations (tenant_id, client_phone, last_message_at DESC)
+    WHERE client_id IS NULL AND status IN ('active', 'waiting_human');
@@ -0,0 +1,42 @@
+-- ================================================================
+-- Migration 010: Start a WhatsApp conversation in one round-trip
+--
+-- Changes:
+-- 1. start_wa_conversation: resolves the client's stale open
+--    conversations and inserts the new one in a single transaction
+--
+-- HOW TO APPLY:
+-- 1. Open Supabase Dashboard > SQL Editor
+-- 2. Paste this entire file and run it
+-- 3. Verify in Database > Functions that start_wa_conversation exists
+-- ================================================================
+
+CREATE OR REPLACE FUNCTION start_wa_conversation(
+    p_tenant_id UUID,
+    p_client_id UUID,
+    p_client_phone TEXT
+)
+RETURNS SETOF whatsapp_conversations
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    -- Close any old open conversations
+    UPDATE whatsapp_conversations
+    SET status = 'resolved',
+        resolved_at = NOW()
+    WHERE tenant_id = p_tenant_id
+      AND status IN ('active', 'waiting_human')
+      AND CASE
+            WHEN p_client_id IS NOT NULL THEN client_id = p_client_id
+            ELSE client_phone = p_client_phone
+          END;
+
+    RETURN QUERY
+    INSERT INTO whatsapp_conversations (
+        tenant_id, client_id, client_phone, status
+    ) VALUES (
+        p_tenant_id, p_client_id, COALESCE(p_client_phone, ''), 'active'
+    )
+    RETURNING *;
+END;
+$$;
@@ -0,0 +1,29 @@
+-- ================================================================
+-- Migration 011: Mark scheduler reminders as sent in one statement
+--
+-- Changes:
+-- 1. mark_reminders_sent: appends the reminder tag (e.g.
+--    "[morning_confirm:2025-03-14 09:00]") to the notes of all the
+--    given appointments in a single UPDATE, instead of one
+--    round-trip per appointment
+--
+-- Superseded by migration 015 (reminder_day_before_sent_at column),
+-- which drops this function: don't apply it on new databases.
+--
+-- HOW TO APPLY:
+-- 1. Open Supabase Dashboard > SQL Editor
+-- 2. Paste this entire file and run it
+-- 3. Verify in Database > Functions that mark_reminders_sent exists
+-- ================================================================
+
+CREATE OR REPLACE FUNCTION mark_reminders_sent(
+    p_ids UUID[],
+    p_tag TEXT
+)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    UPDATE appointments
+    SET notes = btrim(COALESCE(notes, '') || E'\n' || p_tag, E' \t\r\n')
+    WHERE id = ANY(p_ids);
+$$;
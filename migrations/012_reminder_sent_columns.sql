@@ -0,0 +1,48 @@
+-- ================================================================
+-- Migration 012: Reminder bookkeeping columns on appointments
+--
+-- Changes:
+-- 1. appointments.morning_confirm_sent_at / reminder_1h_sent_at:
+--    replace the "[morning_confirm:...]" / "[reminder_1h:...]" tags
+--    that the scheduler appended to notes
+-- 2. Backfill both columns from the existing notes tags
+-- 3. Partial indexes so the scheduler queries only scan appointments
+--    still waiting for their message
+--
+-- HOW TO APPLY:
+-- 1. Open Supabase Dashboard > SQL Editor
+-- 2. Paste this entire file and run it
+-- 3. Verify in Table Editor > appointments that both columns exist
+-- ================================================================
+
+ALTER TABLE appointments
+    ADD COLUMN IF NOT EXISTS morning_confirm_sent_at TIMESTAMPTZ,
+    ADD COLUMN IF NOT EXISTS reminder_1h_sent_at TIMESTAMPTZ;
+
+
+-- ── Backfill from notes tags (timestamps were written in UTC) ──
+UPDATE appointments
+SET morning_confirm_sent_at = COALESCE(
+    (substring(notes FROM '\[morning_confirm:([0-9-]+ [0-9:]+)\]')::TIMESTAMP AT TIME ZONE 'UTC'),
+    NOW()
+)
+WHERE morning_confirm_sent_at IS NULL
+  AND notes LIKE '%[morning_confirm:%';
+
+UPDATE appointments
+SET reminder_1h_sent_at = COALESCE(
+    (substring(notes FROM '\[reminder_1h:([0-9-]+ [0-9:]+)\]')::TIMESTAMP AT TIME ZONE 'UTC'),
+    NOW()
+)
+WHERE reminder_1h_sent_at IS NULL
+  AND notes LIKE '%[reminder_1h:%';
+
+
+-- ── Indexes for the scheduler queries ──────────────────────
+CREATE INDEX IF NOT EXISTS appointments_morning_confirm_due_idx
+    ON appointments (start_at)
+    WHERE status = 'pending' AND morning_confirm_sent_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS appointments_reminder_1h_due_idx
+    ON appointments (start_at)
+    WHERE status = 'confirmed' AND reminder_1h_sent_at IS NULL;
@@ -0,0 +1,58 @@
+-- ================================================================
+-- Migration 013: Claim morning confirmations atomically
+--
+-- Changes:
+-- 1. claim_morning_confirmations: stamps morning_confirm_sent_at on
+--    the pending appointments in [p_start, p_end) that have not been
+--    claimed yet and returns them with client/service already joined.
+--    Select + mark happen in one statement, so two scheduler workers
+--    can never claim (and message) the same appointment twice.
+--    The scheduler sets the column back to NULL for the appointments
+--    it could not message, so they can be claimed again.
+--
+-- HOW TO APPLY:
+-- 1. Open Supabase Dashboard > SQL Editor
+-- 2. Paste this entire file and run it
+--    (requires migration 012 for morning_confirm_sent_at)
+-- 3. Verify in Database > Functions that claim_morning_confirmations exists
+-- ================================================================
+
+CREATE OR REPLACE FUNCTION claim_morning_confirmations(
+    p_start TIMESTAMPTZ,
+    p_end TIMESTAMPTZ
+)
+RETURNS TABLE (
+    id UUID,
+    start_at TIMESTAMPTZ,
+    tenant_id UUID,
+    client JSONB,
+    service JSONB
+)
+LANGUAGE sql
+AS $$
+    WITH claimed AS (
+        UPDATE appointments a
+        SET morning_confirm_sent_at = NOW()
+        WHERE a.status = 'pending'
+          AND a.morning_confirm_sent_at IS NULL
+          AND a.start_at >= p_start
+          AND a.start_at < p_end
+        RETURNING a.id, a.start_at, a.tenant_id, a.client_id, a.service_id
+    )
+    SELECT
+        c.id,
+        c.start_at,
+        c.tenant_id,
+        CASE WHEN cl.id IS NULL THEN NULL ELSE jsonb_build_object(
+            'id', cl.id,
+            'whatsapp_phone', cl.whatsapp_phone,
+            'name', cl.name,
+            'first_name', cl.first_name,
+            'bot_enabled', cl.bot_enabled,
+            'reminder_morning_enabled', cl.reminder_morning_enabled
+        ) END,
+        CASE WHEN s.id IS NULL THEN NULL ELSE jsonb_build_object('name', s.name) END
+    FROM claimed c
+    LEFT JOIN clients cl ON cl.id = c.client_id
+    LEFT JOIN services s ON s.id = c.service_id;
+$$;
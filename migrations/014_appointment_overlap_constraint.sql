@@ -0,0 +1,140 @@
+-- ================================================================
+-- Migration 014: Exclusion constraint against double bookings
+--
+-- Changes:
+-- 1. appointments_no_staff_overlap: GiST exclusion constraint, so two
+--    active appointments (pending / confirmed / in_service) of the same
+--    staff member can never overlap — even when two bookings for an
+--    empty slot run concurrently (SELECT ... FOR UPDATE locks nothing
+--    when there are no rows yet)
+-- 2. book_appointment_atomic: plain INSERT, the constraint does the
+--    conflict check; exclusion_violation -> "slot non disponibile"
+-- 3. modify_appointment_atomic: same for the reschedule UPDATE
+--
+-- HOW TO APPLY:
+-- 1. Open Supabase Dashboard > SQL Editor
+-- 2. Paste this entire file and run it
+--    (the constraint fails if overlapping active appointments already
+--     exist: cancel or move them first)
+-- 3. Verify in Database > Tables > appointments > Constraints that
+--    appointments_no_staff_overlap exists
+-- ================================================================
+
+-- btree_gist provides the "=" operator class for UUIDs in GiST
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'appointments_no_staff_overlap'
+    ) THEN
+        ALTER TABLE appointments
+            ADD CONSTRAINT appointments_no_staff_overlap
+            EXCLUDE USING gist (
+                staff_id WITH =,
+                tstzrange(start_at, end_at, '[)') WITH &&
+            )
+            WHERE (status IN ('pending', 'confirmed', 'in_service'));
+    END IF;
+END;
+$$;
+
+
+-- ── book_appointment_atomic (constraint-based) ──────────────────
+CREATE OR REPLACE FUNCTION book_appointment_atomic(
+    p_tenant_id UUID,
+    p_client_id UUID,
+    p_service_id UUID,
+    p_staff_id UUID,
+    p_start_at TIMESTAMPTZ,
+    p_end_at TIMESTAMPTZ,
+    p_source TEXT DEFAULT 'whatsapp',
+    p_notes TEXT DEFAULT NULL
+)
+RETURNS TABLE(
+    success BOOLEAN,
+    appointment_id UUID,
+    error_message TEXT
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_new_id UUID;
+BEGIN
+    INSERT INTO appointments (
+        tenant_id, client_id, service_id, staff_id,
+        start_at, end_at, status, source, notes
+    ) VALUES (
+        p_tenant_id, p_client_id, p_service_id, p_staff_id,
+        p_start_at, p_end_at,
+        CASE WHEN p_source = 'whatsapp' THEN 'pending' ELSE 'confirmed' END,
+        p_source,
+        COALESCE(p_notes, 'Prenotato via WhatsApp Bot')
+    )
+    RETURNING id INTO v_new_id;
+
+    RETURN QUERY SELECT TRUE, v_new_id, NULL::TEXT;
+EXCEPTION
+    WHEN exclusion_violation THEN
+        RETURN QUERY SELECT
+            FALSE,
+            NULL::UUID,
+            'Lo slot selezionato non è più disponibile. Per favore verifica la disponibilità aggiornata.'::TEXT;
+END;
+$$;
+
+
+-- ── modify_appointment_atomic (constraint-based) ────────────────
+CREATE OR REPLACE FUNCTION modify_appointment_atomic(
+    p_appointment_id UUID,
+    p_client_id UUID,
+    p_tenant_id UUID,
+    p_new_start_at TIMESTAMPTZ,
+    p_new_end_at TIMESTAMPTZ,
+    p_source TEXT DEFAULT 'whatsapp'
+)
+RETURNS TABLE(
+    success BOOLEAN,
+    error_message TEXT
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_status TEXT;
+BEGIN
+    -- Lock and verify ownership
+    SELECT status INTO v_status
+    FROM appointments
+    WHERE id = p_appointment_id
+      AND client_id = p_client_id
+      AND tenant_id = p_tenant_id
+    FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RETURN QUERY SELECT FALSE, 'Appuntamento non trovato o non appartiene a te.'::TEXT;
+        RETURN;
+    END IF;
+
+    IF v_status NOT IN ('pending', 'confirmed') THEN
+        RETURN QUERY SELECT FALSE, ('Impossibile modificare un appuntamento con stato: ' || v_status)::TEXT;
+        RETURN;
+    END IF;
+
+    BEGIN
+        UPDATE appointments
+        SET start_at = p_new_start_at,
+            end_at = p_new_end_at,
+            status = CASE WHEN p_source = 'whatsapp' THEN 'pending' ELSE 'confirmed' END,
+            notes = COALESCE(notes, '') || E'\nSpostato via WhatsApp il ' ||
+                    TO_CHAR(NOW() AT TIME ZONE 'Europe/Rome', 'DD/MM/YYYY HH24:MI'),
+            updated_at = NOW()
+        WHERE id = p_appointment_id;
+    EXCEPTION
+        WHEN exclusion_violation THEN
+            RETURN QUERY SELECT FALSE, 'Il nuovo orario non è disponibile.'::TEXT;
+            RETURN;
+    END;
+
+    RETURN QUERY SELECT TRUE, NULL::TEXT;
+END;
+$$;
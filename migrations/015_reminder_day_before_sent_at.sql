@@ -0,0 +1,41 @@
+-- ================================================================
+-- Migration 015: Day-before reminder bookkeeping column
+--
+-- Changes:
+-- 1. appointments.reminder_day_before_sent_at: replaces the
+--    "[reminder_day_before:...]" tag the scheduler appended to notes,
+--    so "already sent" is filtered in SQL instead of scanning notes
+-- 2. Backfill from the existing notes tags
+-- 3. Partial index for the reminders query
+-- 4. Drops mark_reminders_sent (migration 011): the notes tag it
+--    appended was its last use, nothing calls it anymore
+--
+-- HOW TO APPLY:
+-- 1. Open Supabase Dashboard > SQL Editor
+-- 2. Paste this entire file and run it
+-- 3. Verify in Table Editor > appointments that the column exists,
+--    and in Database > Functions that mark_reminders_sent is gone
+-- ================================================================
+
+ALTER TABLE appointments
+    ADD COLUMN IF NOT EXISTS reminder_day_before_sent_at TIMESTAMPTZ;
+
+
+-- ── Backfill from notes tags (timestamps were written in UTC) ──
+UPDATE appointments
+SET reminder_day_before_sent_at = COALESCE(
+    (substring(notes FROM '\[reminder_day_before:([0-9-]+ [0-9:]+)\]')::TIMESTAMP AT TIME ZONE 'UTC'),
+    NOW()
+)
+WHERE reminder_day_before_sent_at IS NULL
+  AND notes LIKE '%[reminder_day_before:%';
+
+
+-- ── Index for the reminders query ──────────────────────────
+CREATE INDEX IF NOT EXISTS appointments_reminder_day_before_due_idx
+    ON appointments (start_at)
+    WHERE status IN ('pending', 'confirmed') AND reminder_day_before_sent_at IS NULL;
+
+
+-- ── Superseded by the column above ─────────────────────────
+DROP FUNCTION IF EXISTS mark_reminders_sent(UUID[], TEXT);
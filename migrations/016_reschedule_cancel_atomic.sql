@@ -0,0 +1,149 @@
+-- ================================================================
+-- Migration 016: Reschedule / cancel in one round-trip
+--
+-- Changes:
+-- 1. reschedule_appointment_atomic: verifies ownership, computes the
+--    new end from the service duration, moves the appointment (the
+--    exclusion constraint from migration 014 rejects overlaps) and
+--    writes the audit row — one transaction, one call from the bot
+-- 2. cancel_appointment_atomic: verifies ownership, cancels and
+--    writes the audit row in one transaction
+--
+-- HOW TO APPLY:
+-- 1. Open Supabase Dashboard > SQL Editor
+-- 2. Paste this entire file and run it
+--    (requires migration 014 for the overlap constraint)
+-- 3. Verify in Database > Functions that both functions exist
+-- ================================================================
+
+-- ── reschedule_appointment_atomic ───────────────────────────────
+CREATE OR REPLACE FUNCTION reschedule_appointment_atomic(
+    p_appointment_id UUID,
+    p_client_id UUID,
+    p_tenant_id UUID,
+    p_new_start_at TIMESTAMPTZ,
+    p_source TEXT DEFAULT 'whatsapp'
+)
+RETURNS TABLE(
+    success BOOLEAN,
+    error_message TEXT,
+    service_name TEXT
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_status TEXT;
+    v_service_name TEXT;
+    v_duration INTEGER;
+BEGIN
+    -- Lock and verify ownership
+    SELECT a.status, s.name, COALESCE(s.duration_min, 30)
+    INTO v_status, v_service_name, v_duration
+    FROM appointments a
+    LEFT JOIN services s ON s.id = a.service_id
+    WHERE a.id = p_appointment_id
+      AND a.client_id = p_client_id
+      AND a.tenant_id = p_tenant_id
+    FOR UPDATE OF a;
+
+    IF NOT FOUND THEN
+        RETURN QUERY SELECT FALSE, 'Appuntamento non trovato o non appartiene a te.'::TEXT, NULL::TEXT;
+        RETURN;
+    END IF;
+
+    IF v_status NOT IN ('pending', 'confirmed') THEN
+        RETURN QUERY SELECT
+            FALSE,
+            ('Impossibile modificare un appuntamento con stato ''' || v_status || '''.')::TEXT,
+            v_service_name;
+        RETURN;
+    END IF;
+
+    BEGIN
+        UPDATE appointments
+        SET start_at = p_new_start_at,
+            end_at = p_new_start_at + make_interval(mins => v_duration),
+            status = CASE WHEN p_source = 'whatsapp' THEN 'pending' ELSE 'confirmed' END,
+            notes = btrim(COALESCE(notes, '') || E'\nSpostato via WhatsApp il ' ||
+                    TO_CHAR(NOW() AT TIME ZONE 'Europe/Rome', 'DD/MM/YYYY HH24:MI'), E' \t\r\n'),
+            updated_at = NOW()
+        WHERE id = p_appointment_id;
+    EXCEPTION
+        WHEN exclusion_violation THEN
+            RETURN QUERY SELECT FALSE, 'Il nuovo orario non è disponibile.'::TEXT, v_service_name;
+            RETURN;
+    END;
+
+    INSERT INTO audit_logs (tenant_id, action, target, meta)
+    VALUES (
+        p_tenant_id,
+        'appointment_rescheduled',
+        p_appointment_id,
+        jsonb_build_object('new_start', p_new_start_at, 'source', p_source)
+    );
+
+    RETURN QUERY SELECT TRUE, NULL::TEXT, v_service_name;
+END;
+$$;
+
+
+-- ── cancel_appointment_atomic ───────────────────────────────────
+CREATE OR REPLACE FUNCTION cancel_appointment_atomic(
+    p_appointment_id UUID,
+    p_client_id UUID,
+    p_tenant_id UUID,
+    p_source TEXT DEFAULT 'whatsapp'
+)
+RETURNS TABLE(
+    success BOOLEAN,
+    error_message TEXT,
+    service_name TEXT,
+    start_at TIMESTAMPTZ
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_status TEXT;
+    v_service_name TEXT;
+    v_start_at TIMESTAMPTZ;
+BEGIN
+    -- Lock and verify ownership
+    SELECT a.status, s.name, a.start_at
+    INTO v_status, v_service_name, v_start_at
+    FROM appointments a
+    LEFT JOIN services s ON s.id = a.service_id
+    WHERE a.id = p_appointment_id
+      AND a.client_id = p_client_id
+      AND a.tenant_id = p_tenant_id
+    FOR UPDATE OF a;
+
+    IF NOT FOUND THEN
+        RETURN QUERY SELECT
+            FALSE, 'Appuntamento non trovato o non appartiene a te.'::TEXT, NULL::TEXT, NULL::TIMESTAMPTZ;
+        RETURN;
+    END IF;
+
+    IF v_status IN ('canceled', 'completed') THEN
+        RETURN QUERY SELECT
+            FALSE, ('L''appuntamento è già ' || v_status || '.')::TEXT, v_service_name, v_start_at;
+        RETURN;
+    END IF;
+
+    UPDATE appointments
+    SET status = 'canceled',
+        notes = btrim(COALESCE(notes, '') || E'\nCancellato via WhatsApp il ' ||
+                TO_CHAR(NOW() AT TIME ZONE 'Europe/Rome', 'DD/MM/YYYY HH24:MI'), E' \t\r\n'),
+        updated_at = NOW()
+    WHERE id = p_appointment_id;
+
+    INSERT INTO audit_logs (tenant_id, action, target, meta)
+    VALUES (
+        p_tenant_id,
+        'appointment_canceled',
+        p_appointment_id,
+        jsonb_build_object('source', p_source)
+    );
+
+    RETURN QUERY SELECT TRUE, NULL::TEXT, v_service_name, v_start_at;
+END;
+$$;
@@ -0,0 +1,17 @@
+-- ================================================================
+-- Migration 017: Index for a client's upcoming appointments
+--
+-- Changes:
+-- 1. Partial index on appointments (tenant_id, client_id, start_at)
+--    for active appointments, matching get_my_appointments
+--    (filter by tenant/client/status, start_at >= now, order by start_at)
+--
+-- HOW TO APPLY:
+-- 1. Open Supabase Dashboard > SQL Editor
+-- 2. Paste this entire file and run it
+-- 3. Verify in Database > Indexes that appointments_client_future_idx exists
+-- ================================================================
+
+CREATE INDEX IF NOT EXISTS appointments_client_future_idx
+    ON appointments (tenant_id, client_id, start_at)
+    WHERE status IN ('pending', 'confirmed');
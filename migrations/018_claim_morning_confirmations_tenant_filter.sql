@@ -0,0 +1,60 @@
+-- ================================================================
+-- Migration 018: Claim morning confirmations only for reachable tenants
+--
+-- Changes:
+-- 1. claim_morning_confirmations: only claims appointments of tenants
+--    that can receive Cloud API messages (phone_number_id and access
+--    token set, wa_mode not 'unofficial'). Before, those appointments
+--    were claimed, skipped by the scheduler and released again.
+--
+-- HOW TO APPLY:
+-- 1. Open Supabase Dashboard > SQL Editor
+-- 2. Paste this entire file and run it
+--    (replaces the function from migration 013)
+-- 3. Verify in Database > Functions that claim_morning_confirmations exists
+-- ================================================================
+
+CREATE OR REPLACE FUNCTION claim_morning_confirmations(
+    p_start TIMESTAMPTZ,
+    p_end TIMESTAMPTZ
+)
+RETURNS TABLE (
+    id UUID,
+    start_at TIMESTAMPTZ,
+    tenant_id UUID,
+    client JSONB,
+    service JSONB
+)
+LANGUAGE sql
+AS $$
+    WITH claimed AS (
+        UPDATE appointments a
+        SET morning_confirm_sent_at = NOW()
+        FROM tenants t
+        WHERE t.id = a.tenant_id
+          AND COALESCE(t.whatsapp_phone_number_id, '') <> ''
+          AND COALESCE(t.whatsapp_access_token, '') <> ''
+          AND t.wa_mode IS DISTINCT FROM 'unofficial'
+          AND a.status = 'pending'
+          AND a.morning_confirm_sent_at IS NULL
+          AND a.start_at >= p_start
+          AND a.start_at < p_end
+        RETURNING a.id, a.start_at, a.tenant_id, a.client_id, a.service_id
+    )
+    SELECT
+        c.id,
+        c.start_at,
+        c.tenant_id,
+        CASE WHEN cl.id IS NULL THEN NULL ELSE jsonb_build_object(
+            'id', cl.id,
+            'whatsapp_phone', cl.whatsapp_phone,
+            'name', cl.name,
+            'first_name', cl.first_name,
+            'bot_enabled', cl.bot_enabled,
+            'reminder_morning_enabled', cl.reminder_morning_enabled
+        ) END,
+        CASE WHEN s.id IS NULL THEN NULL ELSE jsonb_build_object('name', s.name) END
+    FROM claimed c
+    LEFT JOIN clients cl ON cl.id = c.client_id
+    LEFT JOIN services s ON s.id = c.service_id;
+$$;
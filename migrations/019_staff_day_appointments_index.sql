@@ -0,0 +1,21 @@
+-- ================================================================
+-- Migration 019: Index for a staff member's appointments of a day
+--
+-- Changes:
+-- 1. Partial index on appointments (staff_id, start_at) for active
+--    appointments, matching check_availability (staff_id IN (...),
+--    active status, start_at within the day). The overlap exclusion
+--    constraint's GiST index (migration 014) is keyed on the time
+--    range, not on start_at, so it can't serve this filter.
+--
+-- (The client-side index for get_my_appointments is migration 017.)
+--
+-- HOW TO APPLY:
+-- 1. Open Supabase Dashboard > SQL Editor
+-- 2. Paste this entire file and run it
+-- 3. Verify in Database > Indexes that appointments_staff_day_idx exists
+-- ================================================================
+
+CREATE INDEX IF NOT EXISTS appointments_staff_day_idx
+    ON appointments (staff_id, start_at)
+    WHERE status IN ('pending', 'confirmed', 'in_service');
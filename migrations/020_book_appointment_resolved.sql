@@ -0,0 +1,113 @@
+-- ================================================================
+-- Migration 020: Resolve service/staff and book in one call
+--
+-- Changes:
+-- 1. book_appointment_resolved: takes the service and staff member as
+--    UUID or (partial) name, exactly as the bot receives them, resolves
+--    both within the tenant, computes the end from the service duration
+--    and inserts the appointment — one round-trip instead of
+--    resolve service + resolve staff + book_appointment_atomic.
+--    Resolution and insert share the transaction, so a service or
+--    staff member deactivated in between can't be booked.
+--    Overlaps are rejected by the exclusion constraint (migration 014).
+--
+-- HOW TO APPLY:
+-- 1. Open Supabase Dashboard > SQL Editor
+-- 2. Paste this entire file and run it
+--    (requires migration 014 for the overlap constraint)
+-- 3. Verify in Database > Functions that book_appointment_resolved exists
+-- ================================================================
+
+CREATE OR REPLACE FUNCTION book_appointment_resolved(
+    p_tenant_id UUID,
+    p_client_id UUID,
+    p_service_ident TEXT,
+    p_staff_ident TEXT,
+    p_start_at TIMESTAMPTZ,
+    p_source TEXT DEFAULT 'whatsapp',
+    p_notes TEXT DEFAULT NULL
+)
+RETURNS TABLE(
+    success BOOLEAN,
+    appointment_id UUID,
+    error_message TEXT,
+    service_name TEXT,
+    duration_min INTEGER,
+    price NUMERIC,
+    staff_name TEXT
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_uuid_re CONSTANT TEXT := '^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$';
+    v_service services%ROWTYPE;
+    v_staff staff%ROWTYPE;
+    v_duration INTEGER;
+    v_new_id UUID;
+BEGIN
+    -- Resolve service (UUID or name)
+    IF p_service_ident ~* v_uuid_re THEN
+        SELECT * INTO v_service FROM services s
+        WHERE s.id = p_service_ident::UUID AND s.tenant_id = p_tenant_id AND s.is_active;
+    ELSE
+        SELECT * INTO v_service FROM services s
+        WHERE s.tenant_id = p_tenant_id
+          AND s.is_active
+          AND s.name ILIKE '%' || p_service_ident || '%'
+        ORDER BY s.name
+        LIMIT 1;
+    END IF;
+
+    IF v_service.id IS NULL THEN
+        RETURN QUERY SELECT FALSE, NULL::UUID, 'Servizio non trovato.'::TEXT,
+            NULL::TEXT, NULL::INTEGER, NULL::NUMERIC, NULL::TEXT;
+        RETURN;
+    END IF;
+
+    -- Resolve staff (UUID or name)
+    IF p_staff_ident ~* v_uuid_re THEN
+        SELECT * INTO v_staff FROM staff st
+        WHERE st.id = p_staff_ident::UUID AND st.tenant_id = p_tenant_id AND st.is_active;
+    ELSE
+        SELECT * INTO v_staff FROM staff st
+        WHERE st.tenant_id = p_tenant_id
+          AND st.is_active
+          AND st.name ILIKE '%' || p_staff_ident || '%'
+        ORDER BY st.name
+        LIMIT 1;
+    END IF;
+
+    IF v_staff.id IS NULL THEN
+        RETURN QUERY SELECT FALSE, NULL::UUID, 'Operatore non trovato.'::TEXT,
+            NULL::TEXT, NULL::INTEGER, NULL::NUMERIC, NULL::TEXT;
+        RETURN;
+    END IF;
+
+    v_duration := COALESCE(v_service.duration_min, 30);
+
+    BEGIN
+        INSERT INTO appointments (
+            tenant_id, client_id, service_id, staff_id,
+            start_at, end_at, status, source, notes
+        ) VALUES (
+            p_tenant_id, p_client_id, v_service.id, v_staff.id,
+            p_start_at, p_start_at + make_interval(mins => v_duration),
+            CASE WHEN p_source = 'whatsapp' THEN 'pending' ELSE 'confirmed' END,
+            p_source,
+            COALESCE(p_notes, 'Prenotato via WhatsApp Bot')
+        )
+        RETURNING id INTO v_new_id;
+    EXCEPTION
+        WHEN exclusion_violation THEN
+            RETURN QUERY SELECT
+                FALSE,
+                NULL::UUID,
+                'Lo slot selezionato non è più disponibile. Per favore verifica la disponibilità aggiornata.'::TEXT,
+                v_service.name, v_duration, v_service.price, v_staff.name;
+            RETURN;
+    END;
+
+    RETURN QUERY SELECT TRUE, v_new_id, NULL::TEXT,
+        v_service.name, v_duration, v_service.price, v_staff.name;
+END;
+$$;
@@ -0,0 +1,26 @@
+-- ================================================================
+-- Migration 021: Trigram indexes for name lookups
+--
+-- Changes:
+-- 1. pg_trgm extension
+-- 2. GIN trigram indexes on services.name and staff.name, so the
+--    bot's `name ILIKE '%...%'` lookups (get_service_info,
+--    resolve_service/resolve_staff, book_appointment_resolved) can use
+--    an index instead of scanning the table — a B-tree can't serve a
+--    leading wildcard. The index is on the plain column: ILIKE is
+--    case-insensitive already and is matched by gin_trgm_ops directly.
+--
+-- HOW TO APPLY:
+-- 1. Open Supabase Dashboard > SQL Editor
+-- 2. Paste this entire file and run it
+-- 3. Verify in Database > Indexes that services_name_trgm_idx and
+--    staff_name_trgm_idx exist
+-- ================================================================
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS services_name_trgm_idx
+    ON services USING gin (name gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS staff_name_trgm_idx
+    ON staff USING gin (name gin_trgm_ops);
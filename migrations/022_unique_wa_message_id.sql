@@ -0,0 +1,114 @@
+-- ================================================================
+-- Migration 022: Idempotent message logging on wa_message_id
+--
+-- Changes:
+-- 1. Unique index on whatsapp_messages.wa_message_id. It also serves
+--    the webhook's persistent dedup lookup (eq wa_message_id, limit 1).
+--    NULLs stay allowed (outbound rows may have no id): in a unique
+--    index NULLs never conflict with each other.
+-- 2. log_wa_message / log_wa_messages: ON CONFLICT (wa_message_id)
+--    DO NOTHING, and conversation counters only count rows actually
+--    inserted — a Meta re-delivery that slips past the in-memory dedup
+--    (e.g. handled by two workers at once) is logged exactly once.
+--
+-- HOW TO APPLY:
+-- 1. Open Supabase Dashboard > SQL Editor
+-- 2. Paste this entire file and run it
+--    (the index fails if duplicates already exist; list them with
+--       SELECT wa_message_id, COUNT(*) FROM whatsapp_messages
+--       WHERE wa_message_id IS NOT NULL GROUP BY 1 HAVING COUNT(*) > 1;
+--     and delete the extra rows first)
+-- 3. Verify in Database > Indexes that whatsapp_messages_wa_message_id_key exists
+-- ================================================================
+
+CREATE UNIQUE INDEX IF NOT EXISTS whatsapp_messages_wa_message_id_key
+    ON whatsapp_messages (wa_message_id);
+
+
+-- ── log_wa_message (idempotent) ─────────────────────────────────
+CREATE OR REPLACE FUNCTION log_wa_message(
+    p_tenant_id UUID,
+    p_client_id UUID,
+    p_direction TEXT,
+    p_from_number TEXT,
+    p_to_number TEXT,
+    p_content TEXT,
+    p_wa_message_id TEXT DEFAULT NULL,
+    p_conversation_id UUID DEFAULT NULL,
+    p_handled_by TEXT DEFAULT 'bot'
+)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO whatsapp_messages (
+        tenant_id, client_id, direction, from_number, to_number,
+        message_type, content, wa_message_id, handled_by
+    ) VALUES (
+        p_tenant_id, p_client_id, p_direction, p_from_number, p_to_number,
+        'text', p_content, p_wa_message_id, p_handled_by
+    )
+    ON CONFLICT (wa_message_id) DO NOTHING;
+
+    IF FOUND AND p_conversation_id IS NOT NULL THEN
+        UPDATE whatsapp_conversations
+        SET last_message_at = NOW(),
+            updated_at = NOW(),
+            message_count = COALESCE(message_count, 0) + 1,
+            bot_handled_count = COALESCE(bot_handled_count, 0)
+                + CASE WHEN p_direction = 'outbound' AND p_handled_by = 'bot' THEN 1 ELSE 0 END
+        WHERE id = p_conversation_id;
+    END IF;
+END;
+$$;
+
+
+-- ── log_wa_messages (idempotent batch) ──────────────────────────
+CREATE OR REPLACE FUNCTION log_wa_messages(p_messages JSONB)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    WITH m AS (
+        SELECT r.*, COALESCE(r.created_at, NOW()) AS at
+        FROM jsonb_to_recordset(p_messages) AS r(
+            tenant_id UUID, client_id UUID, direction TEXT, from_number TEXT,
+            to_number TEXT, content TEXT, wa_message_id TEXT, handled_by TEXT,
+            created_at TIMESTAMPTZ, conversation_id UUID
+        )
+    ),
+    ins AS (
+        INSERT INTO whatsapp_messages (
+            tenant_id, client_id, direction, from_number, to_number,
+            message_type, content, wa_message_id, handled_by, created_at
+        )
+        SELECT
+            m.tenant_id, m.client_id, m.direction, m.from_number, m.to_number,
+            'text', m.content, m.wa_message_id, m.handled_by, m.at
+        FROM m
+        ON CONFLICT (wa_message_id) DO NOTHING
+        RETURNING wa_message_id
+    ),
+    -- Rows actually inserted: no id (never conflicts), or an id that made it in
+    -- (once, even if the batch itself repeats the id)
+    logged AS (
+        SELECT * FROM m WHERE m.wa_message_id IS NULL
+        UNION ALL
+        SELECT DISTINCT ON (m.wa_message_id) m.* FROM m JOIN ins USING (wa_message_id)
+    )
+    UPDATE whatsapp_conversations c
+    SET last_message_at = v.last_at,
+        updated_at = NOW(),
+        message_count = COALESCE(c.message_count, 0) + v.n,
+        bot_handled_count = COALESCE(c.bot_handled_count, 0) + v.bot_n
+    FROM (
+        SELECT
+            conversation_id,
+            MAX(at) AS last_at,
+            COUNT(*) AS n,
+            COUNT(*) FILTER (WHERE direction = 'outbound' AND handled_by = 'bot') AS bot_n
+        FROM logged
+        WHERE conversation_id IS NOT NULL
+        GROUP BY conversation_id
+    ) v
+    WHERE c.id = v.conversation_id;
+$$;
@@ -0,0 +1,23 @@
+-- ================================================================
+-- Migration 023: Keyset index for a client's upcoming appointments
+--
+-- Changes:
+-- 1. appointments_client_future_keyset_idx: same partial index as
+--    migration 017, extended with id. get_my_appointments pages on
+--    (start_at, id), so appointments sharing a start_at are never
+--    skipped across pages, and orders by start_at, id
+-- 2. Drops appointments_client_future_idx (migration 017), now a
+--    prefix of the new index
+--
+-- HOW TO APPLY:
+-- 1. Open Supabase Dashboard > SQL Editor
+-- 2. Paste this entire file and run it
+-- 3. Verify in Database > Indexes that appointments_client_future_keyset_idx
+--    exists and appointments_client_future_idx is gone
+-- ================================================================
+
+CREATE INDEX IF NOT EXISTS appointments_client_future_keyset_idx
+    ON appointments (tenant_id, client_id, start_at, id)
+    WHERE status IN ('pending', 'confirmed');
+
+DROP INDEX IF EXISTS appointments_client_future_idx;
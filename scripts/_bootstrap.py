@@ -0,0 +1,15 @@
+"""
+Shared setup for the scripts: put the repo root on sys.path and load .env.
+Import it first: `import _bootstrap  # noqa: F401`
+"""
+
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from src.env import load_env_once  # noqa: E402
+
+load_env_once()
@@ -6,13 +6,7 @@ Run: python scripts/test_gemini.py
 import os
 import sys
 
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
-from dotenv import load_dotenv
-load_dotenv("config/.env")
-load_dotenv("config/.env.local")
-load_dotenv(".env")
-load_dotenv(".env.local")
+import _bootstrap  # noqa: F401
 
 from google import genai
 from google.genai import types
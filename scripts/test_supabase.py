@@ -3,16 +3,7 @@ Test Supabase connection and basic queries.
 Run: python scripts/test_supabase.py
 """
 
-import sys
-import os
-
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
-from dotenv import load_dotenv
-load_dotenv("config/.env")
-load_dotenv("config/.env.local")
-load_dotenv(".env")
-load_dotenv(".env.local")
+import _bootstrap  # noqa: F401
 
 from src.supabase_client import get_supabase
 
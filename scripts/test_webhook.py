@@ -12,27 +12,27 @@ import sys
 BASE_URL = "http://localhost:8000"
 
 
-def test_health():
+def test_health(client: httpx.Client):
     print("--- Health Check ---")
-    resp = httpx.get(f"{BASE_URL}/health")
+    resp = client.get("/health")
     print(f"  Status: {resp.status_code}")
     print(f"  Body: {resp.json()}")
     assert resp.status_code == 200
 
 
-def test_webhook_verify():
+def test_webhook_verify(client: httpx.Client):
     print("\n--- Webhook Verify (GET) ---")
     params = {
         "hub.mode": "subscribe",
         "hub.verify_token": "test_token",
         "hub.challenge": "challenge_string_123",
     }
-    resp = httpx.get(f"{BASE_URL}/webhook", params=params)
+    resp = client.get("/webhook", params=params)
     print(f"  Status: {resp.status_code}")
     print(f"  Body: {resp.text}")
 
 
-def test_webhook_message():
+def test_webhook_message(client: httpx.Client):
     print("\n--- Webhook Message (POST) ---")
     payload = {
         "object": "whatsapp_business_account",
@@ -69,13 +69,15 @@ def test_webhook_message():
             }
         ],
     }
-    resp = httpx.post(f"{BASE_URL}/webhook", json=payload)
+    resp = client.post("/webhook", json=payload)
     print(f"  Status: {resp.status_code}")
     print(f"  (Should be 200 even if tenant not found)")
 
 
 if __name__ == "__main__":
-    test_health()
-    test_webhook_verify()
-    test_webhook_message()
+    # One client: the three requests share a keep-alive connection
+    with httpx.Client(base_url=BASE_URL) as client:
+        test_health(client)
+        test_webhook_verify(client)
+        test_webhook_message(client)
     print("\nAll tests passed!")
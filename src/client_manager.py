@@ -1,16 +1,56 @@
 """
 Identify or create a client from their WhatsApp phone number.
+Caches resolved clients for 60 seconds so bursts of messages from the
+same phone skip the DB lookup. The TTL is kept short on purpose: the
+cached row carries bot_enabled, which staff toggle from the dashboard
+(nothing here can invalidate that), and cache hits don't bump
+updated_at, the client's last interaction.
 """
 
 import logging
-from datetime import datetime, timezone
+import time
+from collections import OrderedDict
 from typing import Optional
 
-from src.supabase_client import get_supabase
-from src.utils import normalize_phone
+from src.supabase_client import get_async_supabase
+from src.utils import normalize_phone, run_in_background, utcnow_iso
 
 logger = logging.getLogger("BOT.client")
 
+# Columns read downstream (webhook handler, system prompt)
+CLIENT_COLUMNS = "id, tenant_id, whatsapp_phone, phone, name, whatsapp_name, bot_enabled"
+
+# Cache: (tenant_id, whatsapp_phone) -> (client_dict, timestamp), least recently used first
+_cache: OrderedDict[tuple[str, str], tuple[dict, float]] = OrderedDict()
+CACHE_TTL = 60  # seconds: bounds how late a dashboard bot_enabled toggle is seen
+CACHE_MAX_SIZE = 5_000
+
+
+async def _touch_client(client_id: str) -> None:
+    """Bump clients.updated_at for the last interaction."""
+    try:
+        await get_async_supabase().from_("clients").update(
+            {"updated_at": utcnow_iso()}, returning="minimal"
+        ).eq("id", client_id).execute()
+    except Exception as e:
+        logger.warning(f"Error touching client {client_id}: {e}")
+
+
+def _cache_put(key: tuple[str, str], client: dict, now: float) -> None:
+    _cache[key] = (client, now)
+    _cache.move_to_end(key)
+    while len(_cache) > CACHE_MAX_SIZE:
+        _cache.popitem(last=False)
+
+
+def invalidate_client_cache(client_id: str | None = None) -> None:
+    """Clear cached client data (one client, or everything)."""
+    if client_id:
+        for key in [k for k, (c, _) in _cache.items() if c.get("id") == client_id]:
+            del _cache[key]
+    else:
+        _cache.clear()
+
 
 async def get_or_create_client(
     tenant_id: str,
@@ -22,24 +62,59 @@ async def get_or_create_client(
     Returns the client row dict.
     """
     phone = normalize_phone(whatsapp_phone)
-    sb = get_supabase()
+    key = (tenant_id, phone)
+    now = time.monotonic()
+
+    # Check cache
+    cached = _cache.get(key)
+    if cached:
+        client, cached_at = cached
+        if now - cached_at < CACHE_TTL:
+            _cache.move_to_end(key)
+            return client
+        del _cache[key]
+
+    client = await _lookup_or_create_client(tenant_id, phone, contact_name)
+    if client.get("id"):
+        _cache_put(key, client, now)
+    return client
 
+
+async def _lookup_or_create_client(
+    tenant_id: str,
+    phone: str,
+    contact_name: Optional[str],
+) -> dict:
+    asb = get_async_supabase()
+
+    # ── Single round-trip lookup/create via PostgreSQL RPC ───
+    try:
+        response = await asb.rpc(
+            "upsert_wa_client",
+            {"p_tenant_id": tenant_id, "p_phone": phone, "p_name": contact_name},
+        ).execute()
+        if response.data:
+            return response.data[0]
+    except Exception as e:
+        logger.warning(f"upsert_wa_client RPC unavailable, using legacy: {e}")
+
+    # ── Legacy fallback (lookup by whatsapp_phone, then phone, then create) ──
     # Search existing client
     try:
-        response = (
-            sb.table("clients")
-            .select("*")
+        response = await (
+            asb.from_("clients")
+            .select(CLIENT_COLUMNS)
             .eq("tenant_id", tenant_id)
             .eq("whatsapp_phone", phone)
+            .limit(1)
+            .maybe_single()
             .execute()
         )
 
-        if response.data:
-            client = response.data[0]
-            # Update last interaction timestamp
-            sb.table("clients").update(
-                {"updated_at": datetime.now(timezone.utc).isoformat()}
-            ).eq("id", client["id"]).execute()
+        if response and response.data:
+            client = response.data
+            # Update last interaction timestamp (off the critical path)
+            run_in_background(_touch_client(client["id"]))
             return client
 
     except Exception as e:
@@ -47,23 +122,25 @@ async def get_or_create_client(
 
     # Also try searching by phone field
     try:
-        response = (
-            sb.table("clients")
-            .select("*")
+        response = await (
+            asb.from_("clients")
+            .select(CLIENT_COLUMNS)
             .eq("tenant_id", tenant_id)
             .eq("phone", phone)
+            .limit(1)
+            .maybe_single()
             .execute()
         )
 
-        if response.data:
-            client = response.data[0]
+        if response and response.data:
+            client = response.data
             # Set whatsapp_phone if missing
-            update = {"ultima_interazione_wa": datetime.now(timezone.utc).isoformat()}
+            update = {"ultima_interazione_wa": utcnow_iso()}
             if not client.get("whatsapp_phone"):
                 update["whatsapp_phone"] = phone
             if contact_name and not client.get("whatsapp_name"):
                 update["whatsapp_name"] = contact_name
-            sb.table("clients").update(update).eq("id", client["id"]).execute()
+            await asb.from_("clients").update(update, returning="minimal").eq("id", client["id"]).execute()
             return client
 
     except Exception as e:
@@ -80,7 +157,7 @@ async def get_or_create_client(
             "consent_wa": True,
         }
 
-        response = sb.table("clients").insert(new_client).execute()
+        response = await asb.from_("clients").insert(new_client).execute()
 
         if response.data:
             client = response.data[0]
@@ -1,6 +1,9 @@
 """
 Manage whatsapp_conversations and message history.
 Conversations expire after 24 hours of inactivity.
+The open conversation per client is cached for a few seconds, and only
+while the bot is handling it: operators take over (waiting_human) and
+hand back from the dashboard, which can't invalidate this cache.
 
 DB Schema (real):
   whatsapp_conversations: id, tenant_id, client_id, client_phone, status,
@@ -14,14 +17,61 @@ DB Schema (real):
 """
 
 import logging
+import time
+from dataclasses import dataclass
 from datetime import datetime, timezone, timedelta
 from typing import Optional
 
-from src.supabase_client import get_supabase
+from src import message_logger
+from src.supabase_client import get_async_supabase
+from src.utils import parse_iso_datetime, utcnow_iso
 
 logger = logging.getLogger("BOT.conversation")
 
 CONVERSATION_TTL_HOURS = 24
+CONVERSATION_TTL = timedelta(hours=CONVERSATION_TTL_HOURS)
+SESSION_GAP_SECONDS = 2 * 3600
+# Max history messages sent to Gemini per turn (each tool round resends them)
+HISTORY_LIMIT = 10
+
+# whatsapp_messages.direction -> chat role
+_ROLE = {"inbound": "user", "outbound": "assistant"}
+
+
+@dataclass(slots=True)
+class HistoryMessage:
+    """One message of the conversation history, in chat-role form."""
+    role: str  # "user" | "assistant"
+    content: str
+    created_at: Optional[str] = None
+
+
+# Columns read downstream (webhook handler, operator tools)
+CONVERSATION_COLUMNS = "id, tenant_id, client_id, client_phone, status, last_message_at, human_takeover"
+
+# Cache: (tenant_id, client_id or client_phone) -> (conversation_dict, timestamp)
+_cache: dict[tuple[str, str], tuple[dict, float]] = {}
+CACHE_TTL = 5  # seconds: bounds how late a dashboard takeover/hand-back is seen
+CACHE_MAX_SIZE = 10_000
+
+
+def _cache_put(key: tuple[str, str], conv: dict, now: float) -> None:
+    if len(_cache) >= CACHE_MAX_SIZE:
+        # Drop expired entries; if still full, start over
+        for k in [k for k, (_, cached_at) in _cache.items() if now - cached_at >= CACHE_TTL]:
+            del _cache[k]
+        if len(_cache) >= CACHE_MAX_SIZE:
+            _cache.clear()
+    _cache[key] = (conv, now)
+
+
+def invalidate_conversation_cache(conversation_id: str | None = None) -> None:
+    """Clear cached conversations (one conversation, or everything)."""
+    if conversation_id:
+        for key in [k for k, (c, _) in _cache.items() if c.get("id") == conversation_id]:
+            del _cache[key]
+    else:
+        _cache.clear()
 
 
 async def get_or_create_conversation(
@@ -36,14 +86,37 @@ async def get_or_create_conversation(
     if not client_id and not client_phone:
         return {"id": None, "tenant_id": tenant_id, "status": "active"}
 
-    sb = get_supabase()
-    cutoff = (datetime.now(timezone.utc) - timedelta(hours=CONVERSATION_TTL_HOURS)).isoformat()
+    key = (tenant_id, client_id or client_phone)
+    now_ts = time.monotonic()
+
+    # Check cache
+    if key in _cache:
+        conv, cached_at = _cache[key]
+        if now_ts - cached_at < CACHE_TTL:
+            return conv
+
+    conv = await _find_or_start_conversation(tenant_id, client_id, client_phone)
+    # waiting_human is re-read every time, so a hand-back is seen immediately
+    if conv.get("id") and conv.get("status") == "active":
+        _cache_put(key, conv, now_ts)
+    return conv
+
+
+async def _find_or_start_conversation(
+    tenant_id: str,
+    client_id: Optional[str],
+    client_phone: str,
+) -> dict:
+    asb = get_async_supabase()
+    now = datetime.now(timezone.utc)
+    now_iso = now.isoformat()
+    cutoff = (now - CONVERSATION_TTL).isoformat()
 
     try:
         # Find recent active conversation
         query = (
-            sb.table("whatsapp_conversations")
-            .select("*")
+            asb.from_("whatsapp_conversations")
+            .select(CONVERSATION_COLUMNS)
             .eq("tenant_id", tenant_id)
             .in_("status", ["active", "waiting_human"])
             .gte("last_message_at", cutoff)
@@ -56,22 +129,40 @@ async def get_or_create_conversation(
         else:
             query = query.eq("client_phone", client_phone)
 
-        response = query.execute()
+        response = await query.maybe_single().execute()
 
-        if response.data:
-            return response.data[0]
+        if response and response.data:
+            return response.data
 
     except Exception as e:
         logger.error(f"Error finding conversation: {e}")
 
+    # ── Close old + create new in one round-trip via PostgreSQL RPC ──
+    try:
+        response = await asb.rpc(
+            "start_wa_conversation",
+            {
+                "p_tenant_id": tenant_id,
+                "p_client_id": client_id,
+                "p_client_phone": client_phone,
+            },
+        ).execute()
+        if response.data:
+            conv = response.data[0]
+            logger.info(f"New conversation created: {conv['id']}")
+            return conv
+    except Exception as e:
+        logger.warning(f"start_wa_conversation RPC unavailable, using legacy: {e}")
+
+    # ── Legacy fallback (close old conversations, then insert) ──
     # Close any old open conversations
     try:
         close_query = (
-            sb.table("whatsapp_conversations")
+            asb.from_("whatsapp_conversations")
             .update({
                 "status": "resolved",
-                "resolved_at": datetime.now(timezone.utc).isoformat(),
-            })
+                "resolved_at": now_iso,
+            }, returning="minimal")
             .eq("tenant_id", tenant_id)
             .in_("status", ["active", "waiting_human"])
         )
@@ -79,7 +170,7 @@ async def get_or_create_conversation(
             close_query = close_query.eq("client_id", client_id)
         else:
             close_query = close_query.eq("client_phone", client_phone)
-        close_query.execute()
+        await close_query.execute()
     except Exception:
         pass
 
@@ -93,8 +184,8 @@ async def get_or_create_conversation(
         if client_id:
             new_conv["client_id"] = client_id
 
-        response = (
-            sb.table("whatsapp_conversations")
+        response = await (
+            asb.from_("whatsapp_conversations")
             .insert(new_conv)
             .execute()
         )
@@ -124,9 +215,49 @@ async def log_message(
     """
     Log a message to whatsapp_messages.
     direction: 'inbound' (user) or 'outbound' (bot)
+    Queued for a batched flush when the message logger is running,
+    written immediately otherwise (scripts, tests).
     """
-    sb = get_supabase()
+    now_iso = utcnow_iso()
+    queued = await message_logger.enqueue({
+        "tenant_id": tenant_id,
+        "client_id": client_id,
+        "direction": direction,
+        "from_number": from_number,
+        "to_number": to_number,
+        "message_type": "text",
+        "content": content,
+        "wa_message_id": wa_message_id,
+        "handled_by": handled_by,
+        "created_at": now_iso,
+        "conversation_id": conversation_id,
+    })
+    if queued:
+        return
+
+    asb = get_async_supabase()
+
+    # ── Insert + counters in one transaction via PostgreSQL RPC ──
+    try:
+        await asb.rpc(
+            "log_wa_message",
+            {
+                "p_tenant_id": tenant_id,
+                "p_client_id": client_id,
+                "p_direction": direction,
+                "p_from_number": from_number,
+                "p_to_number": to_number,
+                "p_content": content,
+                "p_wa_message_id": wa_message_id,
+                "p_conversation_id": conversation_id,
+                "p_handled_by": handled_by,
+            },
+        ).execute()
+        return
+    except Exception as e:
+        logger.warning(f"log_wa_message RPC unavailable, using legacy: {e}")
 
+    # ── Legacy fallback (insert, then update conversation) ───
     try:
         msg_data = {
             "tenant_id": tenant_id,
@@ -141,37 +272,69 @@ async def log_message(
         if wa_message_id:
             msg_data["wa_message_id"] = wa_message_id
 
-        sb.table("whatsapp_messages").insert(msg_data).execute()
+        await asb.from_("whatsapp_messages").insert(msg_data, returning="minimal").execute()
 
         # Update conversation counters
         if conversation_id:
-            now = datetime.now(timezone.utc).isoformat()
-            sb.table("whatsapp_conversations").update({
-                "last_message_at": now,
-                "updated_at": now,
-            }).eq("id", conversation_id).execute()
+            await asb.from_("whatsapp_conversations").update({
+                "last_message_at": now_iso,
+                "updated_at": now_iso,
+            }, returning="minimal").eq("id", conversation_id).execute()
 
     except Exception as e:
         logger.error(f"Error logging message: {e}")
 
 
+def _parse_created_at(msg: dict) -> Optional[datetime]:
+    try:
+        return parse_iso_datetime(msg["created_at"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
 async def get_conversation_history(
     tenant_id: str,
     client_id: Optional[str] = None,
     client_phone: str = "",
-    limit: int = 10,
-) -> list[dict]:
+    limit: int = HISTORY_LIMIT,
+) -> list[HistoryMessage]:
     """
     Load the last N messages for a client, with session gap detection.
     If there's a gap of >2 hours between messages, only messages after
     the gap are returned to avoid stale context pollution.
-    Returns list of dicts with 'role' (user/assistant) and 'content'.
+    Returns HistoryMessage records with role (user/assistant) and content.
     """
-    sb = get_supabase()
+    if not client_id and not client_phone:
+        return []
+
+    asb = get_async_supabase()
+
+    # ── Session cut done in SQL via PostgreSQL RPC (chronological order) ──
+    try:
+        response = await asb.rpc(
+            "get_session_history",
+            {
+                "p_tenant_id": tenant_id,
+                "p_client_id": client_id,
+                "p_client_phone": client_phone or None,
+                "p_limit": limit,
+            },
+        ).execute()
+        return [
+            HistoryMessage(
+                role=_ROLE.get(msg["direction"], "assistant"),
+                content=msg["content"],
+                created_at=msg.get("created_at"),
+            )
+            for msg in (response.data or [])
+        ]
+    except Exception as e:
+        logger.warning(f"get_session_history RPC unavailable, using legacy: {e}")
 
+    # ── Legacy fallback (fetch last N, cut at gap client-side) ──
     try:
         query = (
-            sb.table("whatsapp_messages")
+            asb.from_("whatsapp_messages")
             .select("direction, content, created_at")
             .eq("tenant_id", tenant_id)
             .order("created_at", desc=True)
@@ -185,7 +348,7 @@ async def get_conversation_history(
         else:
             return []
 
-        response = query.execute()
+        response = await query.execute()
 
         if not response.data:
             return []
@@ -194,26 +357,24 @@ async def get_conversation_history(
         # only keep messages from the most recent session
         raw = response.data  # newest first
         session_msgs = [raw[0]]
-        for i in range(1, len(raw)):
-            try:
-                newer = datetime.fromisoformat(raw[i - 1]["created_at"].replace("Z", "+00:00"))
-                older = datetime.fromisoformat(raw[i]["created_at"].replace("Z", "+00:00"))
-                if (newer - older) > timedelta(hours=2):
+        prev_at = _parse_created_at(raw[0])
+        for msg in raw[1:]:
+            msg_at = _parse_created_at(msg)
+            if prev_at is not None and msg_at is not None:
+                if (prev_at - msg_at).total_seconds() > SESSION_GAP_SECONDS:
                     break  # Gap found, stop including older messages
-            except (ValueError, TypeError):
-                pass
-            session_msgs.append(raw[i])
+            session_msgs.append(msg)
+            prev_at = msg_at
 
         # Convert to role-based format and reverse to chronological order
-        messages = []
-        for msg in reversed(session_msgs):
-            role = "user" if msg["direction"] == "inbound" else "assistant"
-            messages.append({
-                "role": role,
-                "content": msg["content"],
-                "created_at": msg.get("created_at"),
-            })
-        return messages
+        return [
+            HistoryMessage(
+                role=_ROLE.get(msg["direction"], "assistant"),
+                content=msg["content"],
+                created_at=msg.get("created_at"),
+            )
+            for msg in reversed(session_msgs)
+        ]
 
     except Exception as e:
         logger.error(f"Error loading history: {e}")
@@ -225,17 +386,20 @@ async def set_conversation_status(conversation_id: str, status: str) -> None:
     if not conversation_id:
         return
 
-    sb = get_supabase()
+    asb = get_async_supabase()
+    now_iso = utcnow_iso()
     try:
         update = {
             "status": status,
-            "updated_at": datetime.now(timezone.utc).isoformat(),
+            "updated_at": now_iso,
         }
         if status == "waiting_human":
             update["human_takeover"] = True
         if status == "resolved":
-            update["resolved_at"] = datetime.now(timezone.utc).isoformat()
+            update["resolved_at"] = now_iso
 
-        sb.table("whatsapp_conversations").update(update).eq("id", conversation_id).execute()
+        await asb.from_("whatsapp_conversations").update(update, returning="minimal").eq("id", conversation_id).execute()
     except Exception as e:
         logger.error(f"Error updating conversation status: {e}")
+    finally:
+        invalidate_conversation_cache(conversation_id)
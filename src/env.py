@@ -0,0 +1,24 @@
+"""
+Environment loading: read the .env files once per process.
+"""
+
+import os
+from functools import lru_cache
+
+from dotenv import load_dotenv
+
+# Earlier files win: load_dotenv never overrides variables already set
+ENV_FILES = (
+    "config/.env",
+    "config/.env.local",
+    ".env",
+    ".env.local",
+)
+
+
+@lru_cache(maxsize=1)
+def load_env_once() -> None:
+    """Load the .env files that exist, only on the first call."""
+    for path in ENV_FILES:
+        if os.path.isfile(path):
+            load_dotenv(path, override=False)
@@ -4,24 +4,48 @@ Builds system prompt with tenant/client context, declares tools,
 and runs the function-calling loop (max 5 iterations).
 """
 
-import json
+import asyncio
+import functools
 import logging
 import os
 import re
-from typing import Optional
+import time
+from typing import Awaitable, Callable, Optional
 
+import orjson
 from google import genai
 from google.genai import types
 
-from src.conversation_manager import get_conversation_history
+from src.conversation_manager import HistoryMessage, get_conversation_history
 from src.supabase_client import get_supabase
 from src.tools import ALL_TOOLS
-from src.utils import format_date_italian
+from src.utils import format_date_italian, is_full_name
 
 logger = logging.getLogger("BOT.gemini")
 
 MAX_TOOL_ROUNDS = 5
 
+# Tools whose result message is the final reply: no follow-up Gemini round.
+# (update_client_name is not one: booking usually continues right after.)
+_TERMINAL_TOOLS = {"request_human_operator"}
+
+# Tools without side effects: identical calls within one turn reuse the result
+_READ_ONLY_TOOLS = {
+    "get_services",
+    "get_service_info",
+    "get_center_info",
+    "check_availability",
+    "get_my_appointments",
+}
+
+# Cache: tenant_id -> (rows, timestamp). Services/staff change rarely.
+_services_cache: dict[str, tuple[list[dict], float]] = {}
+_staff_cache: dict[str, tuple[list[dict], float]] = {}
+CATALOG_CACHE_TTL = 300  # 5 minutes
+
+# Rendered SERVIZI/OPERATORI prompt block: tenant_id -> (catalog_etag, text)
+_catalog_block_cache: dict[str, tuple[int, str]] = {}
+
 
 def _seems_to_confirm_availability(response_text: str, user_message: str) -> bool:
     """
@@ -53,7 +77,13 @@ def _seems_to_confirm_availability(response_text: str, user_message: str) -> boo
 
 
 def _fetch_tenant_services(tenant_id: str) -> list[dict]:
-    """Fetch active services for a tenant from Supabase."""
+    """Fetch active services for a tenant from Supabase (cached 5 minutes)."""
+    now = time.monotonic()
+    if tenant_id in _services_cache:
+        services, cached_at = _services_cache[tenant_id]
+        if now - cached_at < CATALOG_CACHE_TTL:
+            return services
+
     sb = get_supabase()
     try:
         response = (
@@ -65,14 +95,22 @@ def _fetch_tenant_services(tenant_id: str) -> list[dict]:
             .order("name")
             .execute()
         )
-        return response.data or []
+        services = response.data or []
+        _services_cache[tenant_id] = (services, now)
+        return services
     except Exception as e:
         logger.error(f"Error fetching services for prompt: {e}")
         return []
 
 
 def _fetch_tenant_staff(tenant_id: str) -> list[dict]:
-    """Fetch active staff for a tenant from Supabase."""
+    """Fetch active staff for a tenant from Supabase (cached 5 minutes)."""
+    now = time.monotonic()
+    if tenant_id in _staff_cache:
+        staff, cached_at = _staff_cache[tenant_id]
+        if now - cached_at < CATALOG_CACHE_TTL:
+            return staff
+
     sb = get_supabase()
     try:
         response = (
@@ -83,25 +121,43 @@ def _fetch_tenant_staff(tenant_id: str) -> list[dict]:
             .order("name")
             .execute()
         )
-        return response.data or []
+        staff = response.data or []
+        _staff_cache[tenant_id] = (staff, now)
+        return staff
     except Exception as e:
         logger.error(f"Error fetching staff for prompt: {e}")
         return []
 
 
+def invalidate_catalog_cache(tenant_id: str | None = None) -> None:
+    """Clear cached services/staff (one tenant, or everything)."""
+    if tenant_id:
+        _services_cache.pop(tenant_id, None)
+        _staff_cache.pop(tenant_id, None)
+        _catalog_block_cache.pop(tenant_id, None)
+    else:
+        _services_cache.clear()
+        _staff_cache.clear()
+        _catalog_block_cache.clear()
+
+
 def _format_services_for_prompt(services: list[dict]) -> str:
     """Format services list for inclusion in system prompt."""
     if not services:
         return "Nessun servizio disponibile al momento."
-    lines = []
-    for s in services:
-        desc = s.get("descrizione_breve") or s.get("description") or ""
-        price = f"€{float(s['price']):.2f}" if s.get("price") else "prezzo da definire"
-        duration = f"{s['duration_min']} min" if s.get("duration_min") else "durata da definire"
-        lines.append(f"- {s['name']} | {duration} | {price} | ID: {s['id']}")
-        if desc:
-            lines.append(f"  {desc}")
-    return "\n".join(lines)
+    return "\n".join(_format_service_line(s) for s in services)
+
+
+def _format_service_line(s: dict) -> str:
+    """One service entry: summary line, plus the short description if any."""
+    get = s.get
+    price = get("price")
+    duration = get("duration_min")
+    desc = get("descrizione_breve") or get("description")
+    price_str = f"€{float(price):.2f}" if price else "prezzo da definire"
+    duration_str = f"{duration} min" if duration else "durata da definire"
+    line = f"- {s['name']} | {duration_str} | {price_str} | ID: {s['id']}"
+    return f"{line}\n  {desc}" if desc else line
 
 
 def _format_staff_for_prompt(staff: list[dict]) -> str:
@@ -111,48 +167,8 @@ def _format_staff_for_prompt(staff: list[dict]) -> str:
     return "\n".join(f"- {s['name']} | ID: {s['id']}" for s in staff)
 
 
-def _build_system_prompt(tenant: dict, client: dict, services: list[dict], staff: list[dict]) -> str:
-    """Build the system prompt with tenant and client context."""
-    tenant_name = tenant.get("name", "Centro Estetico")
-    tenant_phone = tenant.get("phone", "")
-    tenant_address = tenant.get("address", "")
-    tenant_email = tenant.get("email", "")
-
-    # Usa SOLO il campo name (verificato), mai il whatsapp_name (potrebbe essere emoji/nickname)
-    client_name = (client.get("name") or "").strip()
-    # Il nome è valido SOLO se ha almeno 2 parole composte da lettere (no emoji, numeri, ecc.)
-    name_parts = [p for p in client_name.split() if p.isalpha()] if client_name else []
-    name_is_complete = len(name_parts) >= 2
-    # Se il nome non è valido, non mostrarlo a Gemini
-    if not name_is_complete:
-        client_name = ""
-
-    services_text = _format_services_for_prompt(services)
-    staff_text = _format_staff_for_prompt(staff)
-
-    return f"""Sei l'assistente virtuale WhatsApp di "{tenant_name}", un centro estetico.
-Rispondi sempre in italiano, con tono professionale ma cordiale e accogliente.
-
-INFORMAZIONI CENTRO:
-- Nome: {tenant_name}
-- Telefono: {tenant_phone}
-- Indirizzo: {tenant_address}
-- Email: {tenant_email}
-
-INFORMAZIONI CLIENTE:
-- Nome: {client_name or 'NON DISPONIBILE'}
-- Nome completo (nome + cognome): {"SI" if name_is_complete else "NO — DEVI chiedere nome e cognome completo PRIMA di qualsiasi prenotazione"}
-- ID: {client.get('id', 'N/A')}
-
-SERVIZI DISPONIBILI (lista completa e aggiornata dal database):
-{services_text}
-
-OPERATORI DISPONIBILI:
-{staff_text}
-
-LA DATA DI OGGI È: {format_date_italian()}. Usa SEMPRE questa data per calcolare "oggi", "domani", "dopodomani". IGNORA date nei messaggi precedenti.
-
-=== REGOLA CRITICA: DISPONIBILITÀ ===
+# Static prompt sections (no per-tenant or per-client data)
+_CRITICAL_RULE_BLOCK = """=== REGOLA CRITICA: DISPONIBILITÀ ===
 Quando il cliente menziona un orario, chiede se è disponibile, o vuole prenotare:
 1. DEVI chiamare check_availability() COME PRIMA AZIONE — prima di scrivere qualsiasi testo
 2. Rispondi SOLO in base agli slot restituiti dal tool
@@ -167,9 +183,9 @@ ESEMPIO SBAGLIATO (DA NON FARE MAI):
   Tu: "Sì, è disponibile!" ← VIETATO senza aver chiamato check_availability
 
 Se NON chiami check_availability prima di confermare un orario, darai informazioni FALSE al cliente.
-=== FINE REGOLA CRITICA ===
+=== FINE REGOLA CRITICA ==="""
 
-ALTRE REGOLE:
+_RULES_BLOCK = """ALTRE REGOLE:
 1. I servizi elencati sopra sono gli UNICI offerti. NON inventare servizi non in lista.
 2. Per prezzi e durate, usa SOLO i dati dalla lista sopra.
 3. PRIMA di prenotare, CONTROLLA "Nome completo" sopra. Se è "NO", chiedi nome e cognome e salvalo con update_client_name. NON prenotare se il nome è "NO".
@@ -181,12 +197,94 @@ ALTRE REGOLE:
 9. Per info dettagliate su un servizio, usa get_service_info.
 10. Per cancellare/modificare appuntamenti, usa prima get_my_appointments poi cancel_appointment o modify_appointment.
 11. Gli appuntamenti prenotati via WhatsApp hanno stato "in attesa di conferma" (pending). Il cliente riceverà un messaggio la mattina del giorno PRIMA per confermare, cancellare o spostare. Comunica questo dopo ogni prenotazione.
-12. Se il cliente vuole confermare un appuntamento pending, usa confirm_appointment. Se vuole cancellare, usa cancel_appointment. Se vuole spostare, usa modify_appointment.
+12. Se il cliente vuole confermare un appuntamento pending, usa confirm_appointment. Se vuole cancellare, usa cancel_appointment. Se vuole spostare, usa modify_appointment."""
+
+
+@functools.lru_cache(maxsize=128)
+def _build_center_block(name: str, phone: str, address: str, email: str) -> str:
+    """Prompt intro + INFORMAZIONI CENTRO (static per tenant)."""
+    return f"""Sei l'assistente virtuale WhatsApp di "{name}", un centro estetico.
+Rispondi sempre in italiano, con tono professionale ma cordiale e accogliente.
+
+INFORMAZIONI CENTRO:
+- Nome: {name}
+- Telefono: {phone}
+- Indirizzo: {address}
+- Email: {email}"""
+
+
+def _catalog_etag(services: list[dict], staff: list[dict]) -> int:
+    """Hash of the fields rendered in the catalog block."""
+    return hash((
+        tuple(
+            (s["id"], s["name"], s.get("price"), s.get("duration_min"),
+             s.get("descrizione_breve"), s.get("description"))
+            for s in services
+        ),
+        tuple((s["id"], s["name"]) for s in staff),
+    ))
+
+
+def _build_catalog_block(tenant_id: str, services: list[dict], staff: list[dict]) -> str:
+    """SERVIZI + OPERATORI prompt block, re-rendered only when the catalog changes."""
+    etag = _catalog_etag(services, staff)
+    cached = _catalog_block_cache.get(tenant_id)
+    if cached and cached[0] == etag:
+        return cached[1]
+
+    block = f"""SERVIZI DISPONIBILI (lista completa e aggiornata dal database):
+{_format_services_for_prompt(services)}
+
+OPERATORI DISPONIBILI:
+{_format_staff_for_prompt(staff)}"""
+    _catalog_block_cache[tenant_id] = (etag, block)
+    return block
+
+
+def _build_system_prompt(tenant: dict, client: dict, services: list[dict], staff: list[dict]) -> str:
+    """Build the system prompt with tenant and client context."""
+    center_block = _build_center_block(
+        tenant.get("name", "Centro Estetico"),
+        tenant.get("phone", ""),
+        tenant.get("address", ""),
+        tenant.get("email", ""),
+    )
+    catalog_block = _build_catalog_block(tenant.get("id", ""), services, staff)
+
+    # Usa SOLO il campo name (verificato), mai il whatsapp_name (potrebbe essere emoji/nickname)
+    client_name = (client.get("name") or "").strip()
+    # Il nome è valido SOLO se ha almeno 2 parole composte da lettere (no emoji, numeri, ecc.)
+    name_is_complete = is_full_name(client_name)
+    # Se il nome non è valido, non mostrarlo a Gemini
+    if not name_is_complete:
+        client_name = ""
+
+    return f"""{center_block}
+
+INFORMAZIONI CLIENTE:
+- Nome: {client_name or 'NON DISPONIBILE'}
+- Nome completo (nome + cognome): {"SI" if name_is_complete else "NO — DEVI chiedere nome e cognome completo PRIMA di qualsiasi prenotazione"}
+- ID: {client.get('id', 'N/A')}
+
+{catalog_block}
+
+LA DATA DI OGGI È: {format_date_italian()}. Usa SEMPRE questa data per calcolare "oggi", "domani", "dopodomani". IGNORA date nei messaggi precedenti.
+
+{_CRITICAL_RULE_BLOCK}
+
+{_RULES_BLOCK}
 """
 
 
+@functools.cache
+def _get_gemini_client(api_key: str) -> genai.Client:
+    """Return the Gemini client for this API key (built once, reused)."""
+    return genai.Client(api_key=api_key)
+
+
+@functools.cache
 def _get_tool_declarations() -> list[types.FunctionDeclaration]:
-    """Build Gemini function declarations from our tool functions."""
+    """Build Gemini function declarations from our tool functions (once)."""
     declarations = []
 
     tool_schemas = {
@@ -282,10 +380,15 @@ def _get_tool_declarations() -> list[types.FunctionDeclaration]:
             },
         },
         "get_my_appointments": {
-            "description": "Recupera gli appuntamenti futuri del cliente.",
+            "description": "Recupera gli appuntamenti futuri del cliente (max 50 per pagina).",
             "parameters": {
                 "type": "OBJECT",
-                "properties": {},
+                "properties": {
+                    "after": {
+                        "type": "STRING",
+                        "description": "Valore next_cursor della risposta precedente, per la pagina successiva (opzionale)",
+                    },
+                },
             },
         },
         "modify_appointment": {
@@ -362,12 +465,21 @@ def _get_tool_declarations() -> list[types.FunctionDeclaration]:
     return declarations
 
 
-def _find_tool_function(name: str):
+@functools.cache
+def _get_tools() -> list[types.Tool]:
+    """Tool config passed to every generate_content call (built once)."""
+    return [types.Tool(function_declarations=_get_tool_declarations())]
+
+
+# Tool name -> async tool function
+_TOOL_REGISTRY: dict[str, Callable[..., Awaitable[dict]]] = {
+    fn.__name__: fn for fn in ALL_TOOLS
+}
+
+
+def _find_tool_function(name: str) -> Optional[Callable[..., Awaitable[dict]]]:
     """Find the tool function by name."""
-    for tool_fn in ALL_TOOLS:
-        if tool_fn.__name__ == name:
-            return tool_fn
-    return None
+    return _TOOL_REGISTRY.get(name)
 
 
 async def process_message(
@@ -375,9 +487,11 @@ async def process_message(
     client: dict,
     conversation: dict,
     user_message: str,
+    history: Optional[list[HistoryMessage]] = None,
 ) -> Optional[dict]:
     """
     Process a user message through Gemini with function calling.
+    history: previously loaded conversation history (fetched here if None).
     Returns dict {"text": str, "tool_context": {...} | None} or None.
     """
     api_key = os.getenv("GOOGLE_API_KEY")
@@ -385,40 +499,43 @@ async def process_message(
         logger.error("GOOGLE_API_KEY not set")
         return {"text": "Ci scusi, il servizio non è momentaneamente disponibile.", "tool_context": None}
 
-    gemini_client = genai.Client(api_key=api_key)
+    gemini_client = _get_gemini_client(api_key)
+
+    conversation_id = conversation.get("id")
+    tenant_id = tenant["id"]
+
+    # Services/staff (sync client, off the loop) and history load concurrently
+    if history is None and client.get("id"):
+        history_task = get_conversation_history(
+            tenant_id=tenant_id,
+            client_id=client.get("id"),
+            client_phone=client.get("whatsapp_phone", ""),
+        )
+    else:
+        history_task = asyncio.sleep(0, result=history or [])
 
-    # Fetch fresh services and staff from Supabase for this tenant
-    services = _fetch_tenant_services(tenant["id"])
-    staff = _fetch_tenant_staff(tenant["id"])
+    services, staff, history = await asyncio.gather(
+        asyncio.to_thread(_fetch_tenant_services, tenant_id),
+        asyncio.to_thread(_fetch_tenant_staff, tenant_id),
+        history_task,
+    )
 
     system_prompt = _build_system_prompt(tenant, client, services, staff)
-    tool_declarations = _get_tool_declarations()
 
     # Build conversation history
-    conversation_id = conversation.get("id")
-    tenant_id = tenant["id"]
-    history = await get_conversation_history(
-        tenant_id=tenant_id,
-        client_id=client.get("id"),
-        client_phone=client.get("whatsapp_phone", ""),
-    ) if client.get("id") else []
-
     contents = []
     for msg in history:
-        role = "user" if msg["role"] == "user" else "model"
-        contents.append(types.Content(role=role, parts=[types.Part.from_text(text=msg["content"])]))
+        role = "user" if msg.role == "user" else "model"
+        contents.append(types.Content(role=role, parts=[types.Part.from_text(text=msg.content)]))
 
     # Add current user message
     contents.append(
         types.Content(role="user", parts=[types.Part.from_text(text=user_message)])
     )
 
-    # Tool config
-    tools = [types.Tool(function_declarations=tool_declarations)]
-
     config = types.GenerateContentConfig(
         system_instruction=system_prompt,
-        tools=tools,
+        tools=_get_tools(),
         temperature=0.7,
         max_output_tokens=1024,
     )
@@ -434,11 +551,13 @@ async def process_message(
     last_tool_name = None
     last_tool_result = None
     availability_checked = False  # Guardrail: track if check_availability was called
+    # Read-only tool results for this turn, keyed by (name, args)
+    turn_memo: dict[bytes, dict] = {}
 
     try:
         # Function calling loop
         for round_num in range(MAX_TOOL_ROUNDS):
-            response = gemini_client.models.generate_content(
+            response = await gemini_client.aio.models.generate_content(
                 model="gemini-2.5-flash",
                 contents=contents,
                 config=config,
@@ -508,10 +627,13 @@ async def process_message(
             contents.append(candidate.content)
 
             function_responses = []
+            round_results = []
+            round_memo: dict[bytes, dict] = {}
             for fc_part in function_calls:
                 fc = fc_part.function_call
                 fn_name = fc.name
-                fn_args = dict(fc.args) if fc.args else {}
+                # google-genai already exposes args as a plain dict: no copy needed
+                fn_args = fc.args or {}
 
                 logger.info(f"Tool call: {fn_name}({fn_args})")
 
@@ -520,8 +642,19 @@ async def process_message(
                                "modify_appointment", "get_my_appointments"):
                     availability_checked = True
 
+                # Identical call already answered (a read-only tool since the
+                # last write, or a write earlier in this round): reuse the result
+                call_key = orjson.dumps(
+                    [fn_name, fn_args], default=str, option=orjson.OPT_SORT_KEYS
+                )
                 tool_fn = _find_tool_function(fn_name)
-                if tool_fn:
+                if call_key in round_memo or call_key in turn_memo:
+                    result = round_memo.get(call_key, turn_memo.get(call_key))
+                    logger.info(f"Tool call {fn_name} deduplicated")
+                    if "error" not in result:
+                        last_tool_name = fn_name
+                        last_tool_result = result
+                elif tool_fn:
                     try:
                         result = await tool_fn(**fn_args, **tool_context)
                         # Track for interactive message routing
@@ -530,10 +663,20 @@ async def process_message(
                     except Exception as e:
                         logger.error(f"Tool {fn_name} error: {e}")
                         result = {"error": str(e)}
+                    if fn_name in _READ_ONLY_TOOLS:
+                        if "error" not in result:
+                            turn_memo[call_key] = result
+                    else:
+                        turn_memo.clear()  # a write may change what reads return
+                        if "error" not in result:
+                            round_memo[call_key] = result
                 else:
                     result = {"error": f"Unknown tool: {fn_name}"}
 
-                result_str = json.dumps(result, ensure_ascii=False, default=str)
+                round_results.append((fn_name, result))
+                result_str = orjson.dumps(
+                    result, default=str, option=orjson.OPT_NON_STR_KEYS
+                ).decode()
                 function_responses.append(
                     types.Part.from_function_response(
                         name=fn_name,
@@ -541,6 +684,24 @@ async def process_message(
                     )
                 )
 
+            # Terminal tools only (handoff): reply with the tool's own message,
+            # no further Gemini round
+            if all(
+                name in _TERMINAL_TOOLS
+                and isinstance(result, dict)
+                and result.get("message")
+                and not result.get("error")
+                for name, result in round_results
+            ):
+                messages = dict.fromkeys(result["message"] for _, result in round_results)
+                return {
+                    "text": "\n".join(messages),
+                    "tool_context": {
+                        "last_tool": last_tool_name,
+                        "last_result": last_tool_result,
+                    },
+                }
+
             contents.append(
                 types.Content(role="user", parts=function_responses)
             )
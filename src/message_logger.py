@@ -0,0 +1,120 @@
+"""
+Micro-batched message logging.
+
+log_message() enqueues rows here instead of writing them one by one;
+a single background task flushes them in batches (up to FLUSH_BATCH_SIZE
+rows or every FLUSH_INTERVAL seconds) with one RPC per batch.
+Started/stopped by the FastAPI lifespan.
+"""
+
+import asyncio
+import logging
+from typing import Optional
+
+from src.supabase_client import get_async_supabase
+
+logger = logging.getLogger("BOT.message_logger")
+
+FLUSH_BATCH_SIZE = 50
+FLUSH_INTERVAL = 0.1  # seconds
+QUEUE_MAX_SIZE = 5_000
+
+_queue: Optional[asyncio.Queue] = None
+_flush_task: Optional[asyncio.Task] = None
+_STOP = object()
+
+
+def is_running() -> bool:
+    return _flush_task is not None and not _flush_task.done()
+
+
+async def enqueue(row: dict) -> bool:
+    """
+    Queue a whatsapp_messages row (plus its conversation_id) for the next flush.
+    Returns False if the logger isn't running, so the caller can write directly.
+    """
+    if not is_running():
+        return False
+    await _queue.put(row)
+    return True
+
+
+def start() -> None:
+    """Start the flush loop on the running event loop."""
+    global _queue, _flush_task
+    if is_running():
+        return
+    _queue = asyncio.Queue(maxsize=QUEUE_MAX_SIZE)
+    _flush_task = asyncio.create_task(_flush_loop())
+    logger.info("Message logger started")
+
+
+async def stop() -> None:
+    """Flush pending rows and stop the loop."""
+    global _flush_task
+    if not is_running():
+        return
+    await _queue.put(_STOP)
+    await _flush_task
+    _flush_task = None
+    logger.info("Message logger stopped")
+
+
+async def _flush_loop() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await _queue.get()
+        if item is _STOP:
+            return
+
+        batch = [item]
+        stopping = False
+        deadline = loop.time() + FLUSH_INTERVAL
+        while len(batch) < FLUSH_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is _STOP:
+                stopping = True
+                break
+            batch.append(item)
+
+        await _flush(batch)
+        if stopping:
+            return
+
+
+async def _flush(batch: list[dict]) -> None:
+    """Write a batch: one RPC (insert + grouped counter update), or legacy fallback."""
+    asb = get_async_supabase()
+
+    try:
+        await asb.rpc("log_wa_messages", {"p_messages": batch}).execute()
+        return
+    except Exception as e:
+        logger.warning(f"log_wa_messages RPC unavailable, using legacy: {e}")
+
+    # ── Legacy fallback: one multi-row insert + one update per conversation ──
+    try:
+        rows = [{k: v for k, v in row.items() if k != "conversation_id"} for row in batch]
+        await asb.from_("whatsapp_messages").insert(rows, returning="minimal").execute()
+
+        last_at: dict[str, str] = {}
+        for row in batch:
+            conv_id = row.get("conversation_id")
+            if conv_id:
+                last_at[conv_id] = max(last_at.get(conv_id, ""), row["created_at"])
+
+        await asyncio.gather(*(
+            asb.from_("whatsapp_conversations").update({
+                "last_message_at": ts,
+                "updated_at": ts,
+            }, returning="minimal").eq("id", conv_id).execute()
+            for conv_id, ts in last_at.items()
+        ))
+    except Exception as e:
+        logger.error(f"Error flushing {len(batch)} messages: {e}")
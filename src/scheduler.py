@@ -2,26 +2,32 @@
 APScheduler jobs for appointment reminders and confirmations.
 
 Jobs:
-1. Morning confirmation (cron 08:00): confirm/cancel/modify for pending appointments TOMORROW
-2. Reminder 1h before appointment (every 5 min): only for confirmed appointments
+1. Morning confirmation (cron 09:00): confirm/cancel/modify for pending appointments TOMORROW
+2. Reminders (every 5 min, one query for both windows):
+   - 1h before appointment: only for confirmed appointments
+   - day before appointment: unofficial WA tenants
 """
 
 import asyncio
+import functools
 import logging
-from datetime import datetime, timedelta, timezone
+import os
+import time
+from datetime import datetime, time as dt_time, timedelta, timezone
 
-import pytz
-from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 from src.supabase_client import get_supabase
-from src.whatsapp_api import send_template_message, send_text_message, send_button_message
-from src.utils import format_datetime_italian
+from src.whatsapp_api import (
+    send_button_message,
+    send_template_message,
+    send_text_message,
+)
+from src.utils import ROME_TZ, format_datetime_italian, nested_get, parse_iso_datetime, run_query
 from src.whatsapp_unofficial import send_message as send_unofficial_message
 
 logger = logging.getLogger("BOT.scheduler")
 
-ROME_TZ = pytz.timezone("Europe/Rome")
-
 # Sentry (optional)
 try:
     import sentry_sdk
@@ -29,30 +35,107 @@ try:
 except ImportError:
     _SENTRY = False
 
-_scheduler: BackgroundScheduler | None = None
+_scheduler: AsyncIOScheduler | None = None
 
+JOB_TIMEOUT = 600  # seconds, max run time of one job
 
-def _run_async(coro):
-    """Run an async function from sync context."""
-    try:
-        loop = asyncio.get_event_loop()
-        if loop.is_running():
-            asyncio.ensure_future(coro)
+# Cache: tenant_id -> (tenant_dict, timestamp). Avoids joining tenants per appointment.
+_tenant_cache: dict[str, tuple[dict, float]] = {}
+TENANT_CACHE_TTL = 600  # 10 minutes
+TENANT_COLUMNS = "id, whatsapp_phone_number_id, whatsapp_access_token, wa_mode"
+
+# Max concurrent WhatsApp sends per job run
+SEND_CONCURRENCY = int(os.getenv("WA_MAX_CONC", "20"))
+
+
+def _get_tenants(sb, tenant_ids: set[str]) -> dict[str, dict]:
+    """
+    Return tenant WhatsApp settings by id.
+    Cached for 10 minutes; missing tenants are fetched in one query.
+    """
+    now = time.monotonic()
+    tenants: dict[str, dict] = {}
+    missing = []
+    for tenant_id in tenant_ids:
+        cached = _tenant_cache.get(tenant_id)
+        if cached and now - cached[1] < TENANT_CACHE_TTL:
+            tenants[tenant_id] = cached[0]
         else:
-            loop.run_until_complete(coro)
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(coro)
+            missing.append(tenant_id)
+
+    if missing:
+        try:
+            response = sb.table("tenants").select(TENANT_COLUMNS).in_("id", missing).execute()
+            for tenant in response.data or []:
+                _tenant_cache[tenant["id"]] = (tenant, now)
+                tenants[tenant["id"]] = tenant
+        except Exception as e:
+            logger.error(f"Error fetching tenants for scheduler: {e}")
+
+    return tenants
+
+
+async def _gather_bounded(coros) -> list:
+    """Run send coroutines concurrently, at most SEND_CONCURRENCY at a time."""
+    semaphore = asyncio.Semaphore(SEND_CONCURRENCY)
+
+    async def _run(coro):
+        async with semaphore:
+            return await coro
+
+    results = await asyncio.gather(*(_run(c) for c in coros), return_exceptions=True)
+    for r in results:
+        if isinstance(r, Exception):
+            logger.error(f"Scheduled send failed: {r}")
+    return results
+
+
+@functools.lru_cache(maxsize=512)
+def _format_start(start_at: str) -> tuple[str, str]:
+    """
+    Italian date + time and Rome "HH:MM" for an appointment start_at.
+    Cached: appointments in the same run mostly share a handful of slots.
+    """
+    start = parse_iso_datetime(start_at).astimezone(ROME_TZ)
+    return format_datetime_italian(start), f"{start.hour:02d}:{start.minute:02d}"
+
+
+def _body_components(*texts: str) -> list[dict]:
+    """Template components with one text parameter per value, in order."""
+    return [{"type": "body", "parameters": [{"type": "text", "text": t} for t in texts]}]
+
+
+def _mark_sent_at(sb, column: str, now: datetime, appts: list[dict]) -> None:
+    """Stamp a *_sent_at column on the sent appointments (one UPDATE)."""
+    if not appts:
+        return
+    try:
+        sb.table("appointments").update({column: now.isoformat()}, returning="minimal").in_(
+            "id", [a["id"] for a in appts]
+        ).execute()
+    except Exception as e:
+        logger.error(f"Error setting {column} for {len(appts)} appointments: {e}")
+
+
+def _release_claims(sb, column: str, appts: list[dict]) -> None:
+    """Reset a *_sent_at column claimed by an RPC for appointments not sent."""
+    if not appts:
+        return
+    try:
+        sb.table("appointments").update({column: None}, returning="minimal").in_(
+            "id", [a["id"] for a in appts]
+        ).execute()
+    except Exception as e:
+        logger.error(f"Error releasing {column} for {len(appts)} appointments: {e}")
 
 
 # ─── Job: Morning Confirmation (pending appointments for tomorrow) ────
 
 
-def _job_morning_confirmation():
+async def _job_morning_confirmation():
     """Send confirmation requests for pending appointments happening tomorrow."""
     try:
-        _run_async(_send_morning_confirmations())
+        await asyncio.wait_for(_send_morning_confirmations(), timeout=JOB_TIMEOUT)
     except Exception as e:
         logger.exception(f"Error in morning_confirmation job: {e}")
         if _SENTRY:
@@ -70,43 +153,53 @@ async def _send_morning_confirmations():
     tomorrow = (now_rome + timedelta(days=1)).date()
 
     # Tomorrow's boundaries in UTC for DB query
-    tomorrow_start = ROME_TZ.localize(
-        datetime.combine(tomorrow, datetime.min.time())
-    ).astimezone(timezone.utc)
-    tomorrow_end = ROME_TZ.localize(
-        datetime.combine(tomorrow + timedelta(days=1), datetime.min.time())
+    tomorrow_start = datetime.combine(tomorrow, dt_time.min, tzinfo=ROME_TZ).astimezone(timezone.utc)
+    tomorrow_end = datetime.combine(
+        tomorrow + timedelta(days=1), dt_time.min, tzinfo=ROME_TZ
     ).astimezone(timezone.utc)
 
     sb = get_supabase()
+    now = datetime.now(timezone.utc)
 
+    # ── Claim + fetch in one statement via PostgreSQL RPC ────
+    claimed = True
     try:
-        response = (
-            sb.table("appointments")
-            .select(
-                "id, start_at, status, notes, "
-                "client:clients(id, whatsapp_phone, name, first_name, bot_enabled, reminder_morning_enabled), "
-                "service:services(name), "
-                "staff:staff(name), "
-                "tenant:tenants(id, name, whatsapp_phone_number_id, whatsapp_access_token, wa_mode)"
-            )
-            .eq("status", "pending")
-            .gte("start_at", tomorrow_start.isoformat())
-            .lt("start_at", tomorrow_end.isoformat())
-            .execute()
-        )
+        response = await run_query(sb.rpc(
+            "claim_morning_confirmations",
+            {"p_start": tomorrow_start.isoformat(), "p_end": tomorrow_end.isoformat()},
+        ))
     except Exception as e:
-        logger.error(f"Morning confirmation query error: {e}")
-        return
-
-    now = datetime.now(timezone.utc)
+        logger.warning(f"claim_morning_confirmations RPC unavailable, using legacy: {e}")
+        claimed = False
 
-    for appt in response.data:
-        notes = appt.get("notes") or ""
-        if "morning_confirm" in notes:
-            continue
+    # ── Legacy fallback (select now, mark after sending) ─────
+    if not claimed:
+        try:
+            response = await run_query(
+                sb.table("appointments")
+                .select(
+                    "id, start_at, tenant_id, "
+                    "client:clients(whatsapp_phone, name, first_name, bot_enabled, reminder_morning_enabled), "
+                    "service:services(name), "
+                    "tenants!inner()"  # filter only: tenants with Cloud API credentials
+                )
+                .eq("status", "pending")
+                .is_("morning_confirm_sent_at", "null")
+                .not_.is_("tenants.whatsapp_phone_number_id", "null")
+                .not_.is_("tenants.whatsapp_access_token", "null")
+                .gte("start_at", tomorrow_start.isoformat())
+                .lt("start_at", tomorrow_end.isoformat())
+            )
+        except Exception as e:
+            logger.error(f"Morning confirmation query error: {e}")
+            return
 
+    appts = response.data or []
+    eligible = []
+    tenants = await asyncio.to_thread(_get_tenants, sb, {a["tenant_id"] for a in appts})
+    for appt in appts:
         client = appt.get("client")
-        tenant = appt.get("tenant")
+        tenant = appt["tenant"] = tenants.get(appt["tenant_id"])
         if not client or not tenant or not client.get("whatsapp_phone"):
             continue
 
@@ -123,277 +216,267 @@ async def _send_morning_confirmations():
         if tenant.get("wa_mode") == "unofficial":
             continue
 
-        to_phone = client["whatsapp_phone"]
-        client_name = client.get("name") or client.get("first_name") or ""
-        service_name = (
-            appt.get("service", {}).get("name", "Appuntamento")
-            if appt.get("service") else "Appuntamento"
+        eligible.append(appt)
+
+    results = await _gather_bounded(_send_morning_confirmation(appt) for appt in eligible)
+    sent = [a for a, ok in zip(eligible, results) if ok is True]
+    if claimed:
+        # Release what was claimed but not sent, so a later run can retry it
+        sent_ids = {a["id"] for a in sent}
+        unsent = [a for a in appts if a["id"] not in sent_ids]
+        await asyncio.to_thread(_release_claims, sb, "morning_confirm_sent_at", unsent)
+    else:
+        await asyncio.to_thread(_mark_sent_at, sb, "morning_confirm_sent_at", now, sent)
+
+
+async def _send_morning_confirmation(appt: dict) -> bool:
+    """Send the confirm/cancel/modify request for one appointment."""
+    client = appt["client"]
+    tenant = appt["tenant"]
+    phone_number_id = tenant["whatsapp_phone_number_id"]
+    access_token = tenant["whatsapp_access_token"]
+
+    to_phone = client["whatsapp_phone"]
+    client_name = client.get("name") or client.get("first_name") or ""
+    service_name = nested_get(appt, "service", "name", "Appuntamento")
+    appt_id = appt["id"]
+    time_str, _ = _format_start(appt["start_at"])
+
+    sent = False
+    client_bot_enabled = client.get("bot_enabled", False)
+
+    if client_bot_enabled:
+        # Bot attivo: invia messaggio interattivo con bottoni
+        body = (
+            f"Ciao {client_name}!\n\n"
+            f"Ti ricordiamo il tuo appuntamento per "
+            f"*{service_name}* previsto per domani, *{time_str}*.\n\n"
+            f"Puoi confermare, cancellare o spostare:"
         )
-        start_at = datetime.fromisoformat(appt["start_at"].replace("Z", "+00:00"))
-        appt_id = appt["id"]
-        time_str = format_datetime_italian(start_at)
-
-        sent = False
-        client_bot_enabled = client.get("bot_enabled", False)
-
-        if client_bot_enabled:
-            # Bot attivo: invia messaggio interattivo con bottoni
-            body = (
-                f"Ciao {client_name}!\n\n"
-                f"Ti ricordiamo il tuo appuntamento per "
-                f"*{service_name}* previsto per domani, *{time_str}*.\n\n"
-                f"Puoi confermare, cancellare o spostare:"
+        buttons = [
+            {"id": f"confirm_appt_{appt_id}", "title": "Conferma"},
+            {"id": f"cancel_appt_{appt_id}", "title": "Cancella"},
+            {"id": f"modify_appt_{appt_id}", "title": "Sposta"},
+        ]
+
+        # Primary: button message (within 24h conversation window)
+        try:
+            result = await send_button_message(
+                phone_number_id, access_token, to_phone, body, buttons
             )
-            buttons = [
-                {"id": f"confirm_appt_{appt_id}", "title": "Conferma"},
-                {"id": f"cancel_appt_{appt_id}", "title": "Cancella"},
-                {"id": f"modify_appt_{appt_id}", "title": "Sposta"},
-            ]
+            if result is not None:
+                sent = True
+        except Exception as e:
+            logger.warning(f"Button message failed for {appt_id}, trying template: {e}")
 
-            # Primary: button message (within 24h conversation window)
+        # Fallback: template message (outside 24h window)
+        if not sent:
             try:
-                result = await send_button_message(
-                    phone_number_id, access_token, to_phone, body, buttons
+                await send_template_message(
+                    phone_number_id=phone_number_id,
+                    access_token=access_token,
+                    to=to_phone,
+                    template_name="appointment_confirm_morning",
+                    components=_body_components(client_name, service_name, time_str),
                 )
-                if result is not None:
-                    sent = True
-            except Exception as e:
-                logger.warning(f"Button message failed for {appt_id}, trying template: {e}")
-
-            # Fallback: template message (outside 24h window)
-            if not sent:
-                try:
-                    await send_template_message(
-                        phone_number_id=phone_number_id,
-                        access_token=access_token,
-                        to=to_phone,
-                        template_name="appointment_confirm_morning",
-                        components=[
-                            {
-                                "type": "body",
-                                "parameters": [
-                                    {"type": "text", "text": client_name},
-                                    {"type": "text", "text": service_name},
-                                    {"type": "text", "text": time_str},
-                                ],
-                            }
-                        ],
-                    )
-                    sent = True
-                except Exception as e:
-                    logger.error(f"Template message also failed for {appt_id}: {e}")
-                    if _SENTRY:
-                        sentry_sdk.capture_exception(e)
-
-        else:
-            # Bot non attivo: invia testo semplice senza bottoni
-            body = (
-                f"Ciao {client_name}!\n\n"
-                f"Ti ricordiamo il tuo appuntamento per "
-                f"*{service_name}* domani, *{time_str}*."
-            )
-            try:
-                result = await send_text_message(phone_number_id, access_token, to_phone, body)
-                if result is not None:
-                    sent = True
+                sent = True
             except Exception as e:
-                logger.error(f"Text reminder failed for {appt_id}: {e}")
+                logger.error(f"Template message also failed for {appt_id}: {e}")
                 if _SENTRY:
                     sentry_sdk.capture_exception(e)
 
-        if sent:
-            new_notes = f"{notes}\n[morning_confirm:{now.strftime('%Y-%m-%d %H:%M')}]".strip()
-            sb.table("appointments").update({"notes": new_notes}).eq("id", appt["id"]).execute()
-            logger.info(f"Morning confirmation sent for appointment {appt_id}")
-
-
-# ─── Job: 1h Reminder (only confirmed appointments) ──────────────
-
-
-def _job_reminder_1h():
-    """Send reminder 1h before appointment."""
-    try:
-        _run_async(_send_reminder_1h())
-    except Exception as e:
-        logger.exception(f"Error in reminder_1h job: {e}")
-        if _SENTRY:
-            sentry_sdk.capture_exception(e)
-
-
-async def _send_reminder_1h():
-    """Find confirmed appointments ~1h from now and send a reminder."""
-    sb = get_supabase()
-    now = datetime.now(timezone.utc)
-    target_start = now + timedelta(hours=1)
-    target_end = target_start + timedelta(minutes=5)
-
-    try:
-        response = (
-            sb.table("appointments")
-            .select(
-                "id, start_at, status, notes, "
-                "client:clients(id, whatsapp_phone, name, first_name, reminder_1h_enabled), "
-                "service:services(name), "
-                "staff:staff(name), "
-                "tenant:tenants(id, name, whatsapp_phone_number_id, whatsapp_access_token)"
-            )
-            .in_("status", ["confirmed"])
-            .gte("start_at", target_start.isoformat())
-            .lt("start_at", target_end.isoformat())
-            .execute()
-        )
-    except Exception as e:
-        logger.error(f"Reminder 1h query error: {e}")
-        return
-
-    for appt in response.data:
-        notes = appt.get("notes") or ""
-        if "reminder_1h" in notes:
-            continue
-
-        client = appt.get("client")
-        tenant = appt.get("tenant")
-        if not client or not tenant or not client.get("whatsapp_phone"):
-            continue
-
-        # Skip if 1h reminder disabled for this client
-        if not client.get("reminder_1h_enabled", True):
-            continue
-
-        phone_number_id = tenant.get("whatsapp_phone_number_id")
-        access_token = tenant.get("whatsapp_access_token")
-        if not phone_number_id or not access_token:
-            continue
-
-        to_phone = client["whatsapp_phone"]
-        client_name = client.get("name") or client.get("first_name") or ""
-        service_name = (
-            appt.get("service", {}).get("name", "Appuntamento")
-            if appt.get("service") else "Appuntamento"
+    else:
+        # Bot non attivo: invia testo semplice senza bottoni
+        body = (
+            f"Ciao {client_name}!\n\n"
+            f"Ti ricordiamo il tuo appuntamento per "
+            f"*{service_name}* domani, *{time_str}*."
         )
-        start_at = datetime.fromisoformat(appt["start_at"].replace("Z", "+00:00"))
-
         try:
-            msg = (
-                f"Ciao {client_name}! \n\n"
-                f"Ti ricordiamo il tuo appuntamento per *{service_name}* "
-                f"tra circa 1 ora ({start_at.astimezone(ROME_TZ).strftime('%H:%M')}).\n\n"
-                f"Ti aspettiamo!"
-            )
-            await send_text_message(phone_number_id, access_token, to_phone, msg)
-
-            new_notes = f"{notes}\n[reminder_1h:{now.strftime('%Y-%m-%d %H:%M')}]".strip()
-            sb.table("appointments").update({"notes": new_notes}).eq("id", appt["id"]).execute()
-            logger.info(f"Reminder 1h sent for appointment {appt['id']}")
-
+            result = await send_text_message(phone_number_id, access_token, to_phone, body)
+            if result is not None:
+                sent = True
         except Exception as e:
-            logger.error(f"Failed to send 1h reminder for {appt['id']}: {e}")
+            logger.error(f"Text reminder failed for {appt_id}: {e}")
             if _SENTRY:
                 sentry_sdk.capture_exception(e)
 
+    if sent:
+        logger.info(f"Morning confirmation sent for appointment {appt_id}")
+    return sent
 
-# ─── Job: Reminder giorno prima (tenant unofficial) ──────────────
 
+# ─── Job: Reminders (1h before + day before, every 5 min) ────────
 
-def _job_reminder_day_before():
-    """Send day-before reminder for unofficial WA tenants."""
+
+async def _job_reminders():
+    """Send the 1h and day-before reminders that are due."""
     try:
-        _run_async(_send_reminder_day_before())
+        await asyncio.wait_for(_send_reminders(), timeout=JOB_TIMEOUT)
     except Exception as e:
-        logger.exception(f"Error in reminder_day_before job: {e}")
+        logger.exception(f"Error in reminders job: {e}")
         if _SENTRY:
             sentry_sdk.capture_exception(e)
 
 
-async def _send_reminder_day_before():
+async def _send_reminders():
     """
-    Trova appuntamenti con start_at tra 23h55 e 24h05 da adesso
-    per tenant con wa_mode='unofficial'.
-    Invia promemoria via microservizio whatsapp-web.js.
-    Timing: se appuntamento è martedì alle 11:00, il promemoria
-    viene inviato lunedì alle 11:00 (±5 min).
+    Fetch both reminder windows with one query, then send concurrently:
+    - 1h reminder: confirmed appointments starting in 60-65 minutes
+    - day-before reminder (tenant unofficial): appuntamenti con start_at
+      tra 23h55 e 24h05 da adesso, via microservizio whatsapp-web.js.
+      Timing: se appuntamento è martedì alle 11:00, il promemoria
+      viene inviato lunedì alle 11:00 (±5 min).
     """
     sb = get_supabase()
     now = datetime.now(timezone.utc)
-    target_start = now + timedelta(hours=23, minutes=55)
-    target_end = now + timedelta(hours=24, minutes=5)
+    hour_start = now + timedelta(hours=1)
+    hour_end = hour_start + timedelta(minutes=5)
+    day_start = now + timedelta(hours=23, minutes=55)
+    day_end = now + timedelta(hours=24, minutes=5)
 
     try:
-        response = (
+        response = await run_query(
             sb.table("appointments")
             .select(
-                "id, start_at, notes, "
-                "client:clients(id, whatsapp_phone, name, first_name, reminder_morning_enabled), "
-                "service:services(name), "
-                "tenant:tenants(id, wa_mode)"
+                "id, start_at, tenant_id, "
+                "client:clients(whatsapp_phone, name, first_name, "
+                "reminder_1h_enabled, reminder_morning_enabled), "
+                "service:services(name)"
             )
             .in_("status", ["pending", "confirmed"])
-            .gte("start_at", target_start.isoformat())
-            .lt("start_at", target_end.isoformat())
-            .execute()
+            .or_(
+                f"and(status.eq.confirmed,reminder_1h_sent_at.is.null,"
+                f"start_at.gte.{hour_start.isoformat()},start_at.lt.{hour_end.isoformat()}),"
+                f"and(reminder_day_before_sent_at.is.null,"
+                f"start_at.gte.{day_start.isoformat()},start_at.lt.{day_end.isoformat()})"
+            )
         )
     except Exception as e:
-        logger.error(f"Reminder day before query error: {e}")
+        logger.error(f"Reminders query error: {e}")
         return
 
-    now_str = now.strftime("%Y-%m-%d %H:%M")
+    appts = response.data or []
+    tenants = await asyncio.to_thread(_get_tenants, sb, {a["tenant_id"] for a in appts})
+    hour_before, day_before = [], []
+    for appt in appts:
+        appt["tenant"] = tenants.get(appt["tenant_id"])
+        if parse_iso_datetime(appt["start_at"]) < hour_end:
+            if _is_due_reminder_1h(appt):
+                hour_before.append(appt)
+        elif _is_due_reminder_day_before(appt):
+            day_before.append(appt)
+
+    results = await _gather_bounded([
+        *(_send_reminder_1h_one(appt) for appt in hour_before),
+        *(_send_reminder_day_before_one(appt) for appt in day_before),
+    ])
+    sent_1h = [a for a, ok in zip(hour_before, results) if ok is True]
+    sent_day_before = [a for a, ok in zip(day_before, results[len(hour_before):]) if ok is True]
+    await asyncio.to_thread(_mark_sent_at, sb, "reminder_1h_sent_at", now, sent_1h)
+    await asyncio.to_thread(_mark_sent_at, sb, "reminder_day_before_sent_at", now, sent_day_before)
+
+
+def _is_due_reminder_1h(appt: dict) -> bool:
+    """Whether a 1h-window appointment should get the reminder (official API)."""
+    client = appt.get("client")
+    tenant = appt["tenant"]
+    if not client or not tenant or not client.get("whatsapp_phone"):
+        return False
+
+    # Skip if 1h reminder disabled for this client
+    if not client.get("reminder_1h_enabled", True):
+        return False
+
+    return bool(tenant.get("whatsapp_phone_number_id") and tenant.get("whatsapp_access_token"))
+
+
+def _is_due_reminder_day_before(appt: dict) -> bool:
+    """Whether a day-before-window appointment should get the reminder (unofficial WA)."""
+    client = appt.get("client")
+    tenant = appt["tenant"]
+    if not client or not tenant:
+        return False
+    if tenant.get("wa_mode") != "unofficial":
+        return False
+    if not client.get("reminder_morning_enabled", True):
+        return False
+    return bool(client.get("whatsapp_phone"))
+
+
+async def _send_reminder_1h_one(appt: dict) -> bool:
+    """Send the 1h reminder for one appointment."""
+    client = appt["client"]
+    tenant = appt["tenant"]
+    phone_number_id = tenant["whatsapp_phone_number_id"]
+    access_token = tenant["whatsapp_access_token"]
+
+    to_phone = client["whatsapp_phone"]
+    client_name = client.get("name") or client.get("first_name") or ""
+    service_name = nested_get(appt, "service", "name", "Appuntamento")
+    _, hour_str = _format_start(appt["start_at"])
 
-    for appt in response.data:
-        notes = appt.get("notes") or ""
-        if "reminder_day_before" in notes:
-            continue
+    try:
+        msg = (
+            f"Ciao {client_name}! \n\n"
+            f"Ti ricordiamo il tuo appuntamento per *{service_name}* "
+            f"tra circa 1 ora ({hour_str}).\n\n"
+            f"Ti aspettiamo!"
+        )
+        await send_text_message(phone_number_id, access_token, to_phone, msg)
+        logger.info(f"Reminder 1h sent for appointment {appt['id']}")
+        return True
 
-        client = appt.get("client")
-        tenant = appt.get("tenant")
-        if not client or not tenant:
-            continue
-        if tenant.get("wa_mode") != "unofficial":
-            continue
-        if not client.get("reminder_morning_enabled", True):
-            continue
-        if not client.get("whatsapp_phone"):
-            continue
+    except Exception as e:
+        logger.error(f"Failed to send 1h reminder for {appt['id']}: {e}")
+        if _SENTRY:
+            sentry_sdk.capture_exception(e)
+        return False
 
-        tenant_id = tenant["id"]
-        phone = client["whatsapp_phone"]
-        client_name = client.get("name") or client.get("first_name") or ""
-        service_name = (
-            appt.get("service", {}).get("name", "Appuntamento")
-            if appt.get("service") else "Appuntamento"
-        )
-        start_at = datetime.fromisoformat(appt["start_at"].replace("Z", "+00:00"))
-        time_str = start_at.astimezone(ROME_TZ).strftime("%H:%M")
 
-        message = (
-            f"Ciao {client_name}!\n\n"
-            f"Ti ricordiamo il tuo appuntamento per *{service_name}* "
-            f"domani alle *{time_str}*.\n\n"
-            f"Ti aspettiamo! 😊"
-        )
+async def _send_reminder_day_before_one(appt: dict) -> bool:
+    """Send the day-before reminder for one appointment (unofficial WA)."""
+    client = appt["client"]
+    tenant = appt["tenant"]
 
-        success = await send_unofficial_message(tenant_id, phone, message)
-        if success:
-            new_notes = f"{notes}\n[reminder_day_before:{now_str}]".strip()
-            sb.table("appointments").update({"notes": new_notes}).eq("id", appt["id"]).execute()
-            logger.info(f"Day-before reminder sent for appointment {appt['id']}")
-        else:
-            logger.error(f"Failed to send day-before reminder for appointment {appt['id']}")
-            if _SENTRY:
-                sentry_sdk.capture_exception(
-                    Exception(f"WA unofficial send failed for appt {appt['id']}")
-                )
+    tenant_id = tenant["id"]
+    phone = client["whatsapp_phone"]
+    client_name = client.get("name") or client.get("first_name") or ""
+    service_name = nested_get(appt, "service", "name", "Appuntamento")
+    _, time_str = _format_start(appt["start_at"])
+
+    message = (
+        f"Ciao {client_name}!\n\n"
+        f"Ti ricordiamo il tuo appuntamento per *{service_name}* "
+        f"domani alle *{time_str}*.\n\n"
+        f"Ti aspettiamo! 😊"
+    )
+
+    success = await send_unofficial_message(tenant_id, phone, message)
+    if success:
+        logger.info(f"Day-before reminder sent for appointment {appt['id']}")
+    else:
+        logger.error(f"Failed to send day-before reminder for appointment {appt['id']}")
+        if _SENTRY:
+            sentry_sdk.capture_exception(
+                Exception(f"WA unofficial send failed for appt {appt['id']}")
+            )
+    return bool(success)
 
 
 # ─── Scheduler lifecycle ─────────────────────────────────────────
 
 
 def start_scheduler():
-    """Start the APScheduler with all jobs."""
+    """Start the APScheduler with all jobs (call from the app's event loop)."""
     global _scheduler
     if _scheduler is not None:
         return
 
-    _scheduler = BackgroundScheduler(timezone="Europe/Rome")
+    # Jobs are coroutines run on the application's event loop
+    _scheduler = AsyncIOScheduler(
+        timezone="Europe/Rome", event_loop=asyncio.get_running_loop()
+    )
 
     # Morning confirmation: 09:00 Rome time, every day
     _scheduler.add_job(
@@ -405,26 +488,17 @@ def start_scheduler():
         name="Morning confirmation for pending appointments",
     )
 
-    # 1h reminder (only for confirmed appointments)
-    _scheduler.add_job(
-        _job_reminder_1h,
-        "interval",
-        minutes=5,
-        id="reminder_1h",
-        name="1h appointment reminder",
-    )
-
-    # Day-before reminder (unofficial WA tenants, ogni 5 minuti)
+    # 1h + day-before reminders, one query every 5 minutes
     _scheduler.add_job(
-        _job_reminder_day_before,
+        _job_reminders,
         "interval",
         minutes=5,
-        id="reminder_day_before",
-        name="Day-before reminder (unofficial WA)",
+        id="reminders",
+        name="1h and day-before appointment reminders",
     )
 
     _scheduler.start()
-    logger.info("Scheduler started with 3 jobs: morning_confirmation (09:00), reminder_1h (every 5 min), reminder_day_before (every 5 min)")
+    logger.info("Scheduler started with 2 jobs: morning_confirmation (09:00), reminders (1h + day-before, every 5 min)")
 
 
 def stop_scheduler():
@@ -1,26 +1,125 @@
 """
 Supabase client singleton (multi-tenant, no fixed tenant_id).
 Uses service_role_key to bypass RLS.
+
+Two clients are exposed:
+- get_supabase(): sync supabase-py client (tools, scheduler, scripts)
+- get_async_supabase(): async PostgREST client for the webhook hot path,
+  so DB round-trips don't block the event loop.
 """
 
 import os
 import logging
+import threading
 
+import httpx
+import orjson
+from postgrest import AsyncPostgrestClient
 from supabase import create_client, Client
 
 logger = logging.getLogger("BOT.supabase")
 
 _client: Client | None = None
+_async_client: AsyncPostgrestClient | None = None
+_client_lock = threading.Lock()
+
+SYNC_HTTP_LIMITS = httpx.Limits(max_connections=60, max_keepalive_connections=40)
+# Worker threads for to_thread-offloaded sync queries: one per pooled connection
+SYNC_QUERY_WORKERS = SYNC_HTTP_LIMITS.max_connections
+
+ASYNC_HTTP_LIMITS = httpx.Limits(max_connections=120, max_keepalive_connections=80)
+ASYNC_HTTP_TIMEOUT = httpx.Timeout(10.0, connect=2.0)
+
+
+class _OrjsonBodyMixin:
+    """Encode json= request bodies with orjson instead of stdlib json."""
+
+    def build_request(self, method, url, *, json=None, headers=None, **kwargs):
+        if json is not None:
+            kwargs["content"] = orjson.dumps(json)
+            headers = httpx.Headers(headers)
+            headers["Content-Type"] = "application/json"
+        return super().build_request(method, url, headers=headers, **kwargs)
+
+
+class _OrjsonClient(_OrjsonBodyMixin, httpx.Client):
+    pass
+
+
+class _OrjsonAsyncClient(_OrjsonBodyMixin, httpx.AsyncClient):
+    pass
+
+
+def _get_credentials() -> tuple[str, str]:
+    url = os.getenv("SUPABASE_URL")
+    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+    if not url or not key:
+        raise ValueError("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY must be set")
+    return url, key
 
 
 def get_supabase() -> Client:
-    """Return the Supabase client singleton."""
+    """
+    Return the Supabase client singleton.
+    Built once (thread-safe) and reuses a keep-alive HTTP/2 connection pool,
+    so each call skips TCP/TLS setup and concurrent tool/scheduler threads
+    multiplex over a few connections. Request bodies are encoded with orjson.
+    """
     global _client
     if _client is None:
-        url = os.getenv("SUPABASE_URL")
-        key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-        if not url or not key:
-            raise ValueError("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY must be set")
-        _client = create_client(url, key)
-        logger.info("Supabase client initialized")
+        with _client_lock:
+            if _client is None:
+                url, key = _get_credentials()
+                client = create_client(url, key)
+                # Replace the PostgREST session with a pooled one, keeping base_url/headers
+                default_session = client.postgrest.session
+                client.postgrest.session = _OrjsonClient(
+                    base_url=default_session.base_url,
+                    headers=default_session.headers,
+                    timeout=default_session.timeout,
+                    limits=SYNC_HTTP_LIMITS,
+                    http2=True,
+                    follow_redirects=True,
+                )
+                default_session.close()
+                _client = client
+                logger.info("Supabase client initialized")
     return _client
+
+
+def get_async_supabase() -> AsyncPostgrestClient:
+    """
+    Return the async PostgREST client singleton.
+    Backed by a shared httpx.AsyncClient (HTTP/2, keep-alive pool,
+    orjson-encoded request bodies).
+    Must be used from the application event loop.
+    """
+    global _async_client
+    if _async_client is None:
+        url, key = _get_credentials()
+        client = AsyncPostgrestClient(
+            f"{url}/rest/v1",
+            headers={"apikey": key, "Authorization": f"Bearer {key}"},
+        )
+        # Swap the default session for a pooled one, keeping base_url/headers
+        default_session = client.session
+        client.session = _OrjsonAsyncClient(
+            base_url=default_session.base_url,
+            headers=default_session.headers,
+            limits=ASYNC_HTTP_LIMITS,
+            timeout=ASYNC_HTTP_TIMEOUT,
+            http2=True,
+            follow_redirects=True,
+        )
+        _async_client = client
+        logger.info("Async Supabase client initialized")
+    return _async_client
+
+
+async def close_async_supabase() -> None:
+    """Close the async client's connection pool (called on shutdown)."""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+        logger.info("Async Supabase client closed")
@@ -1,49 +1,74 @@
 """
 Resolve tenant from whatsapp_phone_number_id.
-Caches results for 15 minutes to avoid repeated DB lookups.
+Caches results for 15 minutes to avoid repeated DB lookups
+(unknown ids for 1 minute, so a misconfigured number can't hammer the DB).
 """
 
 import logging
 import time
 from typing import Optional
 
-from src.supabase_client import get_supabase
+from src.supabase_client import get_async_supabase
 
 logger = logging.getLogger("BOT.tenant")
 
-# Cache: phone_number_id -> (tenant_dict, timestamp)
-_cache: dict[str, tuple[dict, float]] = {}
+# Cache: phone_number_id -> (tenant_dict or None for "not found", monotonic timestamp)
+_cache: dict[str, tuple[Optional[dict], float]] = {}
 CACHE_TTL = 900  # 15 minutes
+MISS_CACHE_TTL = 60  # seconds
+CACHE_MAX_SIZE = 1024
+
+# Columns read downstream (webhook credentials, prompt center block)
+TENANT_COLUMNS = (
+    "id, name, phone, email, address, "
+    "whatsapp_phone_number_id, whatsapp_access_token"
+)
+
+
+def _is_fresh(tenant: Optional[dict], cached_at: float, now: float) -> bool:
+    ttl = CACHE_TTL if tenant is not None else MISS_CACHE_TTL
+    return now - cached_at < ttl
+
+
+def _cache_put(phone_number_id: str, tenant: Optional[dict], now: float) -> None:
+    if len(_cache) >= CACHE_MAX_SIZE:
+        # Drop expired entries; if still full, start over
+        for k in [k for k, (t, cached_at) in _cache.items() if not _is_fresh(t, cached_at, now)]:
+            del _cache[k]
+        if len(_cache) >= CACHE_MAX_SIZE:
+            _cache.clear()
+    _cache[phone_number_id] = (tenant, now)
 
 
 async def get_tenant_by_phone_number_id(phone_number_id: str) -> Optional[dict]:
     """
     Look up tenant by WhatsApp phone_number_id.
-    Returns the full tenant row or None.
+    Returns the tenant row (TENANT_COLUMNS) or None.
     """
-    now = time.time()
+    now = time.monotonic()
 
-    # Check cache
+    # Check cache (hits and recent misses)
     if phone_number_id in _cache:
         tenant, cached_at = _cache[phone_number_id]
-        if now - cached_at < CACHE_TTL:
+        if _is_fresh(tenant, cached_at, now):
             return tenant
 
     try:
-        sb = get_supabase()
-        response = (
-            sb.table("tenants")
-            .select("*")
+        response = await (
+            get_async_supabase().from_("tenants")
+            .select(TENANT_COLUMNS)
             .eq("whatsapp_phone_number_id", phone_number_id)
+            .limit(1)
             .execute()
         )
 
         if not response.data:
             logger.warning(f"No tenant found for phone_number_id={phone_number_id}")
+            _cache_put(phone_number_id, None, now)
             return None
 
         tenant = response.data[0]
-        _cache[phone_number_id] = (tenant, now)
+        _cache_put(phone_number_id, tenant, now)
         logger.info(f"Tenant resolved: {tenant.get('name')} (id={tenant['id']})")
         return tenant
 
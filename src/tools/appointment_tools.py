@@ -2,18 +2,58 @@
 Appointment management tools: book, list, modify, cancel.
 """
 
+import asyncio
 import logging
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
-import pytz
+from postgrest.exceptions import APIError
 
 from src.supabase_client import get_supabase
-from src.utils import format_datetime_italian, resolve_service, resolve_staff
+from src.utils import (
+    ROME_TZ,
+    escape_like,
+    format_datetime_italian,
+    is_uuid,
+    nested_get,
+    parse_iso_datetime,
+    resolve_service,
+    resolve_staff,
+    run_in_background,
+    run_query,
+)
 
 logger = logging.getLogger("BOT.tools.appointments")
 
-ROME_TZ = pytz.timezone("Europe/Rome")
+APPOINTMENTS_PAGE_SIZE = 50
+# Statuses listed by get_my_appointments (and the only ones that can be modified)
+UPCOMING_STATUSES = ("pending", "confirmed")
+
+# Postgres exclusion_violation: appointments_no_staff_overlap (migration 014)
+EXCLUSION_VIOLATION = "23P01"
+
+
+def _parse_cursor(after: str) -> Optional[tuple[str, str]]:
+    """Split a get_my_appointments cursor ("<start_at>|<id>") into (start_at, id)."""
+    start_at, _, appt_id = after.rpartition("|")
+    try:
+        start_at = parse_iso_datetime(start_at).isoformat()
+    except ValueError:
+        return None
+    return (start_at, appt_id) if is_uuid(appt_id) else None
+
+
+async def _write_audit_log(sb, tenant_id: str, action: str, target: str, meta: dict) -> None:
+    """Insert an audit_logs row; failures are logged, never raised (run in background)."""
+    try:
+        await run_query(sb.table("audit_logs").insert({
+            "tenant_id": tenant_id,
+            "action": action,
+            "target": target,
+            "meta": meta,
+        }, returning="minimal"))
+    except Exception as e:
+        logger.warning(f"Audit log failed: {e}")
 
 
 def _build_booking_result(appt_id, service, start_dt, time_str, duration, staff_name) -> dict:
@@ -32,6 +72,28 @@ def _build_booking_result(appt_id, service, start_dt, time_str, duration, staff_
     }
 
 
+def _build_modify_result(appointment_id, service_name, new_start, new_time) -> dict:
+    """Build the standard success response for a rescheduled appointment."""
+    return {
+        "success": True,
+        "appointment_id": appointment_id,
+        "service": service_name,
+        "new_date": format_datetime_italian(new_start),
+        "new_time": new_time,
+    }
+
+
+def _build_cancel_result(appointment_id, service_name, start_at) -> dict:
+    """Build the standard success response for a canceled appointment."""
+    return {
+        "success": True,
+        "appointment_id": appointment_id,
+        "service": service_name,
+        "was_scheduled_at": start_at,
+        "message": "L'appuntamento è stato cancellato con successo.",
+    }
+
+
 async def book_appointment(
     service_id: str,
     staff_id: str,
@@ -48,9 +110,47 @@ async def book_appointment(
 
     sb = get_supabase()
 
+    # Start datetime (interpret as Italian time)
+    try:
+        naive_dt = datetime.strptime(f"{date} {time}", "%Y-%m-%d %H:%M")
+        start_dt = naive_dt.replace(tzinfo=ROME_TZ)
+    except ValueError:
+        return {"error": "Formato data/orario non valido."}
+
+    # ── Resolve + book in one call via PostgreSQL RPC ────────
+    try:
+        response = await run_query(sb.rpc(
+            "book_appointment_resolved",
+            {
+                "p_tenant_id": tenant_id,
+                "p_client_id": client_id,
+                "p_service_ident": escape_like(service_id),
+                "p_staff_ident": escape_like(staff_id),
+                "p_start_at": start_dt.isoformat(),
+                "p_source": "whatsapp",
+                "p_notes": "Prenotato via WhatsApp Bot",
+            }
+        ))
+
+        if response.data:
+            result = response.data[0]
+            if result.get("success"):
+                logger.info(f"Appointment booked (resolved): {result['appointment_id']}")
+                return _build_booking_result(
+                    result["appointment_id"],
+                    {"name": result.get("service_name"), "price": result.get("price")},
+                    start_dt,
+                    time,
+                    result.get("duration_min"),
+                    result.get("staff_name") or "",
+                )
+            return {"error": result.get("error_message", "Slot non disponibile.")}
+    except Exception as e:
+        logger.warning(f"book_appointment_resolved RPC unavailable, using legacy: {e}")
+
     # Resolve service (by UUID or name)
     try:
-        service = resolve_service(sb, tenant_id, service_id)
+        service = await asyncio.to_thread(resolve_service, sb, tenant_id, service_id)
         if not service:
             return {"error": "Servizio non trovato."}
         service_id = service["id"]  # Real UUID
@@ -60,7 +160,7 @@ async def book_appointment(
 
     # Resolve staff (by UUID or name)
     try:
-        staff = resolve_staff(sb, tenant_id, staff_id)
+        staff = await asyncio.to_thread(resolve_staff, sb, tenant_id, staff_id)
         if not staff:
             return {"error": "Operatore non trovato."}
         staff_id = staff["id"]  # Real UUID
@@ -68,17 +168,11 @@ async def book_appointment(
     except Exception as e:
         return {"error": f"Errore recupero operatore: {e}"}
 
-    # Build start/end datetimes (interpret as Italian time)
-    try:
-        naive_dt = datetime.strptime(f"{date} {time}", "%Y-%m-%d %H:%M")
-        start_dt = ROME_TZ.localize(naive_dt)
-        end_dt = start_dt + timedelta(minutes=duration)
-    except ValueError:
-        return {"error": "Formato data/orario non valido."}
+    end_dt = start_dt + timedelta(minutes=duration)
 
     # ── Atomic booking via PostgreSQL RPC ────────────────────
     try:
-        response = sb.rpc(
+        response = await run_query(sb.rpc(
             "book_appointment_atomic",
             {
                 "p_tenant_id": tenant_id,
@@ -90,7 +184,7 @@ async def book_appointment(
                 "p_source": "whatsapp",
                 "p_notes": "Prenotato via WhatsApp Bot",
             }
-        ).execute()
+        ))
 
         if response.data and len(response.data) > 0:
             result = response.data[0]
@@ -104,22 +198,7 @@ async def book_appointment(
     except Exception as e:
         logger.warning(f"Atomic booking RPC unavailable, using legacy: {e}")
 
-    # ── Legacy fallback (check-then-insert) ──────────────────
-    try:
-        overlap = (
-            sb.table("appointments")
-            .select("id")
-            .eq("staff_id", staff_id)
-            .in_("status", ["pending", "confirmed", "in_service"])
-            .lt("start_at", end_dt.isoformat())
-            .gt("end_at", start_dt.isoformat())
-            .execute()
-        )
-        if overlap.data:
-            return {"error": "Lo slot selezionato non è più disponibile. Per favore verifica la disponibilità aggiornata."}
-    except Exception as e:
-        logger.warning(f"Overlap check failed: {e}")
-
+    # ── Legacy fallback (plain insert, overlap constraint) ───
     try:
         appt_data = {
             "tenant_id": tenant_id,
@@ -133,7 +212,7 @@ async def book_appointment(
             "notes": "Prenotato via WhatsApp Bot",
         }
 
-        response = sb.table("appointments").insert(appt_data).execute()
+        response = await run_query(sb.table("appointments").insert(appt_data))
 
         if response.data:
             appt = response.data[0]
@@ -142,6 +221,11 @@ async def book_appointment(
                 appt["id"], service, start_dt, time, duration, staff_name
             )
 
+    except APIError as e:
+        if e.code == EXCLUSION_VIOLATION:
+            return {"error": "Lo slot selezionato non è più disponibile. Per favore verifica la disponibilità aggiornata."}
+        logger.error(f"book_appointment error: {e}")
+        return {"error": "Errore durante la prenotazione. Riprova."}
     except Exception as e:
         logger.error(f"book_appointment error: {e}")
         return {"error": "Errore durante la prenotazione. Riprova."}
@@ -150,44 +234,65 @@ async def book_appointment(
 
 
 async def get_my_appointments(
+    after: Optional[str] = None,
     *,
     tenant_id: str,
     client_id: Optional[str] = None,
     **kwargs,
 ) -> dict:
-    """Get future appointments for the current client."""
+    """
+    Get future appointments for the current client, APPOINTMENTS_PAGE_SIZE at a time.
+    `after` is the next_cursor of the previous page (keyset on start_at, id:
+    appointments sharing a start_at are never skipped across pages).
+    """
     if not client_id:
         return {"error": "Cliente non identificato."}
 
+    cursor = None
+    if after:
+        cursor = _parse_cursor(after)
+        if not cursor:
+            return {"error": "Cursore di paginazione non valido."}
+
     sb = get_supabase()
     now = datetime.now(timezone.utc).isoformat()
 
     try:
-        response = (
+        query = (
             sb.table("appointments")
-            .select("id, start_at, end_at, status, notes, service:services(name, duration_min, price), staff:staff(name)")
+            .select("id, start_at, status, service:services(name, price), staff:staff(name)")
             .eq("tenant_id", tenant_id)
             .eq("client_id", client_id)
-            .in_("status", ["pending", "confirmed"])
+            .in_("status", UPCOMING_STATUSES)
             .gte("start_at", now)
-            .order("start_at")
-            .execute()
+        )
+        if cursor:
+            start_at, appt_id = cursor
+            query = query.or_(
+                f'start_at.gt."{start_at}",and(start_at.eq."{start_at}",id.gt.{appt_id})'
+            )
+        response = await run_query(
+            query.order("start_at").order("id").limit(APPOINTMENTS_PAGE_SIZE)
         )
 
         appointments = []
         for appt in response.data:
-            start = datetime.fromisoformat(appt["start_at"].replace("Z", "+00:00")).astimezone(ROME_TZ)
+            start = parse_iso_datetime(appt["start_at"]).astimezone(ROME_TZ)
             appointments.append({
                 "id": appt["id"],
                 "date": format_datetime_italian(start),
-                "time": start.strftime("%H:%M"),
+                "time": f"{start.hour:02d}:{start.minute:02d}",
                 "status": appt["status"],
-                "service": appt["service"]["name"] if appt.get("service") else "N/A",
-                "staff": appt["staff"]["name"] if appt.get("staff") else "N/A",
-                "price": float(appt["service"]["price"]) if appt.get("service", {}).get("price") else None,
+                "service": svc["name"] if (svc := appt.get("service")) else "N/A",
+                "staff": stf["name"] if (stf := appt.get("staff")) else "N/A",
+                "price": float(price) if svc and (price := svc.get("price")) else None,
             })
 
-        return {"appointments": appointments, "count": len(appointments)}
+        result = {"appointments": appointments, "count": len(appointments)}
+        if len(response.data) == APPOINTMENTS_PAGE_SIZE:
+            last = response.data[-1]
+            result["next_cursor"] = f"{last['start_at']}|{last['id']}"
+        return result
 
     except Exception as e:
         logger.error(f"get_my_appointments error: {e}")
@@ -209,15 +314,48 @@ async def modify_appointment(
 
     sb = get_supabase()
 
-    # Verify ownership (needed for both atomic and legacy paths)
     try:
-        appt_resp = (
+        naive_dt = datetime.strptime(f"{new_date} {new_time}", "%Y-%m-%d %H:%M")
+        new_start = naive_dt.replace(tzinfo=ROME_TZ)
+    except ValueError:
+        return {"error": "Formato data/orario non valido."}
+
+    now = datetime.now(ROME_TZ)
+    if new_start < now:
+        return {"error": "Non è possibile spostare nel passato."}
+
+    # ── Verify + move + audit in one call via PostgreSQL RPC ──
+    try:
+        response = await run_query(sb.rpc(
+            "reschedule_appointment_atomic",
+            {
+                "p_appointment_id": appointment_id,
+                "p_client_id": client_id,
+                "p_tenant_id": tenant_id,
+                "p_new_start_at": new_start.isoformat(),
+                "p_source": "whatsapp",
+            }
+        ))
+
+        if response.data:
+            result = response.data[0]
+            if result.get("success"):
+                logger.info(f"Appointment modified (atomic): {appointment_id}")
+                return _build_modify_result(
+                    appointment_id, result.get("service_name") or "", new_start, new_time
+                )
+            return {"error": result.get("error_message", "Impossibile modificare.")}
+    except Exception as e:
+        logger.warning(f"reschedule_appointment_atomic RPC unavailable, using legacy: {e}")
+
+    # Verify ownership (needed for both fallback paths)
+    try:
+        appt_resp = await run_query(
             sb.table("appointments")
-            .select("*, service:services(duration_min, name)")
+            .select("status, notes, service:services(duration_min, name)")
             .eq("id", appointment_id)
             .eq("client_id", client_id)
             .eq("tenant_id", tenant_id)
-            .execute()
         )
 
         if not appt_resp.data:
@@ -225,28 +363,19 @@ async def modify_appointment(
 
         appt = appt_resp.data[0]
 
-        if appt["status"] not in ("pending", "confirmed"):
+        if appt["status"] not in UPCOMING_STATUSES:
             return {"error": f"Impossibile modificare un appuntamento con stato '{appt['status']}'."}
 
     except Exception as e:
         return {"error": f"Errore verifica appuntamento: {e}"}
 
-    duration = appt.get("service", {}).get("duration_min", 30) if appt.get("service") else 30
-    service_name = appt.get("service", {}).get("name", "") if appt.get("service") else ""
-
-    try:
-        naive_dt = datetime.strptime(f"{new_date} {new_time}", "%Y-%m-%d %H:%M")
-        new_start = ROME_TZ.localize(naive_dt)
-        new_end = new_start + timedelta(minutes=duration)
-    except ValueError:
-        return {"error": "Formato data/orario non valido."}
-
-    if new_start < datetime.now(ROME_TZ):
-        return {"error": "Non è possibile spostare nel passato."}
+    duration = nested_get(appt, "service", "duration_min", 30)
+    service_name = nested_get(appt, "service", "name", "")
+    new_end = new_start + timedelta(minutes=duration)
 
     # ── Atomic modify via PostgreSQL RPC ─────────────────────
     try:
-        response = sb.rpc(
+        response = await run_query(sb.rpc(
             "modify_appointment_atomic",
             {
                 "p_appointment_id": appointment_id,
@@ -256,82 +385,52 @@ async def modify_appointment(
                 "p_new_end_at": new_end.isoformat(),
                 "p_source": "whatsapp",
             }
-        ).execute()
+        ))
 
         if response.data and len(response.data) > 0:
             result = response.data[0]
             if result.get("success"):
                 logger.info(f"Appointment modified (atomic): {appointment_id}")
-                # Audit log
-                try:
-                    sb.table("audit_logs").insert({
-                        "tenant_id": tenant_id,
-                        "action": "appointment_rescheduled",
-                        "target": appointment_id,
-                        "meta": {"new_start": new_start.isoformat(), "source": "whatsapp"},
-                    }).execute()
-                except Exception as e:
-                    logger.warning(f"Audit log failed: {e}")
-                return {
-                    "success": True,
-                    "appointment_id": appointment_id,
-                    "service": service_name,
-                    "new_date": format_datetime_italian(new_start),
-                    "new_time": new_time,
-                }
+                run_in_background(_write_audit_log(
+                    sb,
+                    tenant_id,
+                    "appointment_rescheduled",
+                    appointment_id,
+                    {"new_start": new_start.isoformat(), "source": "whatsapp"},
+                ))
+                return _build_modify_result(appointment_id, service_name, new_start, new_time)
             else:
                 return {"error": result.get("error_message", "Impossibile modificare.")}
     except Exception as e:
         logger.warning(f"Atomic modify RPC unavailable, using legacy: {e}")
 
-    # ── Legacy fallback ──────────────────────────────────────
-    staff_id = appt["staff_id"]
-    try:
-        overlap = (
-            sb.table("appointments")
-            .select("id")
-            .eq("staff_id", staff_id)
-            .in_("status", ["pending", "confirmed", "in_service"])
-            .neq("id", appointment_id)
-            .lt("start_at", new_end.isoformat())
-            .gt("end_at", new_start.isoformat())
-            .execute()
-        )
-        if overlap.data:
-            return {"error": "Il nuovo orario non è disponibile."}
-    except Exception as e:
-        logger.warning(f"Overlap check failed: {e}")
-
+    # ── Legacy fallback (plain update, overlap constraint) ───
     try:
-        sb.table("appointments").update({
+        await run_query(sb.table("appointments").update({
             "start_at": new_start.isoformat(),
             "end_at": new_end.isoformat(),
             "status": "pending",
-            "notes": f"{appt.get('notes', '') or ''}\nSpostato via WhatsApp il {datetime.now().strftime('%d/%m/%Y %H:%M')}".strip(),
-            "updated_at": datetime.now(timezone.utc).isoformat(),
-        }).eq("id", appointment_id).execute()
-
-        # Audit log
-        try:
-            sb.table("audit_logs").insert({
-                "tenant_id": tenant_id,
-                "action": "appointment_rescheduled",
-                "target": appointment_id,
-                "meta": {"new_start": new_start.isoformat(), "source": "whatsapp"},
-            }).execute()
-        except Exception as e:
-            logger.warning(f"Audit log failed: {e}")
+            "notes": f"{appt.get('notes', '') or ''}\nSpostato via WhatsApp il {now.strftime('%d/%m/%Y %H:%M')}".strip(),
+            "updated_at": now.isoformat(),
+        }, returning="minimal").eq("id", appointment_id))
+
+        run_in_background(_write_audit_log(
+            sb,
+            tenant_id,
+            "appointment_rescheduled",
+            appointment_id,
+            {"new_start": new_start.isoformat(), "source": "whatsapp"},
+        ))
 
         logger.info(f"Appointment modified (legacy): {appointment_id}")
 
-        return {
-            "success": True,
-            "appointment_id": appointment_id,
-            "service": service_name,
-            "new_date": format_datetime_italian(new_start),
-            "new_time": new_time,
-        }
+        return _build_modify_result(appointment_id, service_name, new_start, new_time)
 
+    except APIError as e:
+        if e.code == EXCLUSION_VIOLATION:
+            return {"error": "Il nuovo orario non è disponibile."}
+        logger.error(f"modify_appointment error: {e}")
+        return {"error": "Errore durante la modifica. Riprova."}
     except Exception as e:
         logger.error(f"modify_appointment error: {e}")
         return {"error": "Errore durante la modifica. Riprova."}
@@ -350,15 +449,37 @@ async def cancel_appointment(
 
     sb = get_supabase()
 
-    # Verify ownership
+    # ── Verify + cancel + audit in one call via PostgreSQL RPC ──
+    try:
+        response = await run_query(sb.rpc(
+            "cancel_appointment_atomic",
+            {
+                "p_appointment_id": appointment_id,
+                "p_client_id": client_id,
+                "p_tenant_id": tenant_id,
+                "p_source": "whatsapp",
+            }
+        ))
+
+        if response.data:
+            result = response.data[0]
+            if result.get("success"):
+                logger.info(f"Appointment {appointment_id} canceled (atomic)")
+                return _build_cancel_result(
+                    appointment_id, result.get("service_name") or "", result.get("start_at") or ""
+                )
+            return {"error": result.get("error_message", "Impossibile cancellare.")}
+    except Exception as e:
+        logger.warning(f"cancel_appointment_atomic RPC unavailable, using legacy: {e}")
+
+    # ── Legacy fallback (verify, cancel, audit) ──────────────
     try:
-        appt_resp = (
+        appt_resp = await run_query(
             sb.table("appointments")
-            .select("*, service:services(name)")
+            .select("status, notes, start_at, service:services(name)")
             .eq("id", appointment_id)
             .eq("client_id", client_id)
             .eq("tenant_id", tenant_id)
-            .execute()
         )
 
         if not appt_resp.data:
@@ -373,36 +494,28 @@ async def cancel_appointment(
         return {"error": f"Errore verifica appuntamento: {e}"}
 
     # Cancel
+    now = datetime.now(ROME_TZ)
     try:
-        sb.table("appointments").update({
+        await run_query(sb.table("appointments").update({
             "status": "canceled",
-            "notes": f"{appt.get('notes', '') or ''}\nCancellato via WhatsApp il {datetime.now().strftime('%d/%m/%Y %H:%M')}".strip(),
-            "updated_at": datetime.now(timezone.utc).isoformat(),
-        }).eq("id", appointment_id).execute()
-
-        # Audit log
-        try:
-            sb.table("audit_logs").insert({
-                "tenant_id": tenant_id,
-                "action": "appointment_canceled",
-                "target": appointment_id,
-                "meta": {"source": "whatsapp"},
-            }).execute()
-        except Exception as e:
-            logger.warning(f"Audit log failed: {e}")
-
-        service_name = appt.get("service", {}).get("name", "") if appt.get("service") else ""
+            "notes": f"{appt.get('notes', '') or ''}\nCancellato via WhatsApp il {now.strftime('%d/%m/%Y %H:%M')}".strip(),
+            "updated_at": now.isoformat(),
+        }, returning="minimal").eq("id", appointment_id))
+
+        run_in_background(_write_audit_log(
+            sb,
+            tenant_id,
+            "appointment_canceled",
+            appointment_id,
+            {"source": "whatsapp"},
+        ))
+
+        service_name = nested_get(appt, "service", "name", "")
         start_at = appt.get("start_at", "")
 
         logger.info(f"Appointment {appointment_id} canceled")
 
-        return {
-            "success": True,
-            "appointment_id": appointment_id,
-            "service": service_name,
-            "was_scheduled_at": start_at,
-            "message": "L'appuntamento è stato cancellato con successo.",
-        }
+        return _build_cancel_result(appointment_id, service_name, start_at)
 
     except Exception as e:
         logger.error(f"cancel_appointment error: {e}")
@@ -423,13 +536,12 @@ async def confirm_appointment(
     sb = get_supabase()
 
     try:
-        appt_resp = (
+        appt_resp = await run_query(
             sb.table("appointments")
             .select("id, status, notes, service:services(name)")
             .eq("id", appointment_id)
             .eq("client_id", client_id)
             .eq("tenant_id", tenant_id)
-            .execute()
         )
 
         if not appt_resp.data:
@@ -443,24 +555,23 @@ async def confirm_appointment(
     except Exception as e:
         return {"error": f"Errore verifica appuntamento: {e}"}
 
+    now_utc = datetime.now(timezone.utc)
     try:
-        sb.table("appointments").update({
+        await run_query(sb.table("appointments").update({
             "status": "confirmed",
-            "notes": f"{appt.get('notes', '') or ''}\n[confirmed_by_client:{datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M')}]".strip(),
-            "updated_at": datetime.now(timezone.utc).isoformat(),
-        }).eq("id", appointment_id).execute()
-
-        try:
-            sb.table("audit_logs").insert({
-                "tenant_id": tenant_id,
-                "action": "appointment_confirmed_by_client",
-                "target": appointment_id,
-                "meta": {"source": "whatsapp"},
-            }).execute()
-        except Exception as e:
-            logger.warning(f"Audit log failed: {e}")
-
-        service_name = appt.get("service", {}).get("name", "") if appt.get("service") else ""
+            "notes": f"{appt.get('notes', '') or ''}\n[confirmed_by_client:{now_utc.strftime('%Y-%m-%d %H:%M')}]".strip(),
+            "updated_at": now_utc.isoformat(),
+        }, returning="minimal").eq("id", appointment_id))
+
+        run_in_background(_write_audit_log(
+            sb,
+            tenant_id,
+            "appointment_confirmed_by_client",
+            appointment_id,
+            {"source": "whatsapp"},
+        ))
+
+        service_name = nested_get(appt, "service", "name", "")
         logger.info(f"Appointment {appointment_id} confirmed by client")
 
         return {
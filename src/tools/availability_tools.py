@@ -4,19 +4,80 @@ Cross-references working_hours, existing appointments, and closures
 to compute free time slots.
 """
 
+import asyncio
 import logging
 from datetime import datetime, date, timedelta, time, timezone
 from typing import Optional
 
-import pytz
-
 from src.supabase_client import get_supabase
-from src.utils import resolve_service, resolve_staff
+from src.utils import ROME_TZ, parse_iso_datetime, resolve_service, resolve_staff, run_query
 
 logger = logging.getLogger("BOT.tools.availability")
 
 DEFAULT_SLOT_MINUTES = 30  # slot granularity
-ROME_TZ = pytz.timezone("Europe/Rome")
+MINUTES_PER_DAY = 24 * 60
+# Appointment statuses that occupy a slot (same set as the overlap constraint)
+ACTIVE_STATUSES = ("pending", "confirmed", "in_service")
+
+
+def _to_minutes(t: time) -> int:
+    """Minutes since midnight."""
+    return t.hour * 60 + t.minute
+
+
+def _hhmm_to_minutes(value: str) -> int:
+    """'HH:MM[:SS]' (Postgres TIME) -> minutes since midnight, without strptime."""
+    return int(value[:2]) * 60 + int(value[3:5])
+
+
+def _format_minutes(m: int) -> str:
+    """Minutes since midnight -> 'HH:MM'."""
+    return f"{m // 60:02d}:{m % 60:02d}"
+
+
+def _free_slot_starts(
+    booked: list[tuple[int, int]],
+    wh_start: int,
+    wh_end: int,
+    duration: int,
+    earliest: int = 0,
+) -> list[int]:
+    """
+    Start minutes of the free slots of `duration` in [wh_start, wh_end].
+
+    Slots sit on the DEFAULT_SLOT_MINUTES grid anchored at wh_start and
+    must not overlap any booked (start, end) range. `booked` must be
+    sorted by start; the free gaps are found in a single sweep.
+    """
+    starts = []
+    gap_start = wh_start
+    for b_start, b_end in [*booked, (wh_end, wh_end)]:
+        if b_end <= gap_start:
+            continue
+        gap_end = min(b_start, wh_end)
+        # First grid slot inside the gap and not in the past
+        lo = max(gap_start, earliest)
+        first = wh_start + -(-(lo - wh_start) // DEFAULT_SLOT_MINUTES) * DEFAULT_SLOT_MINUTES
+        starts.extend(range(first, gap_end - duration + 1, DEFAULT_SLOT_MINUTES))
+        gap_start = max(gap_start, b_end)
+        if gap_start >= wh_end:
+            break
+    return starts
+
+
+async def _no_result() -> None:
+    return None
+
+
+async def _fetch_staff_rows(sb, tenant_id: str, staff_id: Optional[str]) -> list[dict]:
+    """The requested staff member (UUID or name), or all active staff."""
+    if staff_id:
+        resolved = await asyncio.to_thread(resolve_staff, sb, tenant_id, staff_id)
+        return [{"id": resolved["id"], "name": resolved["name"]}] if resolved else []
+    response = await run_query(
+        sb.table("staff").select("id, name").eq("tenant_id", tenant_id).eq("is_active", True)
+    )
+    return response.data or []
 
 
 async def check_availability(
@@ -42,30 +103,33 @@ async def check_availability(
     if target_date < today:
         return {"error": "Non è possibile prenotare nel passato."}
 
-    # Determine service duration
-    service_duration = DEFAULT_SLOT_MINUTES
-    service_name = None
-    if service_id:
-        try:
-            svc = resolve_service(sb, tenant_id, service_id)
-            if svc:
-                service_duration = svc.get("duration_min", DEFAULT_SLOT_MINUTES)
-                service_name = svc.get("name")
-                service_id = svc["id"]  # Ensure we have the real UUID
-        except Exception:
-            pass
-
     weekday = target_date.weekday()  # 0=Monday
 
-    # Check closures (tenant-wide or staff-specific for the date)
-    try:
-        closures = (
+    # Service, closures and staff are independent lookups: run them concurrently
+    svc, closures, staff_rows = await asyncio.gather(
+        asyncio.to_thread(resolve_service, sb, tenant_id, service_id) if service_id else _no_result(),
+        run_query(
             sb.table("closures")
-            .select("*")
+            .select("staff_id, reason")
             .eq("tenant_id", tenant_id)
             .eq("date", target_date.isoformat())
-            .execute()
-        )
+        ),
+        _fetch_staff_rows(sb, tenant_id, staff_id),
+        return_exceptions=True,
+    )
+
+    # Determine service duration
+    service_duration = DEFAULT_SLOT_MINUTES
+    service_name = None
+    if svc and not isinstance(svc, Exception):
+        service_duration = svc.get("duration_min", DEFAULT_SLOT_MINUTES)
+        service_name = svc.get("name")
+        service_id = svc["id"]  # Ensure we have the real UUID
+
+    # Check closures (tenant-wide or staff-specific for the date)
+    if isinstance(closures, Exception):
+        closed_staff_ids = set()
+    else:
         # If there's a closure without staff_id, the whole center is closed
         for closure in (closures.data or []):
             if not closure.get("staff_id"):
@@ -76,117 +140,107 @@ async def check_availability(
                     "slots": [],
                 }
         closed_staff_ids = {c["staff_id"] for c in (closures.data or []) if c.get("staff_id")}
-    except Exception:
-        closed_staff_ids = set()
 
-    # Get staff members to check
-    try:
-        if staff_id:
-            resolved = resolve_staff(sb, tenant_id, staff_id)
-            if resolved:
-                staff_list = type("R", (), {"data": [{"id": resolved["id"], "name": resolved["name"]}]})()
-            else:
-                staff_list = type("R", (), {"data": []})()
-        else:
-            staff_list = sb.table("staff").select("id, name").eq("tenant_id", tenant_id).eq("is_active", True).execute()
-    except Exception as e:
-        logger.error(f"Error fetching staff: {e}")
+    if isinstance(staff_rows, Exception):
+        logger.error(f"Error fetching staff: {staff_rows}")
         return {"error": "Impossibile verificare la disponibilità"}
 
-    if not staff_list.data:
+    if not staff_rows:
         return {"date": date, "available": False, "reason": "Nessun operatore disponibile", "slots": []}
 
-    all_available_slots = []
+    # Skip past slots for today: first bookable minute of the day
+    if target_date == today:
+        now = datetime.now(ROME_TZ)
+        earliest = now.hour * 60 + now.minute + 1
+    else:
+        earliest = 0
+
+    staff_members = [s for s in staff_rows if s["id"] not in closed_staff_ids]
+    staff_ids = [s["id"] for s in staff_members]
+    if not staff_ids:
+        return {"date": date, "available": False, "reason": "Nessun operatore disponibile", "slots": []}
 
-    for staff_member in staff_list.data:
+    # Working hours and the day's appointments for all staff at once
+    day_start = datetime.combine(target_date, time.min, tzinfo=ROME_TZ).isoformat()
+    day_end = datetime.combine(target_date + timedelta(days=1), time.min, tzinfo=ROME_TZ).isoformat()
+
+    wh_response, appts_response = await asyncio.gather(
+        run_query(
+            sb.table("working_hours")
+            .select("staff_id, start_time, end_time")
+            .in_("staff_id", staff_ids)
+            .eq("weekday", weekday)
+        ),
+        run_query(
+            sb.table("appointments")
+            .select("staff_id, start_at, end_at")
+            .in_("staff_id", staff_ids)
+            .in_("status", ACTIVE_STATUSES)
+            .gte("start_at", day_start)
+            .lt("start_at", day_end)
+        ),
+        return_exceptions=True,
+    )
+    if isinstance(wh_response, Exception):
+        logger.error(f"Error fetching working hours: {wh_response}")
+        return {"error": "Impossibile verificare la disponibilità"}
+    if isinstance(appts_response, Exception):
+        logger.warning(f"Error fetching appointments: {appts_response}")
+        appt_rows = []
+    else:
+        appt_rows = appts_response.data
+
+    hours_by_staff: dict[str, list[dict]] = {}
+    for wh in wh_response.data:
+        hours_by_staff.setdefault(wh["staff_id"], []).append(wh)
+    appts_by_staff: dict[str, list[dict]] = {}
+    for appt in appt_rows:
+        appts_by_staff.setdefault(appt["staff_id"], []).append(appt)
+
+    # (start_min, staff_id, staff_name): formatted only after sorting
+    free_slots: list[tuple[int, str, str]] = []
+
+    for staff_member in staff_members:
         sid = staff_member["id"]
         sname = staff_member.get("name", "")
 
-        # Skip staff with a closure for this date
-        if sid in closed_staff_ids:
-            continue
-
-        # Get working hours for this weekday
-        try:
-            wh_response = (
-                sb.table("working_hours")
-                .select("start_time, end_time")
-                .eq("staff_id", sid)
-                .eq("weekday", weekday)
-                .execute()
-            )
-        except Exception:
-            continue
-
-        if not wh_response.data:
+        staff_hours = hours_by_staff.get(sid)
+        if not staff_hours:
             continue  # Staff doesn't work this day
 
-        # Get existing appointments for the day
-        day_start = datetime.combine(target_date, time.min).isoformat()
-        day_end = datetime.combine(target_date + timedelta(days=1), time.min).isoformat()
-
-        try:
-            appts_response = (
-                sb.table("appointments")
-                .select("start_at, end_at")
-                .eq("staff_id", sid)
-                .in_("status", ["pending", "confirmed", "in_service"])
-                .gte("start_at", day_start)
-                .lt("start_at", day_end)
-                .order("start_at")
-                .execute()
-            )
-        except Exception:
-            appts_response = type("R", (), {"data": []})()
-
+        # Booked ranges as minutes since midnight, sorted by start
         booked_intervals = []
-        for appt in appts_response.data:
+        for appt in appts_by_staff.get(sid, []):
             try:
-                a_start = datetime.fromisoformat(appt["start_at"].replace("Z", "+00:00")).astimezone(ROME_TZ)
-                a_end = datetime.fromisoformat(appt["end_at"].replace("Z", "+00:00")).astimezone(ROME_TZ)
-                booked_intervals.append((a_start.time(), a_end.time()))
+                a_start = parse_iso_datetime(appt["start_at"]).astimezone(ROME_TZ)
+                a_end = parse_iso_datetime(appt["end_at"]).astimezone(ROME_TZ)
+                end_min = _to_minutes(a_end.time()) if a_end.date() == target_date else MINUTES_PER_DAY
+                booked_intervals.append((_to_minutes(a_start.time()), end_min))
             except Exception:
                 pass
+        booked_intervals.sort()
 
         # Compute free slots for each working hour range
-        for wh in wh_response.data:
-            wh_start = datetime.strptime(wh["start_time"][:5], "%H:%M").time()
-            wh_end = datetime.strptime(wh["end_time"][:5], "%H:%M").time()
-
-            # Generate slots
-            current = datetime.combine(target_date, wh_start)
-            end_boundary = datetime.combine(target_date, wh_end)
-
-            while current + timedelta(minutes=service_duration) <= end_boundary:
-                slot_start = current.time()
-                slot_end = (current + timedelta(minutes=service_duration)).time()
-
-                # Skip past slots for today
-                if target_date == today:
-                    now_time = datetime.now(ROME_TZ).time()
-                    if slot_start <= now_time:
-                        current += timedelta(minutes=DEFAULT_SLOT_MINUTES)
-                        continue
-
-                # Check overlap with booked intervals
-                is_free = True
-                for b_start, b_end in booked_intervals:
-                    if slot_start < b_end and slot_end > b_start:
-                        is_free = False
-                        break
-
-                if is_free:
-                    all_available_slots.append({
-                        "time": slot_start.strftime("%H:%M"),
-                        "end_time": slot_end.strftime("%H:%M"),
-                        "staff_id": sid,
-                        "staff_name": sname,
-                    })
-
-                current += timedelta(minutes=DEFAULT_SLOT_MINUTES)
-
-    # Sort by time
-    all_available_slots.sort(key=lambda s: s["time"])
+        for wh in staff_hours:
+            wh_start = _hhmm_to_minutes(wh["start_time"])
+            wh_end = _hhmm_to_minutes(wh["end_time"])
+
+            free_slots.extend(
+                (start, sid, sname)
+                for start in _free_slot_starts(booked_intervals, wh_start, wh_end, service_duration, earliest)
+            )
+
+    # Sort by time (stable: staff order kept within the same time)
+    free_slots.sort(key=lambda slot: slot[0])
+    all_available_slots = [
+        {
+            "time": _format_minutes(start),
+            "end_time": _format_minutes(start + service_duration),
+            "staff_id": sid,
+            "staff_name": sname,
+        }
+        for start, sid, sname in free_slots
+    ]
 
     result = {
         "date": date,
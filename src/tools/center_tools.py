@@ -3,28 +3,44 @@ Tools for querying center information.
 """
 
 import logging
+import time
 from typing import Optional
 
 from src.supabase_client import get_supabase
+from src.utils import run_query
 
 logger = logging.getLogger("BOT.tools.center")
 
+# Cache: tenant_id -> (center info dict, monotonic timestamp)
+_cache: dict[str, tuple[dict, float]] = {}
+CACHE_TTL = 300  # 5 minutes
+
+# working_hours.weekday (0=Monday) -> Italian day name
+DAYS_IT = {
+    0: "Lunedì", 1: "Martedì", 2: "Mercoledì",
+    3: "Giovedì", 4: "Venerdì", 5: "Sabato", 6: "Domenica",
+}
+
 
 async def get_center_info(
     *,
     tenant_id: str,
     **kwargs,
 ) -> dict:
-    """Get general information about the beauty center."""
+    """Get general information about the beauty center (cached for CACHE_TTL)."""
+    now = time.monotonic()
+    cached = _cache.get(tenant_id)
+    if cached and now - cached[1] < CACHE_TTL:
+        return cached[0]
+
     sb = get_supabase()
 
     try:
         # Get tenant info
-        response = (
+        response = await run_query(
             sb.table("tenants")
             .select("name, phone, email, address, opening_hours, website")
             .eq("id", tenant_id)
-            .execute()
         )
 
         if not response.data:
@@ -33,32 +49,23 @@ async def get_center_info(
         tenant = response.data[0]
 
         # Get working hours summary from staff
-        wh_response = (
+        wh_response = await run_query(
             sb.table("working_hours")
             .select("weekday, start_time, end_time, staff:staff(name)")
             .eq("tenant_id", tenant_id)
             .order("weekday")
-            .execute()
         )
 
         # Aggregate opening hours
-        days_map = {
-            0: "Lunedì", 1: "Martedì", 2: "Mercoledì",
-            3: "Giovedì", 4: "Venerdì", 5: "Sabato", 6: "Domenica",
-        }
-        opening_hours = {}
+        day_ranges: dict[str, tuple[str, str]] = {}
         for wh in wh_response.data:
-            day = days_map.get(wh["weekday"], str(wh["weekday"]))
+            day = DAYS_IT.get(wh["weekday"], str(wh["weekday"]))
             start = wh["start_time"][:5]  # HH:MM
             end = wh["end_time"][:5]
-            if day not in opening_hours:
-                opening_hours[day] = f"{start}-{end}"
-            else:
-                # Extend range if needed
-                existing = opening_hours[day]
-                existing_end = existing.split("-")[1]
-                if end > existing_end:
-                    opening_hours[day] = f"{existing.split('-')[0]}-{end}"
+            prev = day_ranges.get(day)
+            # Widest range across staff: earliest start, latest end
+            day_ranges[day] = (min(prev[0], start), max(prev[1], end)) if prev else (start, end)
+        opening_hours = {day: f"{start}-{end}" for day, (start, end) in day_ranges.items()}
 
         result = {
             "name": tenant.get("name"),
@@ -73,6 +80,7 @@ async def get_center_info(
         elif tenant.get("opening_hours"):
             result["opening_hours"] = tenant["opening_hours"]
 
+        _cache[tenant_id] = (result, now)
         return result
 
     except Exception as e:
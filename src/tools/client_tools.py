@@ -6,7 +6,9 @@ import logging
 from datetime import datetime, timezone
 from typing import Optional
 
+from src.client_manager import invalidate_client_cache
 from src.supabase_client import get_supabase
+from src.utils import is_full_name, run_query
 
 logger = logging.getLogger("BOT.tools.clients")
 
@@ -27,17 +29,17 @@ async def update_client_name(
         return {"error": "Nome non valido."}
 
     # Validazione: almeno 2 parole composte da lettere (nome + cognome)
-    name_parts = [p for p in full_name.split() if p.isalpha()]
-    if len(name_parts) < 2:
+    if not is_full_name(full_name):
         return {"error": "Serve nome e cognome completo (es. 'Maria Rossi'). Richiedi nuovamente."}
 
     sb = get_supabase()
 
     try:
-        sb.table("clients").update({
+        await run_query(sb.table("clients").update({
             "name": full_name,
             "updated_at": datetime.now(timezone.utc).isoformat(),
-        }).eq("id", client_id).eq("tenant_id", tenant_id).execute()
+        }, returning="minimal").eq("id", client_id).eq("tenant_id", tenant_id))
+        invalidate_client_cache(client_id)
 
         logger.info(f"Client {client_id} name updated to: {full_name}")
         return {"success": True, "name": full_name}
@@ -12,6 +12,7 @@ import logging
 from typing import Optional
 
 from src.supabase_client import get_supabase
+from src.utils import escape_postgrest_like, run_query
 
 logger = logging.getLogger("BOT.tools.services")
 
@@ -28,22 +29,23 @@ async def get_services(
     try:
         query = (
             sb.table("services")
-            .select("id, name, description, descrizione_breve, category_id, duration_min, price, is_active")
+            .select("id, name, description, descrizione_breve, duration_min, price")
             .eq("tenant_id", tenant_id)
             .eq("is_active", True)
         )
 
-        response = query.order("display_order").order("name").execute()
+        response = await run_query(query.order("display_order").order("name"))
 
-        services = []
-        for s in response.data:
-            services.append({
+        services = [
+            {
                 "id": s["id"],
                 "name": s["name"],
                 "description": s.get("descrizione_breve") or s.get("description", ""),
                 "duration_minutes": s.get("duration_min"),
-                "price": float(s["price"]) if s.get("price") else None,
-            })
+                "price": float(price) if (price := s.get("price")) else None,
+            }
+            for s in response.data
+        ]
 
         return {"services": services, "count": len(services)}
 
@@ -62,13 +64,16 @@ async def get_service_info(
     sb = get_supabase()
 
     try:
-        response = (
+        response = await run_query(
             sb.table("services")
-            .select("*")
+            .select(
+                "id, name, description, descrizione_completa, duration_min, price, "
+                "benefici, controindicazioni, prodotti_utilizzati"
+            )
             .eq("tenant_id", tenant_id)
             .eq("is_active", True)
-            .ilike("name", f"%{service_name}%")
-            .execute()
+            .ilike("name", f"%{escape_postgrest_like(service_name)}%")
+            .limit(1)
         )
 
         if not response.data:
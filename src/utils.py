@@ -1,9 +1,34 @@
 """
-Utility functions: phone normalization, Italian date formatting.
+Utility functions: phone normalization, Italian date formatting,
+ISO timestamp parsing, cached service/staff resolution,
+sync query offloading, background task tracking.
 """
 
+import asyncio
+import functools
+import logging
 import re
-from datetime import datetime, date
+import sys
+import time
+from datetime import datetime, date, timezone
+from typing import Coroutine
+from zoneinfo import ZoneInfo
+
+# Fast ISO 8601 parser (optional — falls back to datetime.fromisoformat)
+try:
+    from ciso8601 import parse_datetime as _ciso_parse_datetime
+except ImportError:
+    _ciso_parse_datetime = None
+
+logger = logging.getLogger("BOT.utils")
+
+ROME_TZ = ZoneInfo("Europe/Rome")
+
+# datetime.fromisoformat accepts a trailing "Z" (and any ISO 8601 form) since 3.11
+_FROMISOFORMAT_FULL = sys.version_info >= (3, 11)
+
+# Strong references to fire-and-forget tasks (asyncio only keeps weak ones)
+_background_tasks: set[asyncio.Task] = set()
 
 
 # Italian day/month names
@@ -17,6 +42,25 @@ MESI = [
 ]
 
 
+def parse_iso_datetime(value: str) -> datetime:
+    """
+    Parse an ISO 8601 timestamp as returned by PostgREST
+    (e.g. '2025-03-14T09:30:00+00:00' or '...Z').
+    """
+    if _ciso_parse_datetime is not None:
+        try:
+            return _ciso_parse_datetime(value)
+        except ValueError:
+            pass
+    if _FROMISOFORMAT_FULL:
+        return datetime.fromisoformat(value)
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+# Characters stripped from phone numbers: whitespace (incl. NBSP), dashes, parentheses
+_PHONE_STRIP = str.maketrans("", "", " \t\n\r\v\f\u00a0\u202f-()")
+
+
 def normalize_phone(phone: str) -> str:
     """
     Normalize an Italian phone number to E.164 format.
@@ -27,7 +71,7 @@ def normalize_phone(phone: str) -> str:
         '003931234567'  -> '+3931234567'
     """
     # Strip whitespace, dashes, parentheses
-    cleaned = re.sub(r"[\s\-\(\)]+", "", phone)
+    cleaned = phone.translate(_PHONE_STRIP)
 
     # Remove leading 00 (international prefix)
     if cleaned.startswith("00"):
@@ -49,14 +93,18 @@ def normalize_phone(phone: str) -> str:
     return "+" + cleaned if not cleaned.startswith("+") else cleaned
 
 
+def utcnow_iso() -> str:
+    """Current UTC time as ISO 8601 string (call once per handler and reuse)."""
+    return datetime.now(timezone.utc).isoformat()
+
+
 def format_date_italian(d: date | None = None) -> str:
     """
     Format a date in Italian, always using Europe/Rome timezone.
     Example: 'giovedì 15 maggio 2025'
     """
     if d is None:
-        import pytz
-        d = datetime.now(pytz.timezone("Europe/Rome")).date()
+        d = datetime.now(ROME_TZ).date()
 
     giorno = GIORNI[d.weekday()]
     mese = MESI[d.month]
@@ -68,13 +116,15 @@ def format_datetime_italian(dt: datetime) -> str:
     Format a datetime in Italian, always in Europe/Rome timezone.
     Example: 'giovedì 15 maggio 2025 alle 14:30'
     """
-    import pytz
-    rome = pytz.timezone("Europe/Rome")
     if dt.tzinfo is not None:
-        dt = dt.astimezone(rome)
-    giorno = GIORNI[dt.weekday()]
-    mese = MESI[dt.month]
-    return f"{giorno} {dt.day} {mese} {dt.year} alle {dt.strftime('%H:%M')}"
+        dt = dt.astimezone(ROME_TZ)
+    return _format_datetime_parts(dt.year, dt.month, dt.day, dt.hour, dt.minute)
+
+
+@functools.lru_cache(maxsize=4096)
+def _format_datetime_parts(year: int, month: int, day: int, hour: int, minute: int) -> str:
+    giorno = GIORNI[date(year, month, day).weekday()]
+    return f"{giorno} {day} {MESI[month]} {year} alle {hour:02d}:{minute:02d}"
 
 
 def format_time_range(start: str, end: str) -> str:
@@ -82,47 +132,168 @@ def format_time_range(start: str, end: str) -> str:
     return f"dalle {start} alle {end}"
 
 
-_UUID_RE = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$", re.IGNORECASE)
+# Deletes hex digits: a canonical UUID leaves exactly its four dashes
+_UUID_HEX_STRIP = str.maketrans("", "", "0123456789abcdefABCDEF")
 
 
 def is_uuid(value: str) -> bool:
-    """Check if a string looks like a UUID."""
-    return bool(_UUID_RE.match(value))
+    """Check if a string looks like a UUID (8-4-4-4-12 hex, no regex)."""
+    return (
+        len(value) == 36
+        and value[8] == value[13] == value[18] == value[23] == "-"
+        and value.translate(_UUID_HEX_STRIP) == "----"
+    )
+
+
+def escape_like(value: str) -> str:
+    """Escape LIKE/ILIKE wildcards so user text matches literally."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def escape_postgrest_like(value: str) -> str:
+    """
+    escape_like for PostgREST like/ilike filters, where "*" is a wildcard too.
+    PostgREST turns every "*" into "%" (even after a backslash), so a literal
+    "*" can't be expressed: it becomes "_", matching exactly one character.
+    """
+    return escape_like(value).replace("*", "_")
+
+
+# Full name: at least two words of letters (any script), with internal ' or - ("D'Angelo", "Anna-Maria")
+_NAME_WORD = r"[^\W\d_]+(?:['’-][^\W\d_]+)*"
+_FULL_NAME_RE = re.compile(rf"{_NAME_WORD}(?:\s+{_NAME_WORD})+")
+
+
+def is_full_name(name: str) -> bool:
+    """Check if a string is a plausible 'nome cognome' (no emoji, digits, nicknames)."""
+    return bool(_FULL_NAME_RE.fullmatch(name.strip()))
+
+
+def nested_get(row: dict, key: str, subkey: str, default=None):
+    """row[key][subkey] for embedded PostgREST rows; default when the embed is missing/null."""
+    sub = row.get(key)
+    return sub.get(subkey, default) if sub else default
+
+
+# Columns the booking/availability tools read from resolved rows
+SERVICE_COLUMNS = "id, name, duration_min, price"
+STAFF_COLUMNS = "id, name"
+
+
+# Resolved rows: (table, tenant_id, lowercased id/name) -> (row, monotonic timestamp).
+# Only hits are cached, so a newly added service/staff member is found right away.
+_resolve_cache: dict[tuple[str, str, str], tuple[dict, float]] = {}
+RESOLVE_CACHE_TTL = 300  # 5 minutes
+RESOLVE_CACHE_MAX_SIZE = 1024
+
+
+def _resolve_cached(table: str, tenant_id: str, identifier: str, fetch) -> dict | None:
+    key = (table, tenant_id, identifier.strip().lower())
+    now = time.monotonic()
+    cached = _resolve_cache.get(key)
+    if cached and now - cached[1] < RESOLVE_CACHE_TTL:
+        return cached[0]
+
+    row = fetch()
+    if row is not None:
+        if len(_resolve_cache) >= RESOLVE_CACHE_MAX_SIZE:
+            _resolve_cache.clear()
+        _resolve_cache[key] = (row, now)
+    return row
 
 
 def resolve_service(sb, tenant_id: str, service_id_or_name: str) -> dict | None:
     """
-    Resolve a service by UUID or name.
+    Resolve a service by UUID or name (cached for RESOLVE_CACHE_TTL).
     Returns the service row dict or None.
     """
+    return _resolve_cached(
+        "services", tenant_id, service_id_or_name,
+        lambda: _fetch_service(sb, tenant_id, service_id_or_name),
+    )
+
+
+def resolve_staff(sb, tenant_id: str, staff_id_or_name: str) -> dict | None:
+    """
+    Resolve a staff member by UUID or name (cached for RESOLVE_CACHE_TTL).
+    Returns the staff row dict or None.
+    """
+    return _resolve_cached(
+        "staff", tenant_id, staff_id_or_name,
+        lambda: _fetch_staff(sb, tenant_id, staff_id_or_name),
+    )
+
+
+def _fetch_service(sb, tenant_id: str, service_id_or_name: str) -> dict | None:
     if is_uuid(service_id_or_name):
-        resp = sb.table("services").select("*").eq("id", service_id_or_name).execute()
+        resp = (
+            sb.table("services")
+            .select(SERVICE_COLUMNS)
+            .eq("id", service_id_or_name)
+            .eq("tenant_id", tenant_id)
+            .eq("is_active", True)
+            .execute()
+        )
     else:
         resp = (
             sb.table("services")
-            .select("*")
+            .select(SERVICE_COLUMNS)
             .eq("tenant_id", tenant_id)
             .eq("is_active", True)
-            .ilike("name", f"%{service_id_or_name}%")
+            .ilike("name", f"%{escape_postgrest_like(service_id_or_name)}%")
+            .limit(1)
             .execute()
         )
     return resp.data[0] if resp.data else None
 
 
-def resolve_staff(sb, tenant_id: str, staff_id_or_name: str) -> dict | None:
-    """
-    Resolve a staff member by UUID or name.
-    Returns the staff row dict or None.
-    """
+def _fetch_staff(sb, tenant_id: str, staff_id_or_name: str) -> dict | None:
     if is_uuid(staff_id_or_name):
-        resp = sb.table("staff").select("*").eq("id", staff_id_or_name).execute()
+        resp = (
+            sb.table("staff")
+            .select(STAFF_COLUMNS)
+            .eq("id", staff_id_or_name)
+            .eq("tenant_id", tenant_id)
+            .eq("is_active", True)
+            .execute()
+        )
     else:
         resp = (
             sb.table("staff")
-            .select("*")
+            .select(STAFF_COLUMNS)
             .eq("tenant_id", tenant_id)
             .eq("is_active", True)
-            .ilike("name", f"%{staff_id_or_name}%")
+            .ilike("name", f"%{escape_postgrest_like(staff_id_or_name)}%")
+            .limit(1)
             .execute()
         )
     return resp.data[0] if resp.data else None
+
+
+async def run_query(builder):
+    """
+    Execute a sync supabase-py query in a worker thread,
+    so tools don't block the event loop while waiting on PostgREST.
+    """
+    return await asyncio.to_thread(builder.execute)
+
+
+def run_in_background(coro: Coroutine) -> asyncio.Task:
+    """
+    Schedule a coroutine without awaiting it (non-critical writes).
+    The task is tracked until done so it isn't garbage-collected mid-flight.
+    """
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def drain_background_tasks() -> None:
+    """Wait for pending background tasks (called on shutdown)."""
+    if not _background_tasks:
+        return
+    results = await asyncio.gather(*_background_tasks, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning(f"Background task failed during shutdown: {result}")
@@ -4,26 +4,39 @@ GET  /webhook  -> verification challenge
 POST /webhook  -> incoming messages
 """
 
+import asyncio
 import hashlib
 import hmac
 import logging
 import os
+from collections import OrderedDict
 from typing import Optional
 
 from fastapi import APIRouter, Request, Response
 
 from src.tenant_manager import get_tenant_by_phone_number_id, invalidate_tenant_cache
 from src.client_manager import get_or_create_client
-from src.conversation_manager import get_or_create_conversation, log_message
+from src.conversation_manager import (
+    get_conversation_history,
+    get_or_create_conversation,
+    log_message,
+)
 from src.gemini_agent import process_message
 from src.whatsapp_api import (
     send_text_message,
     send_button_message,
     send_list_message,
     mark_as_read,
+    send_typing_indicator,
+)
+from src.supabase_client import get_async_supabase
+from src.utils import (
+    format_datetime_italian,
+    nested_get,
+    normalize_phone,
+    parse_iso_datetime,
+    run_in_background,
 )
-from src.supabase_client import get_supabase
-from src.utils import normalize_phone, format_datetime_italian
 
 logger = logging.getLogger("BOT.webhook")
 router = APIRouter()
@@ -35,26 +48,30 @@ try:
 except ImportError:
     _SENTRY = False
 
-# In-memory set to deduplicate messages (wa_message_id) — first-level cache
-_processed_messages: set[str] = set()
+# In-memory dedup of wa_message_id — first-level cache, insertion-ordered for FIFO eviction
+_processed_messages: OrderedDict[str, None] = OrderedDict()
 MAX_DEDUP_SIZE = 10_000
 
+# Meta app credentials: fixed for the process lifetime (env is loaded before routes are imported)
+_APP_SECRET = os.getenv("META_APP_SECRET", "").encode()
+_VERIFY_TOKEN = os.getenv("META_VERIFY_TOKEN", "")
+
 
 # ─── Helpers ──────────────────────────────────────────────────
 
 
 def _verify_signature(payload: bytes, signature_header: Optional[str]) -> bool:
     """Verify X-Hub-Signature-256 from Meta."""
-    app_secret = os.getenv("META_APP_SECRET", "")
-    if not app_secret:
+    if not _APP_SECRET:
         logger.warning("META_APP_SECRET not set, skipping signature verification")
         return True
     if not signature_header:
         return False
-    expected = "sha256=" + hmac.new(
-        app_secret.encode(), payload, hashlib.sha256
-    ).hexdigest()
-    return hmac.compare_digest(expected, signature_header)
+    scheme, _, signature = signature_header.partition("=")
+    if scheme != "sha256":
+        return False
+    expected = hmac.new(_APP_SECRET, payload, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
 
 
 def _extract_message(body: dict) -> Optional[dict]:
@@ -128,41 +145,33 @@ def _extract_message(body: dict) -> Optional[dict]:
 
 
 def _add_to_dedup_cache(wa_message_id: str):
-    """Add a message id to the in-memory dedup cache, evicting old entries if needed."""
-    _processed_messages.add(wa_message_id)
-    if len(_processed_messages) > MAX_DEDUP_SIZE:
-        to_remove = list(_processed_messages)[:MAX_DEDUP_SIZE // 2]
-        for item in to_remove:
-            _processed_messages.discard(item)
+    """Add a message id to the in-memory dedup cache, evicting the oldest entries if full."""
+    _processed_messages[wa_message_id] = None
+    _processed_messages.move_to_end(wa_message_id)
+    while len(_processed_messages) > MAX_DEDUP_SIZE:
+        _processed_messages.popitem(last=False)
 
 
-async def _is_duplicate_message(wa_message_id: str, tenant_id: Optional[str]) -> bool:
+async def _is_duplicate_message(wa_message_id: str) -> bool:
     """
-    Two-level deduplication: memory (fast) + database (persistent).
-    Survives server restarts via DB check on whatsapp_messages table.
+    Persistent deduplication: whether wa_message_id is already logged in
+    whatsapp_messages. Survives server restarts; the in-memory level is
+    checked (and claimed) by the webhook before this runs. Served by the
+    unique index on wa_message_id (migration 022).
     """
-    # Level 1: in-memory cache
-    if wa_message_id in _processed_messages:
-        logger.debug(f"Duplicate (memory): {wa_message_id}")
-        return True
-
-    # Level 2: database check
-    if tenant_id:
-        try:
-            sb = get_supabase()
-            response = (
-                sb.table("whatsapp_messages")
-                .select("id")
-                .eq("wa_message_id", wa_message_id)
-                .limit(1)
-                .execute()
-            )
-            if response.data:
-                logger.debug(f"Duplicate (database): {wa_message_id}")
-                _add_to_dedup_cache(wa_message_id)
-                return True
-        except Exception as e:
-            logger.warning(f"Dedup DB check failed, relying on memory only: {e}")
+    try:
+        response = await (
+            get_async_supabase().from_("whatsapp_messages")
+            .select("id")
+            .eq("wa_message_id", wa_message_id)
+            .limit(1)
+            .execute()
+        )
+        if response.data:
+            logger.debug(f"Duplicate (database): {wa_message_id}")
+            return True
+    except Exception as e:
+        logger.warning(f"Dedup DB check failed, relying on memory only: {e}")
 
     return False
 
@@ -190,14 +199,14 @@ async def _handle_appointment_button(
     appt_id = button_id.split("_appt_", 1)[1]
     action = button_id.split("_appt_", 1)[0]  # "confirm", "cancel", "modify"
 
-    sb = get_supabase()
+    asb = get_async_supabase()
     tenant_id = tenant["id"]
     client_id = client.get("id")
 
     # Fetch appointment and verify ownership
     try:
-        appt_resp = (
-            sb.table("appointments")
+        appt_resp = await (
+            asb.from_("appointments")
             .select("id, status, start_at, notes, service:services(name), staff:staff(name)")
             .eq("id", appt_id)
             .eq("tenant_id", tenant_id)
@@ -212,28 +221,30 @@ async def _handle_appointment_button(
         return "Appuntamento non trovato. Potrebbe essere già stato modificato o cancellato."
 
     appt = appt_resp.data[0]
-    service_name = appt.get("service", {}).get("name", "appuntamento") if appt.get("service") else "appuntamento"
+    service_name = nested_get(appt, "service", "name", "appuntamento")
 
     from datetime import datetime as dt, timezone as tz
 
+    now = dt.now(tz.utc)
+    now_str = now.strftime("%Y-%m-%d %H:%M")
+
     if action == "confirm":
         if appt["status"] != "pending":
             return f"L'appuntamento è già {appt['status']}."
         try:
-            now_str = dt.now(tz.utc).strftime("%Y-%m-%d %H:%M")
             notes = appt.get("notes") or ""
-            sb.table("appointments").update({
+            await asb.from_("appointments").update({
                 "status": "confirmed",
                 "notes": f"{notes}\n[confirmed_by_client:{now_str}]".strip(),
-                "updated_at": dt.now(tz.utc).isoformat(),
-            }).eq("id", appt_id).execute()
+                "updated_at": now.isoformat(),
+            }, returning="minimal").eq("id", appt_id).execute()
             try:
-                sb.table("audit_logs").insert({
+                await asb.from_("audit_logs").insert({
                     "tenant_id": tenant_id,
                     "action": "appointment_confirmed_by_client",
                     "target": appt_id,
                     "meta": {"source": "whatsapp_button"},
-                }).execute()
+                }, returning="minimal").execute()
             except Exception:
                 pass
             return (
@@ -248,20 +259,19 @@ async def _handle_appointment_button(
         if appt["status"] in ("canceled", "completed"):
             return f"L'appuntamento è già {appt['status']}."
         try:
-            now_str = dt.now(tz.utc).strftime("%Y-%m-%d %H:%M")
             notes = appt.get("notes") or ""
-            sb.table("appointments").update({
+            await asb.from_("appointments").update({
                 "status": "canceled",
                 "notes": f"{notes}\n[canceled_by_client:{now_str}]".strip(),
-                "updated_at": dt.now(tz.utc).isoformat(),
-            }).eq("id", appt_id).execute()
+                "updated_at": now.isoformat(),
+            }, returning="minimal").eq("id", appt_id).execute()
             try:
-                sb.table("audit_logs").insert({
+                await asb.from_("audit_logs").insert({
                     "tenant_id": tenant_id,
                     "action": "appointment_canceled_by_client",
                     "target": appt_id,
                     "meta": {"source": "whatsapp_button"},
-                }).execute()
+                }, returning="minimal").execute()
             except Exception:
                 pass
             return (
@@ -273,7 +283,7 @@ async def _handle_appointment_button(
             return "Errore durante la cancellazione. Riprova o scrivi un messaggio."
 
     elif action == "modify":
-        start_at = dt.fromisoformat(appt["start_at"].replace("Z", "+00:00"))
+        start_at = parse_iso_datetime(appt["start_at"])
         time_str = format_datetime_italian(start_at)
         return (
             f"Vuoi spostare il tuo appuntamento per *{service_name}* "
@@ -440,9 +450,7 @@ async def verify_webhook(request: Request):
     token = params.get("hub.verify_token")
     challenge = params.get("hub.challenge")
 
-    verify_token = os.getenv("META_VERIFY_TOKEN", "")
-
-    if mode == "subscribe" and token == verify_token:
+    if mode == "subscribe" and token == _VERIFY_TOKEN:
         logger.info("Webhook verified successfully")
         return Response(content=challenge, media_type="text/plain")
 
@@ -479,17 +487,30 @@ async def handle_webhook(request: Request):
     bot_phone = msg.get("display_phone_number", "")
     text = msg["text"]
 
-    # Quick in-memory dedup (fast path, before tenant resolution)
+    # Quick in-memory dedup (fast path, before tenant resolution).
+    # Claim the id right away, so a Meta retry arriving while this one is
+    # still in flight is dropped here instead of reaching the DB check.
     if wa_message_id in _processed_messages:
         logger.debug(f"Duplicate message {wa_message_id}, skipping")
         return Response(status_code=200)
+    _add_to_dedup_cache(wa_message_id)
 
     logger.info(f"Message from {sender}: {text[:80]}")
 
     try:
-        # 1. Resolve tenant
-        tenant = await get_tenant_by_phone_number_id(phone_number_id)
+        # 1. Resolve tenant + persistent dedup (DB check — survives restarts), concurrently
+        # Release the claim when the tenant can't be resolved (possibly a
+        # transient DB error), so a Meta re-delivery is processed again.
+        try:
+            tenant, is_duplicate = await asyncio.gather(
+                get_tenant_by_phone_number_id(phone_number_id),
+                _is_duplicate_message(wa_message_id),
+            )
+        except Exception:
+            _processed_messages.pop(wa_message_id, None)
+            raise
         if not tenant:
+            _processed_messages.pop(wa_message_id, None)
             logger.error(f"No tenant for phone_number_id {phone_number_id}")
             return Response(status_code=200)
 
@@ -503,27 +524,34 @@ async def handle_webhook(request: Request):
                 "name": tenant.get("name"),
             })
 
-        # Persistent dedup (DB check — survives restarts)
-        if await _is_duplicate_message(wa_message_id, tenant_id):
+        if is_duplicate:
             return Response(status_code=200)
-        _add_to_dedup_cache(wa_message_id)
-
-        # Mark as read — if 401, token may be stale: refresh from DB
-        result = await mark_as_read(phone_number_id, access_token, wa_message_id)
-        if result == "auth_error":
-            logger.info("Token expired, refreshing from DB")
-            invalidate_tenant_cache(phone_number_id)
-            tenant = await get_tenant_by_phone_number_id(phone_number_id)
-            if not tenant:
-                return Response(status_code=200)
-            access_token = tenant.get("whatsapp_access_token", "")
 
-        # 2. Identify / create client
-        client = await get_or_create_client(
+        # 2. Identify / create client (DB) while marking as read (Graph API)
+        client_task = asyncio.create_task(get_or_create_client(
             tenant_id=tenant_id,
             whatsapp_phone=sender,
             contact_name=msg.get("contact_name"),
-        )
+        ))
+
+        # Mark as read — if 401, token may be stale: refresh from DB.
+        # client_task is cancelled on every early exit, so it's never left
+        # un-awaited (and its exception never unretrieved).
+        try:
+            result = await mark_as_read(phone_number_id, access_token, wa_message_id)
+            if result == "auth_error":
+                logger.info("Token expired, refreshing from DB")
+                invalidate_tenant_cache(phone_number_id)
+                tenant = await get_tenant_by_phone_number_id(phone_number_id)
+                if not tenant:
+                    client_task.cancel()
+                    return Response(status_code=200)
+                access_token = tenant.get("whatsapp_access_token", "")
+        except BaseException:
+            client_task.cancel()
+            raise
+
+        client = await client_task
 
         if _SENTRY and client:
             sentry_sdk.set_user({
@@ -552,11 +580,20 @@ async def handle_webhook(request: Request):
             )
             return Response(status_code=200)
 
-        # 3. Get or create conversation
-        conversation = await get_or_create_conversation(
-            tenant_id=tenant_id,
-            client_id=client.get("id"),
-            client_phone=sender_normalized,
+        # 3. Get or create conversation + load history, concurrently.
+        # History is read before the inbound message is logged, so it never
+        # contains the current message (process_message appends it).
+        conversation, history = await asyncio.gather(
+            get_or_create_conversation(
+                tenant_id=tenant_id,
+                client_id=client.get("id"),
+                client_phone=sender_normalized,
+            ),
+            get_conversation_history(
+                tenant_id=tenant_id,
+                client_id=client.get("id"),
+                client_phone=client.get("whatsapp_phone", ""),
+            ) if client.get("id") else asyncio.sleep(0, result=[]),
         )
 
         # If conversation is waiting for human, don't auto-reply
@@ -574,8 +611,9 @@ async def handle_webhook(request: Request):
             )
             return Response(status_code=200)
 
-        # 4. Log user message
-        await log_message(
+        # 4. Log user message (off the critical path: overlaps with the reply;
+        # the row is timestamped as soon as the task starts, before the reply)
+        run_in_background(log_message(
             tenant_id=tenant_id,
             client_id=client.get("id"),
             direction="inbound",
@@ -584,7 +622,7 @@ async def handle_webhook(request: Request):
             content=text,
             wa_message_id=wa_message_id,
             conversation_id=conversation.get("id"),
-        )
+        ))
 
         # 4b. Handle appointment confirmation/cancel/modify buttons directly
         if msg.get("interactive") and msg["interactive"].get("type") == "button_reply":
@@ -606,12 +644,14 @@ async def handle_webhook(request: Request):
                 )
                 return Response(status_code=200)
 
-        # 5. Process with Gemini
+        # 5. Process with Gemini ("typing..." shown meanwhile, off the critical path)
+        run_in_background(send_typing_indicator(phone_number_id, access_token, wa_message_id))
         reply = await process_message(
             tenant=tenant,
             client=client,
             conversation=conversation,
             user_message=text,
+            history=history,
         )
 
         # 6. Send reply (interactive or text)
@@ -1,17 +1,78 @@
 """
 WhatsApp Cloud API client.
 Handles sending text, button, list and template messages.
+All requests share a pooled httpx.AsyncClient (HTTP/2, keep-alive).
 """
 
+import asyncio
+import functools
 import logging
+import random
 from typing import Optional
 
 import httpx
+import orjson
 
 logger = logging.getLogger("BOT.whatsapp")
 
 GRAPH_API_BASE = "https://graph.facebook.com/v21.0"
 
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+HTTP_TIMEOUT = httpx.Timeout(30.0)
+MAX_RETRIES = 3  # attempts per message when rate limited (429)
+
+# Shared pooled client. Webhook handlers and scheduler jobs all run on the
+# application event loop, which owns the client's connections.
+_client: httpx.AsyncClient | None = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the shared AsyncClient (created on first use)."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            limits=HTTP_LIMITS,
+            http2=True,
+        )
+    return _client
+
+
+async def close_whatsapp_client() -> None:
+    """Close the client connection pool (called on shutdown)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        logger.info("WhatsApp HTTP client closed")
+
+
+@functools.lru_cache(maxsize=256)
+def _auth_headers(access_token: str) -> dict:
+    """Request headers for a tenant token (built once, shared read-only)."""
+    return {
+        "Authorization": f"Bearer {access_token}",
+        "Content-Type": "application/json",
+    }
+
+
+async def _post_message(url: str, payload: dict, headers: dict) -> httpx.Response:
+    """
+    POST to the Graph API, retrying 429s with jittered exponential backoff.
+    The payload is encoded once with orjson and reused across retries.
+    """
+    client = get_http_client()
+    body = orjson.dumps(payload)
+    for attempt in range(MAX_RETRIES):
+        resp = await client.post(url, content=body, headers=headers)
+        if resp.status_code != 429 or attempt == MAX_RETRIES - 1:
+            return resp
+        # Jitter spreads out concurrent senders hitting the limit together
+        wait = random.uniform(1, 3) * 2 ** attempt
+        logger.warning(f"Rate limited, retrying in {wait:.1f}s")
+        await asyncio.sleep(wait)
+    return resp
+
 
 async def send_text_message(
     phone_number_id: str,
@@ -21,10 +82,7 @@ async def send_text_message(
 ) -> Optional[dict]:
     """Send a plain text message."""
     url = f"{GRAPH_API_BASE}/{phone_number_id}/messages"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-    }
+    headers = _auth_headers(access_token)
     payload = {
         "messaging_product": "whatsapp",
         "to": to,
@@ -32,21 +90,11 @@ async def send_text_message(
         "text": {"body": body},
     }
 
-    async with httpx.AsyncClient(timeout=30) as client:
-        for attempt in range(3):
-            resp = await client.post(url, json=payload, headers=headers)
-            if resp.status_code == 429:
-                import asyncio
-                wait = 2 ** attempt
-                logger.warning(f"Rate limited, retrying in {wait}s")
-                await asyncio.sleep(wait)
-                continue
-            if resp.status_code >= 400:
-                logger.error(f"WhatsApp API error {resp.status_code}: {resp.text}")
-                return None
-            return resp.json()
-
-    return None
+    resp = await _post_message(url, payload, headers)
+    if resp.status_code >= 400:
+        logger.error(f"WhatsApp API error {resp.status_code}: {resp.text}")
+        return None
+    return resp.json()
 
 
 async def send_button_message(
@@ -61,10 +109,7 @@ async def send_button_message(
     buttons: list of {"id": "btn_id", "title": "Label"} (max 3)
     """
     url = f"{GRAPH_API_BASE}/{phone_number_id}/messages"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-    }
+    headers = _auth_headers(access_token)
     button_rows = [
         {"type": "reply", "reply": {"id": b["id"], "title": b["title"][:20]}}
         for b in buttons[:3]
@@ -80,12 +125,11 @@ async def send_button_message(
         },
     }
 
-    async with httpx.AsyncClient(timeout=30) as client:
-        resp = await client.post(url, json=payload, headers=headers)
-        if resp.status_code >= 400:
-            logger.error(f"WhatsApp button error {resp.status_code}: {resp.text}")
-            return None
-        return resp.json()
+    resp = await _post_message(url, payload, headers)
+    if resp.status_code >= 400:
+        logger.error(f"WhatsApp button error {resp.status_code}: {resp.text}")
+        return None
+    return resp.json()
 
 
 async def send_list_message(
@@ -101,10 +145,7 @@ async def send_list_message(
     sections: [{"title": "Section", "rows": [{"id": "row_id", "title": "Row", "description": "..."}]}]
     """
     url = f"{GRAPH_API_BASE}/{phone_number_id}/messages"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-    }
+    headers = _auth_headers(access_token)
     payload = {
         "messaging_product": "whatsapp",
         "to": to,
@@ -119,12 +160,11 @@ async def send_list_message(
         },
     }
 
-    async with httpx.AsyncClient(timeout=30) as client:
-        resp = await client.post(url, json=payload, headers=headers)
-        if resp.status_code >= 400:
-            logger.error(f"WhatsApp list error {resp.status_code}: {resp.text}")
-            return None
-        return resp.json()
+    resp = await _post_message(url, payload, headers)
+    if resp.status_code >= 400:
+        logger.error(f"WhatsApp list error {resp.status_code}: {resp.text}")
+        return None
+    return resp.json()
 
 
 async def send_template_message(
@@ -137,10 +177,7 @@ async def send_template_message(
 ) -> Optional[dict]:
     """Send a pre-approved template message (required for messages outside 24h window)."""
     url = f"{GRAPH_API_BASE}/{phone_number_id}/messages"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-    }
+    headers = _auth_headers(access_token)
     template = {
         "name": template_name,
         "language": {"code": language_code},
@@ -155,12 +192,11 @@ async def send_template_message(
         "template": template,
     }
 
-    async with httpx.AsyncClient(timeout=30) as client:
-        resp = await client.post(url, json=payload, headers=headers)
-        if resp.status_code >= 400:
-            logger.error(f"WhatsApp template error {resp.status_code}: {resp.text}")
-            return None
-        return resp.json()
+    resp = await _post_message(url, payload, headers)
+    if resp.status_code >= 400:
+        logger.error(f"WhatsApp template error {resp.status_code}: {resp.text}")
+        return None
+    return resp.json()
 
 
 async def mark_as_read(
@@ -170,18 +206,41 @@ async def mark_as_read(
 ) -> Optional[str]:
     """Mark a message as read (blue ticks). Returns 'auth_error' on 401."""
     url = f"{GRAPH_API_BASE}/{phone_number_id}/messages"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-    }
+    headers = _auth_headers(access_token)
     payload = {
         "messaging_product": "whatsapp",
         "status": "read",
         "message_id": message_id,
     }
 
-    async with httpx.AsyncClient(timeout=30) as client:
-        resp = await client.post(url, json=payload, headers=headers)
-        if resp.status_code == 401:
-            return "auth_error"
+    client = get_http_client()
+    resp = await client.post(url, content=orjson.dumps(payload), headers=headers)
+    if resp.status_code == 401:
+        return "auth_error"
     return None
+
+
+async def send_typing_indicator(
+    phone_number_id: str,
+    access_token: str,
+    message_id: str,
+) -> None:
+    """
+    Show "typing..." to the user while the reply is being generated.
+    Cleared by WhatsApp when the reply arrives (or after ~25s).
+    """
+    url = f"{GRAPH_API_BASE}/{phone_number_id}/messages"
+    headers = _auth_headers(access_token)
+    payload = {
+        "messaging_product": "whatsapp",
+        "status": "read",
+        "message_id": message_id,
+        "typing_indicator": {"type": "text"},
+    }
+
+    try:
+        resp = await get_http_client().post(url, content=orjson.dumps(payload), headers=headers)
+        if resp.status_code >= 400:
+            logger.warning(f"WhatsApp typing indicator error {resp.status_code}: {resp.text}")
+    except Exception as e:
+        logger.warning(f"WhatsApp typing indicator failed: {e}")
@@ -8,6 +8,8 @@ from typing import Optional
 
 import httpx
 
+from src.whatsapp_api import get_http_client
+
 logger = logging.getLogger("BOT.whatsapp_unofficial")
 
 _WA_SERVICE_URL = os.getenv("WA_SERVICE_URL", "")
@@ -29,19 +31,18 @@ async def send_message(tenant_id: str, phone: str, message: str) -> bool:
         return False
 
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            resp = await client.post(
-                f"{_WA_SERVICE_URL}/send",
-                json={"tenantId": tenant_id, "phone": phone, "message": message},
-                headers={"X-API-Key": _WA_API_KEY, "Content-Type": "application/json"},
-            )
-            if resp.status_code == 200:
-                return True
-            logger.error(
-                f"WA service error per tenant {tenant_id}: "
-                f"HTTP {resp.status_code} — {resp.text}"
-            )
-            return False
+        resp = await get_http_client().post(
+            f"{_WA_SERVICE_URL}/send",
+            json={"tenantId": tenant_id, "phone": phone, "message": message},
+            headers={"X-API-Key": _WA_API_KEY, "Content-Type": "application/json"},
+        )
+        if resp.status_code == 200:
+            return True
+        logger.error(
+            f"WA service error per tenant {tenant_id}: "
+            f"HTTP {resp.status_code} — {resp.text}"
+        )
+        return False
     except httpx.TimeoutException:
         logger.error(f"WA service timeout per tenant {tenant_id}")
         return False